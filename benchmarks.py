@@ -0,0 +1,149 @@
+#!/usr/bin/env python
+
+"""
+Benchmarks of the Policy hot paths.
+
+Every method is timed against calendars of various sizes and weekend shapes,
+with and without business hours or a compiled table, for deltas from a day
+to 50 years. Results are written as JSON so that runs can be compared:
+
+    python benchmarks.py --output before.json
+    python benchmarks.py --compare before.json
+"""
+
+import argparse
+import itertools
+import json
+import platform
+import random
+import sys
+import timeit
+from datetime import date, datetime, time, timedelta
+
+import bizdatim
+from bizdatim import Policy, MON, WED, FRI, SAT, SUN
+
+HOLIDAYS = (10, 100, 1000, 10000)
+
+WEEKENDS = {
+    'none': (),
+    'sat-sun': (SAT, SUN),
+    'fri-sat': (FRI, SAT),
+    'sun': (SUN,),
+    'mon-wed-fri-sat-sun': (MON, WED, FRI, SAT, SUN),
+}
+
+# Business days, roughly
+DELTAS = {
+    '1d': 1,
+    '1m': 21,
+    '1y': 250,
+    '10y': 2500,
+    '50y': 12500,
+}
+
+START = date(1990, 3, 14)
+HOURS = (time(8, 30), time(18, 0))
+COMPILED_RANGE = (date(1900, 1, 1), date(2100, 12, 31))
+
+
+def make_holidays(count, seed=0):
+    """Random holidays spread over the compiled range, reproducibly."""
+    rng = random.Random(seed)
+    first = COMPILED_RANGE[0].toordinal()
+    last = COMPILED_RANGE[1].toordinal()
+    return [date.fromordinal(ordinal) for ordinal in rng.sample(range(first, last), count)]
+
+
+def make_calls(policy, delta):
+    """The calls to time, by method name, for a delta in business days."""
+    day = START
+    moment = datetime.combine(START, time(10, 15))
+    # Calendar days spanning about delta business days
+    other = START + timedelta(days=delta * 7 // 5)
+    ordinal, other_ordinal = day.toordinal(), other.toordinal()
+    return {
+        'add': lambda: policy.add(moment, timedelta(days=delta, hours=3)),
+        'add_days': lambda: policy.add_days(day, delta),
+        'add_seconds': lambda: policy.add_seconds(moment, delta * 8 * 3600),
+        'biz_day_delta': lambda: policy.biz_day_delta(day, other),
+        'weekends_between': lambda: policy.weekends_between(day, other),
+        'closest_biz_day': lambda: policy.closest_biz_day(other),
+        'is_day_off': lambda: policy.is_day_off(other),
+        'add_ordinal': lambda: policy.add_ordinal(ordinal, delta),
+        'delta_ordinal': lambda: policy.delta_ordinal(ordinal, other_ordinal),
+        'is_day_off_ordinal': lambda: policy.is_day_off_ordinal(other_ordinal),
+        'last_biz_day': lambda: policy.last_biz_day(other.year, other.month),
+    }
+
+
+def run(methods=None, number=100, repeat=3, quick=False):
+    holiday_counts = HOLIDAYS[:2] if quick else HOLIDAYS
+    weekend_shapes = ['sat-sun', 'fri-sat'] if quick else sorted(WEEKENDS)
+    for holidays, weekends, hours, compiled in itertools.product(
+            holiday_counts, weekend_shapes, (False, True), (False, True)):
+        policy = Policy(weekends=WEEKENDS[weekends], holidays=make_holidays(holidays),
+                        hours=HOURS if hours else None)
+        if compiled:
+            policy.compile(*COMPILED_RANGE)
+        for delta_name, delta in sorted(DELTAS.items(), key=lambda item: item[1]):
+            for method, call in sorted(make_calls(policy, delta).items()):
+                if methods and method not in methods:
+                    continue
+                timer = timeit.Timer(call)
+                best = min(timer.repeat(repeat=repeat, number=number)) / number
+                yield {
+                    'method': method,
+                    'holidays': holidays,
+                    'weekends': weekends,
+                    'hours': hours,
+                    'compiled': compiled,
+                    'delta': delta_name,
+                    'seconds_per_call': best,
+                }
+
+
+def key(result):
+    return tuple(result[name] for name in ('method', 'holidays', 'weekends', 'hours', 'compiled', 'delta'))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('-o', '--output', help="write the results to this JSON file")
+    parser.add_argument('-c', '--compare', help="JSON file of a previous run to compare with")
+    parser.add_argument('-m', '--method', action='append', dest='methods', help="only time this method")
+    parser.add_argument('-n', '--number', type=int, default=100, help="calls per measurement (default: 100)")
+    parser.add_argument('-r', '--repeat', type=int, default=3, help="measurements, the best is kept (default: 3)")
+    parser.add_argument('-q', '--quick', action='store_true', help="only small calendars and common weekends")
+    options = parser.parse_args(argv)
+
+    baseline = {}
+    if options.compare:
+        with open(options.compare) as f:
+            baseline = dict((key(result), result) for result in json.load(f)['results'])
+
+    results = []
+    for result in run(options.methods, options.number, options.repeat, options.quick):
+        results.append(result)
+        line = '%-16s holidays=%-5d weekends=%-19s hours=%-5s compiled=%-5s delta=%-3s %10.2f us' % (
+            result['method'], result['holidays'], result['weekends'], result['hours'],
+            result['compiled'], result['delta'], result['seconds_per_call'] * 1e6)
+        previous = baseline.get(key(result))
+        if previous:
+            line += '  x%.2f' % (previous['seconds_per_call'] / result['seconds_per_call'])
+        print(line)
+        sys.stdout.flush()
+
+    if options.output:
+        with open(options.output, 'w') as f:
+            json.dump({
+                'bizdatim': bizdatim.__version__,
+                'python': platform.python_version(),
+                'implementation': platform.python_implementation(),
+                'results': results,
+            }, f, indent=1, sort_keys=True)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -7,18 +7,32 @@ A class for calculating business date deltas based on a policy.
 
 Definitions:
 
-    Weekend - a day off reoccurring on a weekly basis (no shifting weekends
-    supported)
+    Weekend - a day off reoccurring on a weekly basis, or every N days for
+    rotating schedules
 
-    Holiday - a special day off. The app is agnostic as to how holidays reoccur.
-    It expects a list of date instances that represent a sequence of holidays
-    within the desired range.
+    Holiday - a special day off, either listed as a date or generated every
+    year by a rule.
 
     Policy - a definition of weekends and holidays.
 
 """
 
-from datetime import datetime, time, timedelta
+import functools
+import mmap
+import struct
+import sys
+import threading
+import weakref
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict, namedtuple
+from datetime import MAXYEAR, MINYEAR, date, datetime, time, timedelta
+from timeit import default_timer
+
+try:
+    import numpy
+except ImportError:  # numpy is only needed by the batch methods
+    numpy = None
 
 __version__ = '0.2.0'
 
@@ -30,47 +44,1324 @@ FRI = 4
 SAT = 5
 SUN = 6
 
+SECONDS_PER_DAY = 24 * 60 * 60
+
+# date(1970, 1, 1).toordinal(), day 0 of numpy datetime64
+EPOCH_ORDINAL = 719163
+
+# Compiled calendar files: magic, format version, weekend mask, padding,
+# business hours as seconds of the day (-1 when unset), first ordinal,
+# number of days and number of holidays; followed by the cumulative
+# business days counts and the holiday ordinals, as little-endian int32.
+_CALENDAR_HEADER = struct.Struct(str('<8sHBxiiiII'))
+_CALENDAR_MAGIC = b'BIZDATIM'
+_CALENDAR_VERSION = 1
+
 
 def set_time(day, hour):
     """Set the time of the day to the given hour."""
     return day.replace(hour=hour.hour, minute=hour.minute, second=hour.second)
 
 
+def _seconds_of_day(hour):
+    """Number of seconds elapsed since midnight, for a time or datetime."""
+    return hour.hour * 3600 + hour.minute * 60 + hour.second + hour.microsecond / 1000000.0
+
+
+CacheInfo = namedtuple('CacheInfo', ['hits', 'misses', 'evictions', 'maxsize', 'currsize'])
+
+
+class _LRUCache(object):
+    """A size-bounded mapping which evicts the least recently used entries."""
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+
+    def get(self, key, default):
+        try:
+            value = self._entries.pop(key)
+        except KeyError:
+            self.misses += 1
+            return default
+        self.hits += 1
+        self._entries[key] = value
+        return value
+
+    def put(self, key, value):
+        self._entries.pop(key, None)
+        self._entries[key] = value
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self):
+        self._entries.clear()
+
+    def info(self):
+        return CacheInfo(self.hits, self.misses, self.evictions, self.maxsize, len(self._entries))
+
+
+MethodStats = namedtuple('MethodStats', ['calls', 'seconds', 'iterations', 'max_depth'])
+
+
+class _CurrentCall(threading.local):
+    """The instrumented call running in a thread."""
+
+    active = False
+    iterations = 0
+    depth = 0
+
+
+class _StatsRecorder(object):
+    """Call counts, time, inner loop iterations and recursion depth by method.
+
+    Calls made within an instrumented call are accounted to the outer one,
+    so that every call is counted once, with all its iterations.
+    """
+
+    def __init__(self, hook=None):
+        self.hook = hook
+        self._totals = {}
+        self._current = _CurrentCall()
+        self._lock = threading.Lock()
+
+    def call(self, name, method, policy, args, kwargs):
+        current = self._current
+        if current.active:
+            return method(policy, *args, **kwargs)
+        current.active = True
+        current.iterations = current.depth = 0
+        start = default_timer()
+        try:
+            return method(policy, *args, **kwargs)
+        finally:
+            stats = MethodStats(1, default_timer() - start, current.iterations, current.depth)
+            current.active = False
+            with self._lock:
+                calls, seconds, iterations, max_depth = self._totals.get(name, (0, 0.0, 0, 0))
+                self._totals[name] = MethodStats(
+                    calls + 1, seconds + stats.seconds, iterations + stats.iterations, max(max_depth, stats.max_depth))
+            if self.hook is not None:
+                self.hook(name, stats)
+
+    def iterate(self, iterations, depth=0):
+        """Adds loop iterations to the current call, and the depth of recursion reached."""
+        current = self._current
+        current.iterations += iterations
+        if depth > current.depth:
+            current.depth = depth
+
+    def clear(self):
+        with self._lock:
+            self._totals.clear()
+
+    def info(self):
+        with self._lock:
+            return dict(self._totals)
+
+
+_MISSING = object()
+
+# Everything a Policy method reads, replaced as a whole by every change so
+# that a call sees a single version of it.
+_PolicyState = namedtuple('_PolicyState', ['version', 'calendar', 'hours', 'compiled_first', 'compiled_counts'])
+
+# Serializes the changes to policies, reads never take it
+_write_lock = threading.Lock()
+
+
+def _memoized(method):
+    """Caches the results of a Policy method when the policy cache is enabled.
+
+    Arguments are keyed along with their type, so that a date and a datetime
+    (or a subclass of it) never share an entry, and with their time zone, as
+    aware datetimes of different zones compare equal at the same instant.
+    """
+    name = method.__name__
+
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        cache = self._cache
+        if cache is None:
+            return method(self, *args, **kwargs)
+        # Keyed by version too, so that a result of a state being replaced is never stored for the next one
+        key = (name, self._state.version)
+        key += tuple((arg.__class__, arg, getattr(arg, 'tzinfo', None)) for arg in args)
+        key += tuple(sorted(kwargs.items()))
+        result = cache.get(key, _MISSING)
+        if result is _MISSING:
+            result = method(self, *args, **kwargs)
+            cache.put(key, result)
+        return result
+
+    return wrapper
+
+
+def _instrumented(method):
+    """Marks a Policy method whose calls are recorded when the policy stats
+    are enabled. The method is left as is, so that disabled stats cost nothing:
+    enable_stats switches the class of the policy to one recording them."""
+    method.instrumented = True
+    return method
+
+
+def _recorded(method):
+    """Records the calls of a Policy method in the policy stats."""
+    name = method.__name__
+
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        stats = self._stats
+        if stats is None:
+            # Stats disabled by another thread while the method was looked up
+            return method(self, *args, **kwargs)
+        return stats.call(name, method, self, args, kwargs)
+
+    return wrapper
+
+
+_recording_classes = {}
+
+
+def _recording_class(cls):
+    """Returns the subclass of a Policy class whose instrumented methods
+    record their calls, with the same slots so that a policy can switch to it."""
+    try:
+        return _recording_classes[cls]
+    except KeyError:
+        pass
+    namespace = {str('__slots__'): (), str('_plain_class'): cls}
+    for name in dir(cls):
+        # Overrides of instrumented methods are recorded too
+        if any(getattr(vars(base).get(name), 'instrumented', False) for base in cls.__mro__):
+            # Unbound methods of Python 2 hold their function in __func__
+            method = getattr(cls, name)
+            namespace[str(name)] = _recorded(getattr(method, '__func__', method))
+    return _recording_classes.setdefault(cls, type(cls.__name__, (cls,), namespace))
+
+
+def _check_hours(hours):
+    if hours is not None and not isinstance(hours, BusinessHours) and len(hours) != 2:
+        raise AssertionError("Working hours must specify a beginning and an end")
+
+
+def _moved(day, ordinal, seconds_of_day):
+    """The datetime on the day ordinal at the given seconds since its
+    midnight, keeping the time zone of day."""
+    midnight = day.replace(hour=0, minute=0, second=0, microsecond=0)
+    return midnight + timedelta(days=ordinal - day.toordinal(), seconds=seconds_of_day)
+
+
+def _month_start(year, month):
+    """The ordinal of the first day of the month, which may be past December."""
+    years, month = divmod(month - 1, 12)
+    return date(year + years, month + 1, 1).toordinal()
+
+
+def _period(year, month=None, quarter=None):
+    """Returns the ordinals of the first day of a month, a quarter or a whole
+    year and of the day after it."""
+    if month is not None and quarter is not None:
+        raise AssertionError("A period is a month or a quarter, not both")
+    if quarter is not None:
+        if not 1 <= quarter <= 4:
+            raise AssertionError("Quarters are numbered from 1 to 4")
+        month, months = 3 * quarter - 2, 3
+    elif month is not None:
+        if not 1 <= month <= 12:
+            raise AssertionError("Months are numbered from 1 to 12")
+        months = 1
+    else:
+        month, months = 1, 12
+    return _month_start(year, month), _month_start(year, month + months)
+
+
+def _array_bytes(values):
+    """The bytes of an array, array.tobytes being named tostring on Python 2."""
+    return values.tobytes() if hasattr(values, 'tobytes') else values.tostring()
+
+
+def _int32_array(buf, offset, length):
+    """A read-only view of little-endian int32 in buf, copied only when the
+    native byte order does not match, or on Python 2 which cannot cast
+    memory views."""
+    if sys.version_info < (3,):
+        values = array(str('i'), buf[offset:offset + length * 4])
+    else:
+        view = memoryview(buf)[offset:offset + length * 4]
+        if sys.byteorder == 'little':
+            return view.cast(str('i'))
+        values = array(str('i'), view.tobytes())
+    if sys.byteorder != 'little':
+        values.byteswap()
+    return values
+
+
+def _gcd(a, b):
+    """Greatest common divisor, math.gcd needing Python 3.5."""
+    while b:
+        a, b = b, a % b
+    return a
+
+
+def _observed(observed):
+    """Normalizes an observed mapping of weekdays to shifts into a 7-tuple."""
+    if observed is None:
+        return None
+    if isinstance(observed, dict):
+        if any(weekday not in range(7) for weekday in observed):
+            raise AssertionError("Observed shifts are keyed by weekday")
+        observed = tuple(observed.get(weekday, 0) for weekday in range(7))
+    elif len(observed) != 7:
+        raise AssertionError("Observed shifts are keyed by weekday")
+    return tuple(observed) if any(observed) else None
+
+
+def _easter(year):
+    """Returns the (western) Easter sunday of the year.
+
+    >>> _easter(2011)
+    datetime.date(2011, 4, 24)
+    """
+    # Anonymous Gregorian algorithm
+    a = year % 19
+    b, c = divmod(year, 100)
+    d, e = divmod(b, 4)
+    f = (b + 8) // 25
+    g = (b - f + 1) // 3
+    h = (19 * a + b - d - g + 15) % 30
+    i, k = divmod(c, 4)
+    j = (32 + 2 * e + 2 * i - h - k) % 7
+    m = (a + 11 * h + 22 * j) // 451
+    month, day = divmod(h + j - 7 * m + 114, 31)
+    return date(year, month, day + 1)
+
+
+class FixedHoliday(namedtuple('FixedHoliday', 'month day observed')):
+    """A holiday on the same date every year.
+
+    observed maps weekdays to the number of days the holiday moves by when it
+    falls on them: it is then also observed on that day, or on the first day
+    further away which is neither a weekend nor another holiday.
+
+    >>> policy = Policy(weekends=(SAT, SUN), holiday_rules=[FixedHoliday(7, 4, observed={SAT: -1, SUN: 1})])
+    >>> policy.is_holiday(date(2010, 7, 5))  # July 4th 2010 is a Sunday
+    True
+    """
+
+    __slots__ = ()
+
+    def __new__(cls, month, day, observed=None):
+        if month not in range(1, 13) or not 1 <= day <= (29 if month == 2 else 30 + (month + month // 8) % 2):
+            raise AssertionError("Invalid month or day")
+        return super(FixedHoliday, cls).__new__(cls, month, day, _observed(observed))
+
+    def in_year(self, year):
+        """Returns the date of the holiday in the year, before being observed."""
+        if self.month == 2 and self.day == 29 and not (year % 4 == 0 and (year % 100 != 0 or year % 400 == 0)):
+            return None
+        return date(year, self.month, self.day)
+
+
+class NthWeekdayHoliday(namedtuple('NthWeekdayHoliday', 'month weekday n observed')):
+    """A holiday on the n-th given weekday of a month, counted from the end
+    of the month when n is negative. See FixedHoliday for observed.
+
+    >>> NthWeekdayHoliday(9, MON, 1).in_year(2011)  # Labour day
+    datetime.date(2011, 9, 5)
+    >>> NthWeekdayHoliday(5, MON, -1).in_year(2011)  # Memorial day
+    datetime.date(2011, 5, 30)
+    """
+
+    __slots__ = ()
+
+    def __new__(cls, month, weekday, n, observed=None):
+        if month not in range(1, 13) or weekday not in range(7) or not 1 <= abs(n) <= 5:
+            raise AssertionError("Invalid month, weekday or rank")
+        return super(NthWeekdayHoliday, cls).__new__(cls, month, weekday, n, _observed(observed))
+
+    def in_year(self, year):
+        """Returns the date of the holiday in the year, before being observed."""
+        if self.n > 0:
+            first = date(year, self.month, 1)
+            day = first + timedelta(days=(self.weekday - first.weekday()) % 7 + 7 * (self.n - 1))
+        else:
+            if self.month == 12:
+                last = date(year, 12, 31)
+            else:
+                last = date(year, self.month + 1, 1) - timedelta(days=1)
+            day = last - timedelta(days=(last.weekday() - self.weekday) % 7 + 7 * (-self.n - 1))
+        return day if day.month == self.month else None
+
+
+class EasterHoliday(namedtuple('EasterHoliday', 'offset observed')):
+    """A holiday a number of days after (or before) Easter sunday. See
+    FixedHoliday for observed.
+
+    >>> EasterHoliday(-2).in_year(2011)  # Good Friday
+    datetime.date(2011, 4, 22)
+    """
+
+    __slots__ = ()
+
+    def __new__(cls, offset=0, observed=None):
+        return super(EasterHoliday, cls).__new__(cls, offset, _observed(observed))
+
+    def in_year(self, year):
+        """Returns the date of the holiday in the year, before being observed."""
+        return _easter(year) + timedelta(days=self.offset)
+
+
+def _interned_calendar(weekend_mask, ordinals, holiday_rules, cycle, cycle_anchor, parts):
+    """Unpickles a CompiledCalendar, Python 2 being unable to pickle its class methods."""
+    return CompiledCalendar._intern(weekend_mask, ordinals, holiday_rules, cycle, cycle_anchor, parts)
+
+
+def _interval_seconds(intervals):
+    """Converts (begin, end) pairs of datetime.time into seconds since the
+    midnight of the day they start, moving to the next day when needed."""
+    result = []
+    shift = 0
+    for begin, end in intervals:
+        begin = _seconds_of_day(begin) + shift
+        if result and begin < result[-1][1]:
+            begin += SECONDS_PER_DAY
+            shift += SECONDS_PER_DAY
+        end = _seconds_of_day(end) + shift
+        if end <= begin:
+            end += SECONDS_PER_DAY
+        if result and begin < result[-1][1]:
+            raise AssertionError("Business hours must be in order and must not overlap")
+        result.append((begin, end))
+    if result and result[-1][1] - result[0][0] > SECONDS_PER_DAY:
+        raise AssertionError("Business hours of a day must not last more than a day")
+    return tuple(result)
+
+
+class BusinessHours(object):
+    """Business hours which vary with the weekday, with breaks and special days.
+
+    Each weekday has a list of (begin, end) intervals of datetime.time, in
+    order, an interval ending at or before its beginning ending on the next
+    day. Weekdays without intervals have no business hours. Special dates,
+    such as half-days before holidays, have their own intervals instead of
+    those of their weekday. Days off never have business hours.
+
+    >>> hours = BusinessHours({MON: [(time(9), time(12)), (time(13), time(18))], FRI: [(time(9), time(16))]},
+    ...                       special={date(2011, 7, 11): [(time(9), time(12))]})
+    >>> hours.length(date(2011, 7, 4).toordinal()), hours.length(date(2011, 7, 11).toordinal())
+    (28800.0, 10800.0)
+    """
+
+    __slots__ = ('weekdays', '_special', '_seconds', '_special_seconds', '_key')
+
+    def __init__(self, weekdays, special=None):
+        """Initialise the business hours.
+
+        Args:
+            weekdays: dict mapping weekdays to lists of (begin, end) datetime.time.
+            special: dict mapping dates to lists of (begin, end) datetime.time.
+        """
+        if any(weekday not in range(7) for weekday in weekdays):
+            raise AssertionError("Business hours are keyed by weekday")
+        setattr_ = super(BusinessHours, self).__setattr__
+        setattr_('weekdays', tuple(tuple(tuple(pair) for pair in weekdays.get(weekday, ())) for weekday in range(7)))
+        setattr_('_special', tuple(sorted(
+            (day.toordinal(), tuple(tuple(pair) for pair in intervals)) for day, intervals in (special or {}).items())))
+        setattr_('_seconds', tuple(_interval_seconds(intervals) for intervals in self.weekdays))
+        setattr_('_special_seconds', dict(
+            (ordinal, _interval_seconds(intervals)) for ordinal, intervals in self._special))
+        setattr_('_key', (self.weekdays, self._special))
+
+    def __setattr__(self, name, value):
+        raise AttributeError("BusinessHours is immutable")
+
+    def __reduce__(self):
+        return BusinessHours, (dict(enumerate(self.weekdays)), self.special)
+
+    def __eq__(self, other):
+        if not isinstance(other, BusinessHours):
+            return NotImplemented
+        return self._key == other._key
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash(self._key)
+
+    def __repr__(self):
+        return 'BusinessHours(%r, special=%r)' % (
+            dict((weekday, list(intervals)) for weekday, intervals in enumerate(self.weekdays) if intervals),
+            self.special)
+
+    @property
+    def special(self):
+        """The special dates and their intervals."""
+        return dict((date.fromordinal(ordinal), list(intervals)) for ordinal, intervals in self._special)
+
+    def intervals(self, ordinal):
+        """Returns the business hours of a day, as (begin, end) seconds since its midnight."""
+        intervals = self._special_seconds.get(ordinal)
+        if intervals is None:
+            intervals = self._seconds[(ordinal + 6) % 7]
+        return intervals
+
+    def length(self, ordinal):
+        """Returns the number of business seconds of a day."""
+        return sum(end - begin for begin, end in self.intervals(ordinal))
+
+    def elapsed(self, ordinal, seconds):
+        """Returns the number of business seconds of a day elapsed the given
+        number of seconds after its midnight."""
+        return sum(min(max(seconds - begin, 0), end - begin) for begin, end in self.intervals(ordinal))
+
+    def contains(self, ordinal, seconds):
+        """Returns True if the business hours of a day include the given
+        number of seconds after its midnight, bounds included."""
+        return any(begin <= seconds <= end for begin, end in self.intervals(ordinal))
+
+    def time_at(self, ordinal, offset, latest=False):
+        """Returns the number of seconds after midnight at which offset
+        business seconds of the day have elapsed. Between two intervals, the
+        end of the first one is returned, or the beginning of the second one
+        if latest is True."""
+        intervals = self.intervals(ordinal)
+        for i, (begin, end) in enumerate(intervals):
+            if offset < end - begin or offset == end - begin and not (latest and i + 1 < len(intervals)):
+                return begin + offset
+            offset -= end - begin
+        return intervals[-1][1]
+
+
+class CompiledCalendar(object):
+    """Weekends and holidays, indexed for business day arithmetic.
+
+    Calendars are immutable and CompiledCalendar.get returns the same
+    instance for identical weekends and holidays, so that policies sharing a
+    definition share its indexes too. Holidays are kept as a packed array of
+    sorted ordinals.
+
+    Holidays may also be given as rules, like FixedHoliday, NthWeekdayHoliday
+    or EasterHoliday. The holidays of a year are only generated the first
+    time a query needs them, so rules cost nothing for the years not used.
+
+    Weekends repeat every cycle days, 7 unless a rotating schedule is used.
+    Day ordinal o is at position (o - cycle_anchor) % cycle of the cycle, and
+    bit p of weekend_mask is set when position p is a weekend. Weekly
+    calendars are anchored on a Monday, so positions are weekdays.
+
+    Calendars may be combined with CompiledCalendar.combine: the weekend
+    masks are merged over a common cycle and the holidays of the parts are
+    merged year by year, as for rules.
+
+    >>> calendar = CompiledCalendar.get(weekends=(SAT, SUN), holidays=(date(2011, 7, 1),))
+    >>> calendar is CompiledCalendar.get(weekends=[SUN, SAT], holidays=[date(2011, 7, 1)])
+    True
+    >>> Policy(calendar=calendar, hours=(time(8), time(20))).calendar is calendar
+    True
+    """
+
+    __slots__ = (
+        'weekend_mask', 'cycle', 'cycle_anchor', 'weeklen', 'weekday_gaps', 'holiday_rules', 'holiday_ordinals',
+        'workday_holiday_ordinals', 'holiday_set', 'parts', '_base_ordinals', '_years', '_span', '_cycle_span',
+        '_tables', '_busdaycalendar', '__weakref__',
+    )
+
+    _registry = weakref.WeakValueDictionary()
+
+    # Serializes the lazy expansions, shared calendars may be read from several threads.
+    # Reentrant since combined calendars expand their parts.
+    _lock = threading.RLock()
+
+    def __init__(self, weekend_mask, holiday_ordinals, holiday_rules=(), cycle=7, cycle_anchor=1, parts=None):
+        """Initialise the calendar, use CompiledCalendar.get instead.
+
+        Args:
+            weekend_mask: integer, bit n is set when position n of the cycle is a weekend.
+            holiday_ordinals: sorted array('i') of distinct holiday ordinals.
+            holiday_rules: tuple of holiday rules.
+            cycle: integer, the number of days after which weekends repeat.
+            cycle_anchor: integer, the ordinal of a day at position 0 of the cycle.
+            parts: for combined calendars, 'all' or 'any' and the tuple of
+                calendars whose holidays are merged.
+        """
+        if cycle < 1 or weekend_mask >= 1 << cycle or bin(weekend_mask).count('1') >= cycle:
+            raise AssertionError("Too many weekends per week" if cycle == 7 else "No business day in the cycle")
+        setattr_ = super(CompiledCalendar, self).__setattr__
+        setattr_('weekend_mask', weekend_mask)
+        setattr_('cycle', cycle)
+        setattr_('cycle_anchor', cycle_anchor)
+        # business days per cycle
+        setattr_('weeklen', cycle - bin(weekend_mask).count('1'))
+        # days to the next (and previous) day which is not a weekend, by position
+        setattr_('weekday_gaps', tuple(
+            tuple(
+                next(gap for gap in range(1, cycle + 1) if not weekend_mask >> ((position + sign * gap) % cycle) & 1)
+                for position in range(cycle)
+            )
+            for sign in (1, -1)
+        ))
+        setattr_('holiday_rules', holiday_rules)
+        setattr_('parts', parts)
+        setattr_('_base_ordinals', holiday_ordinals)
+        # years whose rules were expanded, and the ordinals [first, last) known to be complete
+        setattr_('_years', set())
+        setattr_('_span', (0, 0))
+        # ordinals [first, last) whose rotating weekends are in the busdaycalendar
+        setattr_('_cycle_span', (0, 0))
+        setattr_('_tables', {})
+        self._index_holidays(holiday_ordinals)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("CompiledCalendar is immutable")
+
+    def __reduce__(self):
+        # Unpickled through the registry, as they can not be set attribute by attribute
+        return _interned_calendar, (self.weekend_mask, self._base_ordinals, self.holiday_rules, self.cycle,
+                                    self.cycle_anchor, self.parts)
+
+    def _index_holidays(self, holiday_ordinals):
+        setattr_ = super(CompiledCalendar, self).__setattr__
+        setattr_('holiday_ordinals', holiday_ordinals)
+        setattr_('workday_holiday_ordinals', array(
+            str('i'), [o for o in holiday_ordinals if not self.is_weekend(o)]))
+        setattr_('holiday_set', frozenset(holiday_ordinals))
+        setattr_('_busdaycalendar', None)
+
+    @classmethod
+    def get(cls, weekends=None, holidays=None, holiday_rules=None, cycle=None, cycle_start=None):
+        """Returns the calendar for the given weekdays, holiday dates and
+        holiday rules. A rotating schedule is given as the cycle of days,
+        True for business days, starting on cycle_start, instead of weekends."""
+        ordinals = [h.toordinal() for h in holidays or ()]
+        if cycle is not None:
+            if weekends is not None or cycle_start is None:
+                raise AssertionError("A cycle needs a start date and no weekends")
+            mask = sum(1 << position for position, worked in enumerate(cycle) if not worked)
+            return cls.intern(mask, ordinals, holiday_rules, len(cycle), cycle_start.toordinal())
+        if weekends is not None and len(weekends) > 6:
+            raise AssertionError("Too many weekends per week")
+        mask = 0
+        for weekday in weekends or ():
+            mask |= 1 << weekday
+        return cls.intern(mask, ordinals, holiday_rules)
+
+    @classmethod
+    def intern(cls, weekend_mask, holiday_ordinals, holiday_rules=None, cycle=7, cycle_anchor=1, parts=None):
+        """Returns the calendar for the given weekend mask, holiday ordinals,
+        holiday rules, cycle and parts."""
+        ordinals = array(str('i'), sorted(set(holiday_ordinals)))
+        return cls._intern(weekend_mask, ordinals, holiday_rules, cycle, cycle_anchor, parts)
+
+    @classmethod
+    def _intern(cls, weekend_mask, ordinals, holiday_rules, cycle, cycle_anchor, parts):
+        """Same as intern, for a sorted array('i') of distinct ordinals."""
+        rules = tuple(holiday_rules or ())
+        if cycle == 7:
+            # Weekly cycles are anchored on a Monday, so that positions are weekdays
+            shift = (cycle_anchor - 1) % 7
+            weekend_mask = (weekend_mask << shift | weekend_mask >> (7 - shift)) & 0x7f
+            cycle_anchor = 1
+        cycle_anchor %= cycle
+        key = (weekend_mask, cycle, cycle_anchor, len(ordinals), hash(_array_bytes(ordinals)), rules, parts)
+        calendar = cls._registry.get(key)
+        if calendar is None or calendar._base_ordinals != ordinals:
+            calendar = cls(weekend_mask, ordinals, rules, cycle, cycle_anchor, parts)
+            cls._registry[key] = calendar
+        return calendar
+
+    @classmethod
+    def combine(cls, calendars, how='all'):
+        """Returns the calendar whose business days are those of all the
+        given calendars, or of any of them.
+
+        >>> paris = CompiledCalendar.get(weekends=(SAT, SUN), holidays=(date(2011, 7, 14),))
+        >>> new_york = CompiledCalendar.get(weekends=(SAT, SUN), holidays=(date(2011, 7, 4),))
+        >>> both = CompiledCalendar.combine([paris, new_york], 'all')
+        >>> both.is_day_off(date(2011, 7, 4).toordinal()), both.is_day_off(date(2011, 7, 14).toordinal())
+        (True, True)
+        >>> CompiledCalendar.combine([paris, new_york], 'any').is_day_off(date(2011, 7, 4).toordinal())
+        False
+        """
+        if how not in ('all', 'any'):
+            raise AssertionError("Calendars are combined with 'all' or 'any'")
+        calendars = tuple(calendars)
+        if not calendars:
+            raise AssertionError("At least one calendar is needed")
+        cycle = 1
+        for calendar in calendars:
+            cycle = cycle * calendar.cycle // _gcd(cycle, calendar.cycle)
+        anchor = calendars[0].cycle_anchor
+        # A day is off in the combination when it is off in any, or all, of the calendars
+        merge = any if how == 'all' else all
+        mask = 0
+        for position in range(cycle):
+            if merge(calendar.is_weekend(anchor + position) for calendar in calendars):
+                mask |= 1 << position
+        return cls.intern(mask, (), (), cycle, anchor, (how, calendars))
+
+    def with_holidays(self, added=(), removed=()):
+        """Returns the calendar with holiday ordinals added and removed.
+
+        The sorted holidays are copied and updated one ordinal at a time, which
+        is cheaper than sorting them again for a few changes.
+
+        >>> calendar = CompiledCalendar.get(weekends=(SAT, SUN), holidays=(date(2011, 7, 1),))
+        >>> calendar.with_holidays(added=[date(2011, 6, 30).toordinal()]).holidays
+        [datetime.date(2011, 6, 30), datetime.date(2011, 7, 1)]
+        """
+        ordinals = array(str('i'), self._base_ordinals)
+        for ordinal in removed:
+            i = bisect_left(ordinals, ordinal)
+            if i < len(ordinals) and ordinals[i] == ordinal:
+                del ordinals[i]
+        for ordinal in added:
+            i = bisect_left(ordinals, ordinal)
+            if i == len(ordinals) or ordinals[i] != ordinal:
+                ordinals.insert(i, ordinal)
+        return self._intern(self.weekend_mask, ordinals, self.holiday_rules, self.cycle, self.cycle_anchor, self.parts)
+
+    def _definition(self):
+        return (self.weekend_mask, self.cycle, self.cycle_anchor, _array_bytes(self._base_ordinals), self.holiday_rules,
+                self.parts)
+
+    def __eq__(self, other):
+        if not isinstance(other, CompiledCalendar):
+            return NotImplemented
+        return self._definition() == other._definition()
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash(self._definition())
+
+    @property
+    def weekends(self):
+        """The weekdays which are weekends, None for rotating schedules."""
+        if self.cycle != 7:
+            return None
+        return [weekday for weekday in range(7) if self.weekend_mask >> weekday & 1]
+
+    @property
+    def cycle_days(self):
+        """For rotating schedules, whether each day of the cycle is a business day."""
+        if self.cycle == 7:
+            return None
+        return tuple(not self.weekend_mask >> position & 1 for position in range(self.cycle))
+
+    @property
+    def cycle_start(self):
+        """For rotating schedules, a day on which the cycle starts."""
+        if self.cycle == 7:
+            return None
+        return date.fromordinal(self.cycle_anchor or self.cycle)
+
+    @property
+    def holidays(self):
+        """The holidays given as dates, without those generated by the rules
+        or merged from the parts."""
+        return [date.fromordinal(ordinal) for ordinal in self._base_ordinals]
+
+    @property
+    def is_lazy(self):
+        """True when holidays are generated for the years queries need."""
+        return bool(self.holiday_rules or self.parts)
+
+    def expand(self, first, last):
+        """Generates the holidays of the rules and parts for the years
+        between both ordinals, if not done yet. Returns True if new holidays
+        were indexed."""
+        if last < first:
+            first, last = last, first
+        # A single read, the span of another thread may move between two
+        span = self._span
+        if not self.is_lazy or span[0] <= first and last < span[1]:
+            return False
+        year1 = date.fromordinal(max(first, 1)).year
+        year2 = date.fromordinal(min(last, date.max.toordinal())).year
+        # Observed holidays may move to the previous or next year
+        low, high = max(year1 - 1, MINYEAR), min(year2 + 1, MAXYEAR)
+        with self._lock:
+            years = [year for year in range(low, high + 1) if year not in self._years]
+            if years:
+                # Indexed before the years and span are published, so that
+                # readers skipping expand never see them without their holidays
+                self._index_holidays(self._generate(years))
+                self._years.update(years)
+
+            while low - 1 in self._years:
+                low -= 1
+            while high + 1 in self._years:
+                high += 1
+            low = low + 1 if low > MINYEAR else low
+            high = high - 1 if high < MAXYEAR else high
+            super(CompiledCalendar, self).__setattr__(
+                '_span', (date(low, 1, 1).toordinal(), date(high, 12, 31).toordinal() + 1))
+        return bool(years)
+
+    def _generate(self, years):
+        """Returns the holiday ordinals with those of the parts and rules for the given years."""
+        taken = set(self.holiday_ordinals)
+        for year in years:
+            if self.parts:
+                taken.update(self._merge_parts(year))
+            days = []
+            for rule in self.holiday_rules:
+                try:
+                    day = rule.in_year(year)
+                except (ValueError, OverflowError):
+                    continue
+                if day is not None:
+                    days.append((rule, day))
+                    taken.add(day.toordinal())
+            # Observed days once every holiday of the year is known, so that they avoid each other
+            for rule, day in days:
+                shift = rule.observed[day.weekday()] if rule.observed else 0
+                if shift:
+                    ordinal = day.toordinal() + shift
+                    step = 1 if shift > 0 else -1
+                    while self.is_weekend(ordinal) or ordinal in taken:
+                        ordinal += step
+                    taken.add(ordinal)
+        return array(str('i'), sorted(taken))
+
+    def _merge_parts(self, year):
+        """Returns the holiday ordinals of the parts in the year."""
+        how, calendars = self.parts
+        first = date(year, 1, 1).toordinal()
+        last = date(year, 12, 31).toordinal()
+        days = set()
+        for calendar in calendars:
+            calendar.expand(first, last)
+            ordinals = calendar.holiday_ordinals
+            days.update(ordinals[bisect_left(ordinals, first):bisect_right(ordinals, last)])
+        if how == 'any':
+            days = [ordinal for ordinal in days if all(calendar.is_day_off(ordinal) for calendar in calendars)]
+        return days
+
+    def is_holiday(self, ordinal):
+        self.expand(ordinal, ordinal)
+        return ordinal in self.holiday_set
+
+    def is_weekend(self, ordinal):
+        return bool(self.weekend_mask >> ((ordinal - self.cycle_anchor) % self.cycle) & 1)
+
+    def is_day_off(self, ordinal):
+        return self.is_weekend(ordinal) or self.is_holiday(ordinal)
+
+    def cover(self, first, last):
+        """Same as expand, also adding the weekends of rotating schedules
+        between both ordinals to the busdaycalendar, whose weekmask can only
+        express weekly ones."""
+        expanded = self.expand(first, last)
+        if last < first:
+            first, last = last, first
+        if self.cycle == 7 or self._cycle_span[0] <= first and last < self._cycle_span[1]:
+            return expanded
+        with self._lock:
+            if self._cycle_span != (0, 0):
+                first = min(first, self._cycle_span[0])
+                last = max(last, self._cycle_span[1] - 1)
+            # Whole years, to avoid growing one day at a time
+            first = date(date.fromordinal(max(first, 1)).year, 1, 1).toordinal()
+            last = date(date.fromordinal(min(last, date.max.toordinal())).year, 12, 31).toordinal()
+            setattr_ = super(CompiledCalendar, self).__setattr__
+            setattr_('_cycle_span', (first, last + 1))
+            setattr_('_busdaycalendar', None)
+        return True
+
+    def business_day_counts(self, first, last):
+        """Returns an array whose item k is the number of business days in
+        [first, first + k), for k up to last - first + 1. Arrays are built
+        once per range and shared."""
+        counts = self._tables.get((first, last))
+        if counts is None:
+            self.expand(first, last)
+            counts = array(str('l'), [0])
+            n = 0
+            for ordinal in range(first, last + 1):
+                if not self.is_day_off(ordinal):
+                    n += 1
+                counts.append(n)
+            self._tables[(first, last)] = counts
+        return counts
+
+    def business_seconds(self, hours, year):
+        """Returns an array whose item k is the number of business seconds
+        of the BusinessHours in the k first days of the year. Arrays are
+        built once per year and shared."""
+        seconds = self._tables.get((hours, year))
+        if seconds is None:
+            first = date(year, 1, 1).toordinal()
+            last = date(year, 12, 31).toordinal()
+            self.expand(first, last)
+            seconds = array(str('d'), [0])
+            n = 0
+            for ordinal in range(first, last + 1):
+                if not self.is_day_off(ordinal):
+                    n += hours.length(ordinal)
+                seconds.append(n)
+            self._tables[(hours, year)] = seconds
+        return seconds
+
+    def busdaycalendar(self):
+        """Returns the equivalent numpy.busdaycalendar."""
+        if numpy is None:
+            raise ImportError("numpy is required for batch operations")
+        busdaycalendar = self._busdaycalendar
+        if busdaycalendar is None:
+            with self._lock:
+                ordinals = self.holiday_ordinals
+                if self.cycle == 7:
+                    weekmask = [not self.weekend_mask >> weekday & 1 for weekday in range(7)]
+                else:
+                    # Rotating weekends are listed as holidays over the covered span
+                    weekmask = [True] * 7
+                    ordinals = sorted(self.holiday_set.union(
+                        ordinal for ordinal in range(*self._cycle_span) if self.is_weekend(ordinal)))
+                busdaycalendar = numpy.busdaycalendar(
+                    weekmask=weekmask,
+                    holidays=(numpy.array(ordinals, dtype='int64') - EPOCH_ORDINAL).astype('datetime64[D]'),
+                )
+                super(CompiledCalendar, self).__setattr__('_busdaycalendar', busdaycalendar)
+        return busdaycalendar
+
+
 class Policy(object):
     """
     Policy class defined holidays and weekends. All calculations related to
     business day arithmetics are done in teh context of Policy.
     """
 
-    def __init__(self, weekends=None, holidays=None, hours=None):
+    __slots__ = ('_state', '_cache', '_stats', '_compiled_range', '__weakref__')
+
+    def __init__(self, weekends=None, holidays=None, hours=None, calendar=None, holiday_rules=None, cycle=None,
+                 cycle_start=None):
         """Initialise the class.
 
         Args:
             weekends: list or tuple, a days to consider in the weekend.
             holidays: list or tuple, all the holidays.
-            hours: list or tuple of datetime.time, when work begins and ends during a day.
+            hours: list or tuple of datetime.time, when work begins and ends during a day,
+                or BusinessHours varying with the day.
+            calendar: CompiledCalendar, shared weekends and holidays to use
+                instead of the weekends, holidays and holiday_rules arguments.
+            holiday_rules: list or tuple of FixedHoliday, NthWeekdayHoliday
+                or EasterHoliday, generating holidays every year.
+            cycle: list or tuple of booleans, for rotating schedules instead
+                of weekends: whether each day of the cycle is a business day.
+            cycle_start: datetime.date, a day on which the cycle starts.
         """
-        if len(weekends) > 6:
-            raise AssertionError("Too many weekends per week")
-        if hours is not None and len(hours) != 2:
-            raise AssertionError("Working hours must specify a beginning and an end")
-        self.weekends = weekends or []
-        self._holidays = []
-        self._set_holidays(holidays)
-        self.hours = hours
+        self._cache = None
+        self._stats = None
+        self._compiled_range = None
+        if calendar is None:
+            calendar = CompiledCalendar.get(weekends, holidays, holiday_rules, cycle, cycle_start)
+        elif weekends is not None or holidays is not None or holiday_rules is not None or cycle is not None:
+            raise AssertionError("Weekends and holidays come from the calendar")
+        _check_hours(hours)
+        self._state = _PolicyState(0, calendar, hours, None, None)
+
+    @property
+    def calendar(self):
+        """The CompiledCalendar holding weekends and holidays."""
+        return self._state.calendar
+
+    @property
+    def version(self):
+        """The number of changes made to weekends, holidays, hours or the
+        compiled range since the policy was created."""
+        return self._state.version
+
+    @property
+    def _compiled_first(self):
+        return self._state.compiled_first
+
+    @property
+    def _compiled_counts(self):
+        return self._state.compiled_counts
+
+    def snapshot(self):
+        """Returns a copy of the policy pinned to its current version, which
+        later changes to this policy do not affect.
+
+        Every method reads the state of the policy once, so a call is always
+        answered by a single version, even while another thread changes the
+        holidays. A snapshot keeps several calls on the same version and
+        tells which one it is.
+
+        >>> policy = Policy(weekends=(SAT, SUN))
+        >>> snapshot = policy.snapshot()
+        >>> policy.add_holidays([date(2011, 7, 1)])
+        >>> policy.version, snapshot.version
+        (1, 0)
+        >>> policy.is_day_off(date(2011, 7, 1)), snapshot.is_day_off(date(2011, 7, 1))
+        (True, False)
+        """
+        # Recording calls too when stats are enabled, as they are shared
+        policy = Policy.__new__(self.__class__)
+        policy._state = self._state
+        policy._cache = None
+        policy._stats = self._stats
+        policy._compiled_range = self._compiled_range
+        return policy
+
+    def _update(self, calendar=None, hours=_MISSING):
+        """Publishes a new version of the state, with everything derived from
+        it rebuilt. Callers hold _write_lock, readers never take it."""
+        state = self._state
+        if calendar is None:
+            calendar = state.calendar
+        if hours is _MISSING:
+            hours = state.hours
+        first = counts = None
+        if self._compiled_range is not None:
+            start, end = self._compiled_range
+            first = start.toordinal()
+            # counts[k] is the number of business days in [first, first + k)
+            counts = calendar.business_day_counts(first, end.toordinal())
+        self._state = _PolicyState(state.version + 1, calendar, hours, first, counts)
+        if self._cache is not None:
+            self._cache.clear()
+
+    def __getstate__(self):
+        # Needed by the first pickle protocols, the policy having no __dict__
+        return dict((name, getattr(self, name)) for name in Policy.__slots__ if name != '__weakref__')
+
+    def __setstate__(self, state):
+        for name, value in state.items():
+            setattr(self, name, value)
+
+    def _get_weekends(self):
+        return self._state.calendar.weekends
+
+    def _set_weekends(self, weekends):
+        with _write_lock:
+            calendar = self._state.calendar
+            self._update(CompiledCalendar.intern(
+                CompiledCalendar.get(weekends).weekend_mask, calendar._base_ordinals, calendar.holiday_rules,
+                parts=calendar.parts))
+
+    weekends = property(_get_weekends, _set_weekends)
 
     def _get_holidays(self):
-        return self._holidays
+        return self._state.calendar.holidays
 
     def _set_holidays(self, holidays):
-        if holidays:
-            self._holidays = list(holidays)
-            self._holidays.sort()
-        else:
-            self._holidays = []
+        with _write_lock:
+            calendar = self._state.calendar
+            self._update(CompiledCalendar.intern(
+                calendar.weekend_mask, [h.toordinal() for h in holidays or ()], calendar.holiday_rules,
+                calendar.cycle, calendar.cycle_anchor, calendar.parts))
 
     holidays = property(_get_holidays, _set_holidays)
 
+    def add_holidays(self, holidays):
+        """Adds holidays, e.g. a bridge day announced while the policy is in use.
+
+        The sorted holidays are updated in place of being sorted again, and
+        the new version replaces the old one at once for readers.
+
+        >>> policy = Policy(weekends=(SAT, SUN), holidays=(date(2011, 7, 1),))
+        >>> policy.add_holidays([date(2011, 6, 30)])
+        >>> policy.holidays
+        [datetime.date(2011, 6, 30), datetime.date(2011, 7, 1)]
+        """
+        with _write_lock:
+            self._update(self._state.calendar.with_holidays(added=[h.toordinal() for h in holidays]))
+
+    def remove_holidays(self, holidays):
+        """Removes holidays, the ones not listed by the policy being ignored.
+
+        >>> policy = Policy(weekends=(SAT, SUN), holidays=(date(2011, 6, 30), date(2011, 7, 1)))
+        >>> policy.remove_holidays([date(2011, 6, 30)])
+        >>> policy.holidays
+        [datetime.date(2011, 7, 1)]
+        """
+        with _write_lock:
+            self._update(self._state.calendar.with_holidays(removed=[h.toordinal() for h in holidays]))
+
+    def _get_holiday_rules(self):
+        return list(self._state.calendar.holiday_rules)
+
+    def _set_holiday_rules(self, holiday_rules):
+        with _write_lock:
+            calendar = self._state.calendar
+            self._update(CompiledCalendar.intern(
+                calendar.weekend_mask, calendar._base_ordinals, holiday_rules,
+                calendar.cycle, calendar.cycle_anchor, calendar.parts))
+
+    holiday_rules = property(_get_holiday_rules, _set_holiday_rules)
+
+    @property
+    def cycle(self):
+        """For rotating schedules, whether each day of the cycle is a business
+        day. None when weekends are weekly."""
+        return self._state.calendar.cycle_days
+
+    @property
+    def cycle_start(self):
+        """For rotating schedules, a day on which the cycle starts."""
+        return self._state.calendar.cycle_start
+
+    def intersection(self, *others):
+        """Returns a policy whose business days are the business days of
+        this policy and of all the others, e.g. to settle in two markets.
+        Policy & other is the same.
+
+        Policies must have the same hours.
+
+        >>> paris = Policy(weekends=(SAT, SUN), holidays=(date(2011, 7, 14),))
+        >>> new_york = Policy(weekends=(SAT, SUN), holidays=(date(2011, 7, 4),))
+        >>> (paris & new_york).closest_biz_day(date(2011, 7, 2))
+        datetime.date(2011, 7, 5)
+        """
+        return self._combine(others, 'all')
+
+    def union(self, *others):
+        """Returns a policy whose business days are the business days of
+        this policy or of any of the others, e.g. to trade on any venue.
+        Policy | other is the same.
+
+        Policies must have the same hours.
+
+        >>> paris = Policy(weekends=(SAT, SUN), holidays=(date(2011, 7, 14),))
+        >>> new_york = Policy(weekends=(SAT, SUN), holidays=(date(2011, 7, 4),))
+        >>> (paris | new_york).is_day_off(date(2011, 7, 4))
+        False
+        """
+        return self._combine(others, 'any')
+
+    def _combine(self, others, how):
+        def same(hours):
+            return tuple(hours) if hours is not None and not isinstance(hours, BusinessHours) else hours
+
+        state = self._state
+        for other in others:
+            if same(other.hours) != same(state.hours):
+                raise AssertionError("Combined policies must have the same hours")
+        calendars = [state.calendar] + [other.calendar for other in others]
+        return Policy(calendar=CompiledCalendar.combine(calendars, how), hours=state.hours)
+
+    def __and__(self, other):
+        if not isinstance(other, Policy):
+            return NotImplemented
+        return self.intersection(other)
+
+    def __or__(self, other):
+        if not isinstance(other, Policy):
+            return NotImplemented
+        return self.union(other)
+
+    def _get_hours(self):
+        return self._state.hours
+
+    def _set_hours(self, hours):
+        _check_hours(hours)
+        with _write_lock:
+            self._update(hours=hours)
+
+    hours = property(_get_hours, _set_hours)
+
+    def enable_cache(self, maxsize=1024):
+        """Remember the results of add, add_days, closest_biz_day and biz_day_delta.
+
+        At most maxsize results are kept, the least recently used ones being
+        evicted first. The cache is emptied whenever weekends, holidays or
+        hours change.
+
+        >>> policy = Policy(weekends=(SAT, SUN), holidays=(date(2011, 7, 1),))
+        >>> policy.enable_cache(maxsize=2)
+        >>> policy.biz_day_delta(date(2011, 7, 4), date(2011, 6, 30))
+        1
+        >>> policy.biz_day_delta(date(2011, 7, 4), date(2011, 6, 30))
+        1
+        >>> policy.cache_info()
+        CacheInfo(hits=1, misses=1, evictions=0, maxsize=2, currsize=1)
+        """
+        if maxsize < 1:
+            raise AssertionError("Cache size must be positive")
+        self._cache = _LRUCache(maxsize)
+
+    def disable_cache(self):
+        """Stop remembering results and drop the cache."""
+        self._cache = None
+
+    def clear_cache(self):
+        """Drop all remembered results, keeping the counters."""
+        if self._cache is not None:
+            self._cache.clear()
+
+    def cache_info(self):
+        """Returns a CacheInfo with hits, misses, evictions, maxsize and
+        currsize, or None when the cache is disabled."""
+        if self._cache is None:
+            return None
+        return self._cache.info()
+
+    def enable_stats(self, hook=None):
+        """Record, for each method, the number of calls, the time spent, the
+        iterations of inner loops walking the calendar (e.g. over clusters of
+        holidays) and the maximum depth of recursion.
+
+        Calls made by a method are accounted to it. hook, if given, is called
+        after every call with the method name and the MethodStats of the call.
+        Snapshots of the policy share its stats.
+
+        >>> policy = Policy(weekends=(SAT, SUN), holidays=(date(2011, 7, 1),))
+        >>> policy.enable_stats()
+        >>> policy.add_days(date(2011, 6, 29), 22)
+        datetime.date(2011, 8, 1)
+        >>> stats = policy.stats_info()['add_days']
+        >>> stats.calls, stats.iterations, stats.max_depth
+        (1, 5, 2)
+        """
+        self._stats = _StatsRecorder(hook)
+        self.__class__ = _recording_class(getattr(self, '_plain_class', self.__class__))
+
+    def disable_stats(self):
+        """Stop recording calls and drop the stats."""
+        self.__class__ = getattr(self, '_plain_class', self.__class__)
+        self._stats = None
+
+    def clear_stats(self):
+        """Drop the stats recorded so far, keeping the hook."""
+        if self._stats is not None:
+            self._stats.clear()
+
+    def stats_info(self):
+        """Returns a dict of MethodStats with calls, seconds, iterations and
+        max_depth by method name, or None when stats are disabled."""
+        if self._stats is None:
+            return None
+        return self._stats.info()
+
+    def is_day_off_ordinal(self, ordinal):
+        """Same as is_day_off, for a day ordinal (see date.toordinal).
+
+        >>> Policy(weekends=(SAT, SUN)).is_day_off_ordinal(date(2011, 7, 2).toordinal())
+        True
+        """
+        return self._state.calendar.is_day_off(ordinal)
+
+    def compile(self, start, end):
+        """Precompute the business days between start and end (both included).
+
+        Within that range, add_days, add, biz_day_delta and closest_biz_day
+        are answered with an index lookup or a bisect instead of walking the
+        calendar. Anything falling outside of the range uses the regular code.
+        The table is kept up to date when weekends or holidays change.
+
+        >>> policy = Policy(weekends=(SAT, SUN), holidays=(date(2011, 7, 1),))
+        >>> policy.compile(date(2011, 1, 1), date(2011, 12, 31))
+        >>> policy.add_days(date(2011, 6, 29), 2)
+        datetime.date(2011, 7, 4)
+        """
+        if isinstance(start, datetime):
+            start = start.date()
+        if isinstance(end, datetime):
+            end = end.date()
+        if end < start:
+            raise AssertionError("Compiled range must not end before it starts")
+        with _write_lock:
+            self._compiled_range = (start, end)
+            self._update()
+
+    def save_compiled(self, path):
+        """Write the compiled table to a file which load_compiled can map in memory.
+
+        The file holds the weekends, business hours and holidays of the policy
+        along with the cumulative business days counts of the compiled range.
+        Holidays generated by rules are saved as plain holidays, for the years
+        used so far, which include the compiled range.
+        """
+        state = self._state
+        if state.compiled_counts is None:
+            raise AssertionError("Policy must be compiled first")
+        if state.calendar.cycle != 7:
+            raise AssertionError("Rotating schedules can not be saved")
+        if isinstance(state.hours, BusinessHours):
+            raise AssertionError("Business hours varying with the day can not be saved")
+        if state.hours is None:
+            begin = end = -1
+        else:
+            begin = int(_seconds_of_day(state.hours[0]))
+            end = int(_seconds_of_day(state.hours[1]))
+        counts = array(str('i'), state.compiled_counts)
+        holidays = array(str('i'), state.calendar.holiday_ordinals)
+        if sys.byteorder == 'big':
+            counts.byteswap()
+            holidays.byteswap()
+        with open(path, 'wb') as f:
+            f.write(_CALENDAR_HEADER.pack(
+                _CALENDAR_MAGIC, _CALENDAR_VERSION, state.calendar.weekend_mask, begin, end,
+                state.compiled_first, len(counts) - 1, len(holidays),
+            ))
+            f.write(counts)
+            f.write(holidays)
+
+    @classmethod
+    def load_compiled(cls, path):
+        """Returns a compiled policy from a file written by save_compiled.
+
+        The file is mapped in memory and the compiled table is read from it
+        without being copied, so processes loading the same file share it.
+        """
+        with open(path, 'rb') as f:
+            buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(buf) < _CALENDAR_HEADER.size:
+            raise ValueError("Not a compiled calendar file: %s" % path)
+        magic, version, mask, begin, end, first, ndays, nholidays = _CALENDAR_HEADER.unpack_from(buf, 0)
+        if magic != _CALENDAR_MAGIC or version != _CALENDAR_VERSION:
+            raise ValueError("Not a compiled calendar file: %s" % path)
+        offset = _CALENDAR_HEADER.size
+        # Views of a truncated file would silently be shorter than the header says
+        if len(buf) < offset + (ndays + 1 + nholidays) * 4:
+            raise ValueError("Truncated compiled calendar file: %s" % path)
+        counts = _int32_array(buf, offset, ndays + 1)
+        offset += (ndays + 1) * 4
+        holidays = _int32_array(buf, offset, nholidays)
+
+        hours = None
+        if begin >= 0:
+            hours = tuple(time(s // 3600, s // 60 % 60, s % 60) for s in (begin, end))
+        policy = cls(calendar=CompiledCalendar.intern(mask, holidays), hours=hours)
+        policy._compiled_range = (date.fromordinal(first), date.fromordinal(first + ndays - 1))
+        policy._state = policy._state._replace(compiled_first=first, compiled_counts=counts)
+        return policy
+
+    def _compiled_index(self, state, ordinal):
+        """Returns the index of the day ordinal in the compiled table, or None."""
+        if state.compiled_counts is None:
+            return None
+        k = ordinal - state.compiled_first
+        if 0 <= k < len(state.compiled_counts) - 1:
+            return k
+        return None
+
+    def _count_biz_days(self, state, ordinal1, ordinal2):
+        """Returns the number of business days in [ordinal1, ordinal2)."""
+        if state.compiled_counts is not None:
+            k1 = ordinal1 - state.compiled_first
+            k2 = ordinal2 - state.compiled_first
+            if 0 <= k1 and k2 < len(state.compiled_counts):
+                return state.compiled_counts[k2] - state.compiled_counts[k1]
+        calendar = state.calendar
+        weeks, extra = divmod(ordinal2 - ordinal1, calendar.cycle)
+        n = weeks * (calendar.weeklen)
+        for ordinal in range(ordinal2 - extra, ordinal2):
+            if not calendar.is_weekend(ordinal):
+                n += 1
+        calendar.expand(ordinal1, ordinal2)
+        holidays = calendar.workday_holiday_ordinals
+        return n - (bisect_left(holidays, ordinal2) - bisect_left(holidays, ordinal1))
+
     def is_empty(self):
         """ Returns True is policy has no weekends or holidays.
 
@@ -81,7 +1372,8 @@ class Policy(object):
         >>> policy.is_empty()
         False
         """
-        return not (self.weekends or self._holidays)
+        calendar = self._state.calendar
+        return not (calendar.weekend_mask or calendar.holiday_ordinals or calendar.is_lazy)
 
     def is_weekend(self, day):
         """ Returns True only if the day falls on a weekend.
@@ -96,7 +1388,7 @@ class Policy(object):
         >>> policy.is_weekend(date(2011, 7, 4)) # Monday
         False
         """
-        return day.weekday() in self.weekends
+        return self._state.calendar.is_weekend(day.toordinal())
 
     def is_holiday(self, day):
         """ Returns true only if the day falls on a holiday.
@@ -106,7 +1398,7 @@ class Policy(object):
         >>> policy.is_holiday(date(2011, 7, 2)) # Saturday
         False
         """
-        return day in self._holidays
+        return self._state.calendar.is_holiday(day.toordinal())
 
     def is_day_off(self, day):
         """ Returns True if the day is either weekend or holiday.
@@ -121,7 +1413,7 @@ class Policy(object):
         >>> policy.is_day_off(date(2011, 7, 4)) # Monday
         False
         """
-        return self.is_weekend(day) or self.is_holiday(day)
+        return self._state.calendar.is_day_off(day.toordinal())
 
     def is_not_in_business_hours(self, day):
         """ Returns if the datetime is not in business hours.
@@ -132,14 +1424,22 @@ class Policy(object):
         >>> policy.is_not_in_business_hours(datetime(2011, 7, 1, 15, 0, 0))
         False
         """
-        if self.hours is None:
+        hours = self._state.hours
+        if hours is None:
             return False
 
-        if self.hours[0] < self.hours[1]:
-            return day.time() < self.hours[0] or day.time() > self.hours[1]
+        if isinstance(hours, BusinessHours):
+            ordinal = day.toordinal()
+            seconds = _seconds_of_day(day)
+            return not (hours.contains(ordinal, seconds) or hours.contains(ordinal - 1, seconds + SECONDS_PER_DAY))
+
+        if hours[0] < hours[1]:
+            return day.time() < hours[0] or day.time() > hours[1]
         else:
-            return day.time() < self.hours[0] and day.time() > self.hours[1]
+            return day.time() < hours[0] and day.time() > hours[1]
 
+    @_instrumented
+    @_memoized
     def closest_biz_day(self, day, forward=True):
         """If the given date falls on a weekend or holiday, returns the closest
         business day. Otherwise the original date is returned. If forward is
@@ -156,15 +1456,48 @@ class Policy(object):
         >>> policy.closest_biz_day(date(2011, 7, 1), False) # Previous closest buisuness day
         datetime.date(2011, 6, 30)
         """
+        ordinal = day.toordinal()
+        return day + timedelta(days=self._closest_biz_day(self._state, ordinal, forward) - ordinal)
 
-        if forward:
-            delta = timedelta(days=1)
-        else:
-            delta = timedelta(days=-1)
-        while day.weekday() in self.weekends or day in self.holidays:
-            day = day + delta
-        return day
+    @_instrumented
+    def closest_biz_day_ordinal(self, ordinal, forward=True):
+        """Same as closest_biz_day, for a day ordinal.
 
+        >>> policy = Policy(weekends=(SAT, SUN), holidays=(date(2011,  7,  1), ))
+        >>> date.fromordinal(policy.closest_biz_day_ordinal(date(2011, 7, 1).toordinal()))
+        datetime.date(2011, 7, 4)
+        """
+        return self._closest_biz_day(self._state, ordinal, forward)
+
+    def _closest_biz_day(self, state, ordinal, forward=True):
+        k = self._compiled_index(state, ordinal)
+        if k is not None:
+            counts = state.compiled_counts
+            if forward:
+                # First index m such that [first, first + m) holds one more business day
+                m = bisect_right(counts, counts[k], k + 1)
+                if m < len(counts):
+                    return ordinal + m - 1 - k
+            elif counts[k + 1]:
+                m = bisect_left(counts, counts[k + 1], 0, k + 2)
+                return ordinal + m - 1 - k
+
+        calendar = state.calendar
+        delta = 1 if forward else -1
+        # Weekends are jumped over at once, holidays one day at a time
+        gaps = calendar.weekday_gaps[0 if forward else 1]
+        steps = 0
+        while calendar.is_day_off(ordinal):
+            steps += 1
+            if calendar.is_weekend(ordinal):
+                ordinal += delta * gaps[(ordinal - calendar.cycle_anchor) % calendar.cycle]
+            else:
+                ordinal += delta
+        if self._stats is not None:
+            self._stats.iterate(steps)
+        return ordinal
+
+    @_instrumented
     def holidays_between(self, day1, day2, skip_weekends=True):
         """
         Returns the number of holidays between two given dates, excluding
@@ -177,79 +1510,247 @@ class Policy(object):
         >>> policy.holidays_between(date(2011,  7,  1), date(2011, 8, 1))
         0
         """
+        return self._holidays_between(self._state, day1.toordinal(), day2.toordinal(), skip_weekends)
 
-        if day1 > day2:
-            return self.holidays_between(day2, day1)
-        if day1 == day2:
+    def _holidays_between(self, state, ordinal1, ordinal2, skip_weekends=True):
+        if ordinal1 > ordinal2:
+            ordinal1, ordinal2 = ordinal2, ordinal1
+        if ordinal2 - ordinal1 < 2:
             return 0
-        if isinstance(day1, datetime):
-            day1 = day1.date()
-        if isinstance(day2, datetime):
-            day2 = day2.date()
-
-        n = 0
-        # FIXME: should probably use bisect here
-        for h in self._holidays:
-            if h > day1:
-                if h >= day2:
-                    break
-                if skip_weekends:
-                    if h.weekday() not in self.weekends:
-                        n += 1
-                else:
-                    n += 1
-        return n
 
+        calendar = state.calendar
+        calendar.expand(ordinal1, ordinal2)
+        if skip_weekends:
+            ordinals = calendar.workday_holiday_ordinals
+        else:
+            ordinals = calendar.holiday_ordinals
+        return bisect_left(ordinals, ordinal2) - bisect_right(ordinals, ordinal1)
+
+    @_instrumented
     def add_seconds(self, day, seconds):
         """Adds the given seconds to the day.
 
         It is mainly intended as a helper for the add function but can be called from outside.
+        When hours[0] is after hours[1], the business hours of a day end on the next morning.
 
         Args:
             day: datetime.datetime, the given day.
-            seconds: integer, the number of seconds to add.
+            seconds: integer, the number of seconds to add, possibly negative.
 
-        >>> policy = Policy(weekends=(SAT, SUN), holidays=(date(2011,7,1)), hours=(time(8), time(20)))
+        >>> policy = Policy(weekends=(SAT, SUN), holidays=(date(2011,7,1),), hours=(time(8), time(20)))
         >>> day = datetime(2011, 6, 30, 14, 30)
         >>> policy.add_seconds(day, 3600) # One hour after
         datetime.datetime(2011, 6, 30, 15, 30)
-        >>> policy.add(day, 36000) # The next working day
+        >>> policy.add_seconds(day, -7 * 3600) # One hour before closing, the day before
+        datetime.datetime(2011, 6, 29, 19, 30)
+        >>> policy.add_seconds(day, 36000) # The next working day
         datetime.datetime(2011, 7, 4, 12, 30)
         """
-        if self.hours is None:
-            if self.is_day_off(day):
-                day = set_time(day, time())
-            return self.closest_biz_day(day + timedelta(seconds=seconds))
-
-        begin_hours = self.hours[0]
-        end_hours = self.hours[1]
-
-        # Put us in business hours
-        if self.is_day_off(day):
-            day = set_time(day, begin_hours)
-            day = self.closest_biz_day(day, forward=True)
-
-        elif self.is_not_in_business_hours(day):
-            if day.time() > begin_hours:
-                day += timedelta(days=1)
-            day = set_time(day, begin_hours)
-
-        # Fill the current day
-        end_of_day = set_time(day, end_hours)
-        if day.time() > end_hours:
-            end_of_day += timedelta(days=1)
-        seconds_in_day = (end_of_day - day).seconds
-
-        if seconds <= seconds_in_day:
-            # All the seconds are in the current day
-            return day + timedelta(seconds=seconds)
-        else:
-            # Move to next day
-            if not (day.time() < begin_hours):
-                day += timedelta(days=1)
-            next_day = set_time(day, begin_hours)
-            return self.add_seconds(next_day, seconds - seconds_in_day)
+        ordinal, seconds_of_day = self._add_seconds(self._state, day.toordinal(), _seconds_of_day(day), seconds)
+        return _moved(day, ordinal, seconds_of_day)
+
+    @_instrumented
+    def add_seconds_epoch(self, timestamp, seconds):
+        """Same as add_seconds, for a number of seconds elapsed since
+        1970-01-01 00:00, time zones being ignored like with naive datetimes.
 
+        >>> policy = Policy(weekends=(SAT, SUN), holidays=(date(2011,7,1),), hours=(time(8), time(20)))
+        >>> policy.add_seconds_epoch(1309444200, 36000)  # 2011-06-30 14:30
+        1309782600
+        """
+        days, seconds_of_day = divmod(timestamp, SECONDS_PER_DAY)
+        ordinal, seconds_of_day = self._add_seconds(self._state, int(days) + EPOCH_ORDINAL, seconds_of_day, seconds)
+        result = (ordinal - EPOCH_ORDINAL) * SECONDS_PER_DAY + seconds_of_day
+        return int(result) if result == int(result) else result
+
+    def _add_seconds(self, state, ordinal, seconds_of_day, seconds):
+        """add_seconds on a day ordinal and the seconds elapsed since its
+        midnight, returns the resulting ordinal and seconds of that day."""
+        hours = state.hours
+        if hours is None:
+            if seconds >= 0 and state.calendar.is_day_off(ordinal):
+                seconds_of_day = 0
+            days, seconds_of_day = divmod(seconds_of_day + seconds, SECONDS_PER_DAY)
+            return self._closest_biz_day(state, ordinal + int(days), seconds >= 0), seconds_of_day
+
+        if isinstance(hours, BusinessHours):
+            year, position = self._schedule_position(state, ordinal, seconds_of_day)
+            if not seconds:
+                end, end_seconds = self._schedule_time(state, year, position, latest=False)
+                if (end - ordinal) * SECONDS_PER_DAY + end_seconds == seconds_of_day:
+                    # The end of business hours is still within them
+                    return ordinal, seconds_of_day
+            # Outside business hours, moving forward starts from the next ones
+            return self._schedule_time(state, year, position + seconds, latest=seconds <= 0)
+
+        forward = seconds >= 0
+        begin, length = self._hours_window(state)
+        ordinal, offset = self._locate_in_window(state, ordinal, seconds_of_day, forward)
+
+        offset += seconds
+        if offset > length:
+            # Skip as many whole windows as needed, the last one being partial
+            days = int(-((length - offset) // length))
+            offset -= days * length
+            ordinal = self._add_ordinal(state, ordinal, days)
+        elif offset < 0:
+            days = int(-(offset // length))
+            offset += days * length
+            ordinal = self._add_ordinal(state, ordinal, -days)
+        return ordinal, begin + offset
+
+    @_instrumented
+    def biz_seconds_between(self, day1, day2):
+        """Returns the number of business seconds elapsed between two datetimes.
+
+        Without business hours, every business day counts for 24 hours.
+
+        >>> policy = Policy(weekends=(SAT, SUN), holidays=(date(2011,7,1),), hours=(time(8), time(20)))
+        >>> policy.biz_seconds_between(datetime(2011, 6, 30, 14, 30), datetime(2011, 7, 4, 12, 30))
+        36000
+        """
+        if day2 < day1:
+            day1, day2 = day2, day1
+        return self._biz_seconds_between(
+            self._state, day1.toordinal(), _seconds_of_day(day1), day2.toordinal(), _seconds_of_day(day2))
+
+    @_instrumented
+    def biz_seconds_between_epoch(self, timestamp1, timestamp2):
+        """Same as biz_seconds_between, for numbers of seconds elapsed since
+        1970-01-01 00:00 (see add_seconds_epoch).
+
+        >>> policy = Policy(weekends=(SAT, SUN), holidays=(date(2011,7,1),), hours=(time(8), time(20)))
+        >>> policy.biz_seconds_between_epoch(1309444200, 1309782600)
+        36000
+        """
+        if timestamp2 < timestamp1:
+            timestamp1, timestamp2 = timestamp2, timestamp1
+        days1, seconds1 = divmod(timestamp1, SECONDS_PER_DAY)
+        days2, seconds2 = divmod(timestamp2, SECONDS_PER_DAY)
+        return self._biz_seconds_between(
+            self._state, int(days1) + EPOCH_ORDINAL, seconds1, int(days2) + EPOCH_ORDINAL, seconds2)
+
+    def _biz_seconds_between(self, state, ordinal1, seconds1, ordinal2, seconds2):
+        hours = state.hours
+        if isinstance(hours, BusinessHours):
+            year1, position1 = self._schedule_position(state, ordinal1, seconds1)
+            year2, position2 = self._schedule_position(state, ordinal2, seconds2)
+            seconds = position2 - position1 + sum(
+                state.calendar.business_seconds(hours, year)[-1] for year in range(year1, year2))
+        else:
+            begin, length = self._hours_window(state)
+            ordinal1, offset1 = self._locate_in_window(state, ordinal1, seconds1)
+            ordinal2, offset2 = self._locate_in_window(state, ordinal2, seconds2)
+            seconds = self._count_biz_days(state, ordinal1, ordinal2) * length + offset2 - offset1
+        return int(seconds) if seconds == int(seconds) else seconds
+
+    def _locate_in_window(self, state, ordinal, seconds_of_day, forward=True):
+        """Returns the business day whose window holds the given day ordinal
+        and seconds since its midnight, and the number of seconds since the
+        beginning of that window.
+
+        Outside business hours, the beginning of the next window is returned,
+        or the end of the previous one if forward is False.
+        """
+        begin, length = self._hours_window(state)
+        offset = seconds_of_day - begin
+        # Windows of 24 hours end right when the next ones begin
+        if offset < 0 or not offset and length == SECONDS_PER_DAY:
+            if offset + SECONDS_PER_DAY <= length:
+                # Still in the overnight window opened the day before
+                ordinal -= 1
+                offset += SECONDS_PER_DAY
+            elif forward:
+                offset = 0
+            else:
+                ordinal -= 1
+                offset = length
+        elif offset > length:
+            if forward:
+                ordinal += 1
+                offset = 0
+            else:
+                offset = length
+        if state.calendar.is_day_off(ordinal):
+            ordinal = self._closest_biz_day(state, ordinal, forward)
+            offset = 0 if forward else length
+        return ordinal, offset
+
+    def _schedule_position(self, state, ordinal, seconds):
+        """Returns the year of the day ordinal and the number of business
+        seconds elapsed from the beginning of that year up to the given
+        seconds since its midnight, for BusinessHours."""
+        calendar, hours = state.calendar, state.hours
+        year = date.fromordinal(ordinal).year
+        table = calendar.business_seconds(hours, year)
+        position = table[ordinal - date(year, 1, 1).toordinal()]
+        if not calendar.is_day_off(ordinal):
+            position += hours.elapsed(ordinal, seconds)
+        if not calendar.is_day_off(ordinal - 1):
+            # Business hours of the day before may end after midnight
+            position -= hours.length(ordinal - 1) - hours.elapsed(ordinal - 1, seconds + SECONDS_PER_DAY)
+        return year, position
+
+    def _schedule_time(self, state, year, position, latest=False):
+        """Returns a business day and the number of seconds since its
+        midnight at which the given business seconds from the beginning of the
+        year have elapsed, for BusinessHours.
+
+        Between business hours, the end of the previous ones is returned, or
+        the beginning of the next ones if latest is True.
+        """
+        calendar, hours = state.calendar, state.hours
+        table = calendar.business_seconds(hours, year)
+        first_year = year
+        # Whole years are skipped using their totals
+        while position < 0 or position == 0 and not latest:
+            year -= 1
+            table = calendar.business_seconds(hours, year)
+            position += table[-1]
+            if not table[-1]:
+                self._check_schedule(state, year, forward=False)
+        while position > table[-1] or position == table[-1] and latest:
+            if not table[-1]:
+                self._check_schedule(state, year, forward=True)
+            position -= table[-1]
+            year += 1
+            table = calendar.business_seconds(hours, year)
+        if self._stats is not None:
+            self._stats.iterate(abs(year - first_year))
+        m = bisect_right(table, position) if latest else bisect_left(table, position)
+        ordinal = date(year, 1, 1).toordinal() + m - 1
+        return ordinal, hours.time_at(ordinal, position - table[m - 1], latest)
+
+    def _check_schedule(self, state, year, forward):
+        """Raises ValueError when no later year, or no earlier one if
+        forward is False, can hold business hours: none of the weekdays with
+        hours is ever a business day, and no special day is left."""
+        calendar, hours = state.calendar, state.hours
+        period = 7 * calendar.cycle // _gcd(7, calendar.cycle)
+        if any(hours.length(ordinal) and not calendar.is_weekend(ordinal) for ordinal in range(1, period + 1)):
+            return
+        first, last = date(year, 1, 1).toordinal(), date(year, 12, 31).toordinal()
+        if any(intervals and (ordinal > last if forward else ordinal < first) for ordinal, intervals in hours._special):
+            return
+        raise ValueError("No business hours fall on a business day")
+
+    def _hours_window(self, state):
+        """Returns when business hours begin and how long they last, in seconds.
+
+        The window ends on the next day when hours[0] is not before hours[1].
+        Without business hours, the window is the whole day.
+        """
+        hours = state.hours
+        if hours is None:
+            return 0, SECONDS_PER_DAY
+        begin = _seconds_of_day(hours[0])
+        length = _seconds_of_day(hours[1]) - begin
+        if length <= 0:
+            length += SECONDS_PER_DAY
+        return begin, length
+
+    @_instrumented
+    @_memoized
     def add_days(self, day, days):
         """Adds the given number of days.
 
@@ -263,9 +1764,25 @@ class Policy(object):
         datetime.date(2011, 7, 4)
         >>> policy.add_days(day, 22) # Spanning two holidays and several weekends
         datetime.date(2011, 8, 2)
-        >>> policy.add_days(day, 10, reverse=True) # 10 business days (2 weeks) ago
+        >>> policy.add_days(day, -10) # 10 business days (2 weeks) ago
         datetime.date(2011, 6, 15)
         """
+        ordinal = day.toordinal()
+        return day + timedelta(days=self._add_ordinal(self._state, ordinal, days) - ordinal)
+
+    @_instrumented
+    def add_ordinal(self, ordinal, days):
+        """Same as add_days, for a day ordinal.
+
+        >>> policy = Policy(weekends=(SAT, SUN), holidays=(date(2011,7,1), date(2011,8,1)))
+        >>> date.fromordinal(policy.add_ordinal(date(2011, 6, 29).toordinal(), 2))
+        datetime.date(2011, 7, 4)
+        """
+        return self._add_ordinal(self._state, ordinal, days)
+
+    def _add_ordinal(self, state, ordinal, days, depth=1):
+        if self._stats is not None:
+            self._stats.iterate(0, depth)
         if days < 0:
             sign = -1
             look_forward = False
@@ -273,27 +1790,52 @@ class Policy(object):
             sign = 1
             look_forward = True
 
-        if self.weekends:
-            weeklen = 7 - len(self.weekends)
+        if days:
+            k = self._compiled_index(state, ordinal)
+            if k is not None:
+                counts = state.compiled_counts
+                if days > 0:
+                    m = bisect_left(counts, counts[k + 1] + days, k + 1)
+                    if m < len(counts):
+                        return ordinal + m - 1 - k
+                elif counts[k] + days >= 0:
+                    m = bisect_left(counts, counts[k] + days + 1, 0, k + 1)
+                    return ordinal + m - 1 - k
+
+        calendar = state.calendar
+        if calendar.weekend_mask:
+            weeklen = calendar.weeklen
             weeks_add = abs(days) // weeklen * sign
             days_add = abs(days) % weeklen * sign
+            # Start from a weekday so that whole weeks end on a weekday too
+            while days and calendar.is_weekend(ordinal):
+                ordinal -= sign
         else:
             weeks_add = 0
             days_add = days
 
-        new_date = day + timedelta(days=weeks_add * 7)
+        new_ordinal = ordinal + weeks_add * calendar.cycle
+        steps = 0
         while days_add:
             # remaining days may or may not include weekends;
-            new_date = new_date + timedelta(sign)
-            if not self.is_weekend(new_date):
-                days_add -= 1
-
-        days_add = self.holidays_between(day, new_date)  # any holidays?
+            steps += 1
+            new_ordinal += sign
+            if not calendar.is_weekend(new_ordinal):
+                days_add -= sign
+        if self._stats is not None:
+            self._stats.iterate(steps)
+
+        days_add = self._holidays_between(state, ordinal, new_ordinal)  # any holidays?
+        if new_ordinal != ordinal and calendar.is_holiday(new_ordinal) and not calendar.is_weekend(new_ordinal):
+            # landing on a holiday does not count as a business day either
+            days_add += 1
         if days_add:
-            return self.add(new_date, days_add * sign)
+            return self._add_ordinal(state, new_ordinal, days_add * sign, depth + 1)
         else:
-            return self.closest_biz_day(new_date, look_forward)
+            return self._closest_biz_day(state, new_ordinal, look_forward)
 
+    @_instrumented
+    @_memoized
     def add(self, day, delta):
         """Adds a timedelta to the day, taking care of business days.
 
@@ -306,13 +1848,13 @@ class Policy(object):
         datetime.date(2011, 7, 4)
         >>> policy.add(day, timedelta(days=22)) # Spanning two holidays and several weekends
         datetime.date(2011, 8, 2)
-        >>> policy.add(day, timedelta(days=10), reverse=True) # 10 business days (2 weeks) ago
+        >>> policy.add(day, -timedelta(days=10)) # 10 business days (2 weeks) ago
         datetime.date(2011, 6, 15)
 
-        >>> policy = Policy(weekends=(SAT, SUN), holidays=(date(2011,7,1)), hours=(time(8), time(20)))
+        >>> policy = Policy(weekends=(SAT, SUN), holidays=(date(2011,7,1),), hours=(time(8), time(20)))
         >>> day = datetime(2011, 6, 29, 14, 30)
         >>> policy.add(day, timedelta(days=1, hours=5)) # The day after, in the afternoon
-        datetime.datetime(2011, 6, 29, 19, 30)
+        datetime.datetime(2011, 6, 30, 19, 30)
         >>> policy.add(day, timedelta(days=1, hours=10)) # Too many hours, will finish the monday after the long weekend
         datetime.datetime(2011, 7, 4, 12, 30)
         """
@@ -320,37 +1862,53 @@ class Policy(object):
         if isinstance(delta, int):
             delta = timedelta(days=delta)
 
+        if delta < timedelta(0):
+            # timedelta normalizes to negative days and positive seconds
+            delta = -delta
+            sign = -1
+        else:
+            sign = 1
+
+        state = self._state
         if isinstance(day, datetime):
             # Add hours only if the given day is a datetime
-            day = self.add_seconds(day, delta.seconds)
+            ordinal, seconds_of_day = self._add_seconds(
+                state, day.toordinal(), _seconds_of_day(day), sign * delta.seconds)
+            day = _moved(day, ordinal, seconds_of_day)
 
-        return self.add_days(day, delta.days)
+        ordinal = day.toordinal()
+        return day + timedelta(days=self._add_ordinal(state, ordinal, sign * delta.days) - ordinal)
 
     def weekends_between(self, day1, day2):
         """
-        Returns the number of weekends between two dates, including upper boundary.
+        Returns the number of weekend days between two dates, including the
+        lower boundary and excluding the upper one.
 
         >>> policy = Policy(weekends=(SAT, SUN))
         >>> policy.weekends_between(date(2011, 6, 3), date(2011, 6, 15))
         4
         >>> policy.weekends_between(date(2011, 6, 4), date(2011, 6, 11)) # SAT to SAT
         2
+        >>> policy.weekends_between(date(2011, 6, 3), date(2011, 6, 4)) # FRI to SAT
+        0
         """
-
-        # FIXME: check about boundaries
         if day2 < day1:
             return self.weekends_between(day2, day1)
-        delta = day2 - day1
-        weeks = delta.days // 7
-        extra = delta.days % 7
-        n = weeks * len(self.weekends)
-        while extra:
-            day = day2 - timedelta(days=extra)
-            if self.is_weekend(day):
+        return self._weekends_between(self._state, day2.toordinal(), (day2 - day1).days)
+
+    def _weekends_between(self, state, ordinal2, days):
+        """weekends_between, from the ordinal of the upper day and the number
+        of whole days between both."""
+        calendar = state.calendar
+        weeks, extra = divmod(days, calendar.cycle)
+        n = weeks * (calendar.cycle - calendar.weeklen)
+        for ordinal in range(ordinal2 - extra, ordinal2):
+            if calendar.is_weekend(ordinal):
                 n += 1
-            extra -= 1
         return n
 
+    @_instrumented
+    @_memoized
     def biz_day_delta(self, day1, day2):
         """
         Returns the number of business days between day1 and day2, excluding
@@ -363,14 +1921,525 @@ class Policy(object):
         10
         """
         if day2 < day1:
-            return self.biz_day_delta(day2, day1)
+            day1, day2 = day2, day1
+        return self._biz_day_delta(self._state, day1.toordinal(), day2.toordinal(), (day2 - day1).days)
 
-        delta = day2 - day1
+    @_instrumented
+    def delta_ordinal(self, ordinal1, ordinal2):
+        """Same as biz_day_delta, for day ordinals.
 
-        return delta.days - self.weekends_between(day1, day2) - self.holidays_between(day1, day2)
+        >>> policy = Policy(weekends=(SAT, SUN), holidays=(date(2011,  7,  1),))
+        >>> policy.delta_ordinal(date(2011, 7, 4).toordinal(), date(2011, 6, 30).toordinal())
+        1
+        """
+        if ordinal2 < ordinal1:
+            ordinal1, ordinal2 = ordinal2, ordinal1
+        return self._biz_day_delta(self._state, ordinal1, ordinal2, ordinal2 - ordinal1)
+
+    def _biz_day_delta(self, state, ordinal1, ordinal2, days):
+        """biz_day_delta, from the ordinals of both days and the number of
+        whole days between them."""
+        k1 = self._compiled_index(state, ordinal1)
+        k2 = self._compiled_index(state, ordinal2)
+        if k1 is not None and k2 is not None:
+            if k1 == k2:
+                return 0
+            counts = state.compiled_counts
+            # Business days strictly between both days; the lower boundary is
+            # accounted for like weekends_between does, on whole days only.
+            n = counts[k2] - counts[k1 + 1]
+            if k2 - days == k1 and not state.calendar.is_weekend(ordinal1):
+                n += 1
+            return n
+
+        weekends = self._weekends_between(state, ordinal2, days)
+        return days - weekends - self._holidays_between(state, ordinal1, ordinal2)
+
+    def _step_weekdays(self, state, ordinal, n, forward=True):
+        """Moves n days which are not weekends away from a day which is not a weekend."""
+        calendar = state.calendar
+        weeks, rest = divmod(n, calendar.weeklen)
+        if forward:
+            gaps = calendar.weekday_gaps[0]
+            ordinal += weeks * calendar.cycle
+            for _ in range(rest):
+                ordinal += gaps[(ordinal - calendar.cycle_anchor) % calendar.cycle]
+        else:
+            gaps = calendar.weekday_gaps[1]
+            ordinal -= weeks * calendar.cycle
+            for _ in range(rest):
+                ordinal -= gaps[(ordinal - calendar.cycle_anchor) % calendar.cycle]
+        return ordinal
+
+    def iter_biz_days(self, start, stop=None, step=1, reverse=False):
+        """Generates every step-th business day from start (included when it
+        is a business day), up to stop (excluded), or forever if stop is None.
+        If reverse is True, days are generated backwards.
+
+        Weekends are skipped a week at a time and holidays are merged in as
+        the iteration goes, so days are produced lazily in a single pass.
+
+        >>> policy = Policy(weekends=(SAT, SUN), holidays=(date(2011, 7, 1), ))
+        >>> list(policy.iter_biz_days(date(2011, 6, 29), date(2011, 7, 6)))
+        [datetime.date(2011, 6, 29), datetime.date(2011, 6, 30), datetime.date(2011, 7, 4), datetime.date(2011, 7, 5)]
+        >>> days = policy.iter_biz_days(date(2011, 7, 3), reverse=True)
+        >>> next(days), next(days)
+        (datetime.date(2011, 6, 30), datetime.date(2011, 6, 29))
+        """
+        if step < 1:
+            raise AssertionError("Step must be a positive number of business days")
+        forward = not reverse
+        start_ordinal = start.toordinal()
+        stop_ordinal = stop.toordinal() if stop is not None else None
+        # The whole iteration uses the version current when it starts
+        state = self._state
+        ordinal = self._closest_biz_day(state, start.toordinal(), forward)
+        calendar = state.calendar
+        holidays = calendar.workday_holiday_ordinals
+        # cursor on the next holiday not yet passed, in the direction of travel
+        if forward:
+            cursor = bisect_right(holidays, ordinal)
+        else:
+            cursor = bisect_left(holidays, ordinal) - 1
+
+        while True:
+            if stop_ordinal is not None and (ordinal >= stop_ordinal if forward else ordinal <= stop_ordinal):
+                return
+            yield start + timedelta(days=ordinal - start_ordinal)
+            days = step
+            while days:
+                previous = ordinal
+                ordinal = self._step_weekdays(state, ordinal, days, forward)
+                days = 0
+                calendar.expand(previous, ordinal)
+                if calendar.workday_holiday_ordinals is not holidays:
+                    # New years of holiday rules, expanded here or by any
+                    # user of the shared calendar: find the cursor again
+                    holidays = calendar.workday_holiday_ordinals
+                    if forward:
+                        cursor = bisect_right(holidays, previous)
+                    else:
+                        cursor = bisect_left(holidays, previous) - 1
+                if forward:
+                    while cursor < len(holidays) and holidays[cursor] <= ordinal:
+                        cursor += 1
+                        days += 1
+                else:
+                    while cursor >= 0 and holidays[cursor] >= ordinal:
+                        cursor -= 1
+                        days += 1
+
+    def biz_day_range(self, start, stop, step=1):
+        """Like range(), for business days: generates every step-th business day
+        from start up to stop (excluded), backwards if step is negative.
+
+        >>> policy = Policy(weekends=(SAT, SUN), holidays=(date(2011, 7, 1), ))
+        >>> list(policy.biz_day_range(date(2011, 7, 5), date(2011, 6, 28), -2))
+        [datetime.date(2011, 7, 5), datetime.date(2011, 6, 30)]
+        """
+        if step == 0:
+            raise AssertionError("Step must not be zero")
+        return self.iter_biz_days(start, stop, abs(step), reverse=step < 0)
+
+    def biz_days_in(self, year, month=None, quarter=None):
+        """Returns the number of business days in a month, a quarter or a
+        whole year if neither is given.
+
+        >>> policy = Policy(weekends=(SAT, SUN), holidays=(date(2011, 7, 1),))
+        >>> policy.biz_days_in(2011, 7), policy.biz_days_in(2011, quarter=3), policy.biz_days_in(2011)
+        (20, 65, 259)
+        """
+        return self._count_biz_days(self._state, *_period(year, month, quarter))
+
+    def nth_biz_day(self, year, month=None, n=1, quarter=None):
+        """Returns the n-th business day of a month, a quarter or a whole year
+        if neither is given, counted from the end of the period if n is
+        negative. Returns None if the period has fewer business days.
+
+        Business days are counted on tables built once per year and shared
+        by the policies of a calendar, so each query is a bisect.
+
+        >>> policy = Policy(weekends=(SAT, SUN), holidays=(date(2011, 7, 1),))
+        >>> policy.nth_biz_day(2011, 7, 1), policy.nth_biz_day(2011, quarter=3, n=5)
+        (datetime.date(2011, 7, 4), datetime.date(2011, 7, 8))
+        """
+        if not n:
+            raise AssertionError("Business days of a period are counted from 1, or from -1 for the last one")
+        ordinal = self._nth_biz_day(self._state, n, *_period(year, month, quarter))
+        return None if ordinal is None else date.fromordinal(ordinal)
+
+    def last_biz_day(self, year, month=None, quarter=None):
+        """Returns the last business day of a month, a quarter or a whole year
+        if neither is given, or None if the period has no business day.
+
+        >>> Policy(weekends=(SAT, SUN)).last_biz_day(2011, 7)
+        datetime.date(2011, 7, 29)
+        """
+        return self.nth_biz_day(year, month, -1, quarter)
+
+    def biz_day_schedule(self, start, stop, n=1, months=1):
+        """Generates the n-th business day (from the end if n is negative) of
+        every period of the given number of months, the first period starting
+        on the month of start and the last one on the month of stop at the
+        latest. Periods without enough business days are skipped.
+
+        >>> policy = Policy(weekends=(SAT, SUN), holidays=(date(2011, 7, 1),))
+        >>> list(policy.biz_day_schedule(date(2011, 1, 1), date(2011, 12, 31), n=-1, months=6))
+        [datetime.date(2011, 6, 30), datetime.date(2011, 12, 30)]
+        """
+        if not n or months < 1:
+            raise AssertionError("Business days are counted from 1 or -1, over periods of at least a month")
+        # The whole schedule uses the version current when it starts
+        state = self._state
+        stop_ordinal = stop.toordinal()
+        month = start.month
+        first = _month_start(start.year, month)
+        while first <= stop_ordinal:
+            last = _month_start(start.year, month + months)
+            ordinal = self._nth_biz_day(state, n, first, last)
+            if ordinal is not None:
+                yield date.fromordinal(ordinal)
+            month += months
+            first = last
+
+    def _year_counts(self, state, year):
+        """Returns the ordinal of January 1st and the business day counts of
+        the year (see CompiledCalendar.business_day_counts)."""
+        first = date(year, 1, 1).toordinal()
+        return first, state.calendar.business_day_counts(first, date(year, 12, 31).toordinal())
+
+    def _nth_biz_day(self, state, n, first, last):
+        """Returns the ordinal of the n-th business day in [first, last),
+        counted from the end if n is negative, or None."""
+        if n > 0:
+            ordinal = first
+            while ordinal < last:
+                year_first, counts = self._year_counts(state, date.fromordinal(ordinal).year)
+                k1 = ordinal - year_first
+                k2 = min(last - year_first, len(counts) - 1)
+                available = counts[k2] - counts[k1]
+                if n <= available:
+                    # counts[m] reaches the n-th business day of the segment on day m - 1
+                    return year_first + bisect_left(counts, counts[k1] + n, k1 + 1, k2 + 1) - 1
+                n -= available
+                ordinal = year_first + len(counts) - 1
+        else:
+            ordinal = last
+            while ordinal > first:
+                year_first, counts = self._year_counts(state, date.fromordinal(ordinal - 1).year)
+                k1 = max(first - year_first, 0)
+                k2 = ordinal - year_first
+                available = counts[k2] - counts[k1]
+                if -n <= available:
+                    return year_first + bisect_left(counts, counts[k1] + available + n + 1, k1 + 1, k2 + 1) - 1
+                n += available
+                ordinal = year_first
+        return None
+
+    def _expand_over(self, state, *days):
+        """Expands the holiday rules and rotating weekends over arrays of
+        dates, returns True if new days off were added."""
+        if not state.calendar.is_lazy and state.calendar.cycle == 7:
+            return False
+        expanded = False
+        for values in days:
+            ordinals = values.astype('datetime64[D]').astype('int64')
+            if ordinals.size:
+                expanded |= state.calendar.cover(
+                    int(ordinals.min()) + EPOCH_ORDINAL, int(ordinals.max()) + EPOCH_ORDINAL)
+        return expanded
+
+    def _get_busdaycalendar(self, state, *days):
+        """Returns the numpy.busdaycalendar, holiday rules being expanded over
+        the given arrays of dates first."""
+        self._expand_over(state, *days)
+        return state.calendar.busdaycalendar()
+
+    @_instrumented
+    def closest_biz_day_many(self, days, forward=True):
+        """Same as closest_biz_day, for an array of dates.
+
+        Args:
+            days: array-like of dates, converted to numpy datetime64[D].
+            forward: boolean, look for the next (default) or previous business day.
+
+        >>> policy = Policy(weekends=(SAT, SUN), holidays=(date(2011,  7,  1), ))
+        >>> policy.closest_biz_day_many(['2011-06-30', '2011-07-01'])
+        array(['2011-06-30', '2011-07-04'], dtype='datetime64[D]')
+        """
+        return self._closest_biz_day_many(self._state, numpy.asarray(days, dtype='datetime64[D]'), forward)
+
+    def _closest_biz_day_many(self, state, days, forward):
+        calendar = self._get_busdaycalendar(state, days)
+        result = numpy.busday_offset(days, 0, roll='forward' if forward else 'backward', busdaycal=calendar)
+        if self._expand_over(state, result):
+            # Holiday rules were expanded for the years of the result, try again
+            return self._closest_biz_day_many(state, days, forward)
+        return result
+
+    @_instrumented
+    def add_many(self, days, deltas):
+        """Same as add_days, for arrays of dates and numbers of days.
+
+        Args:
+            days: array-like of dates, converted to numpy datetime64[D].
+            deltas: integer or array-like of integers, possibly negative,
+                broadcast against days.
+
+        >>> policy = Policy(weekends=(SAT, SUN), holidays=(date(2011,7,1), date(2011,8,1)))
+        >>> policy.add_many(['2011-06-29', '2011-06-29', '2011-07-04'], [2, 22, -1])
+        array(['2011-07-04', '2011-08-02', '2011-06-30'], dtype='datetime64[D]')
+        """
+        return self._add_many(
+            self._state, numpy.asarray(days, dtype='datetime64[D]'), numpy.asarray(deltas, dtype='int64'))
+
+    def _add_many(self, state, days, deltas):
+        calendar = self._get_busdaycalendar(state, days)
+        # Days off are rolled onto the business day behind them, in the
+        # direction of travel, so that counting starts right after them.
+        forward = numpy.busday_offset(days, deltas, roll='backward', busdaycal=calendar)
+        backward = numpy.busday_offset(days, deltas, roll='forward', busdaycal=calendar)
+        result = numpy.where(deltas > 0, forward, backward)
+        if self._expand_over(state, result):
+            # Holiday rules were expanded for the years of the result, try again
+            return self._add_many(state, days, deltas)
+        return result
+
+    @_instrumented
+    def biz_day_delta_many(self, days1, days2):
+        """Same as biz_day_delta, for arrays of dates or datetimes.
+
+        >>> policy = Policy(weekends=(SAT, SUN), holidays=(date(2011,  7,  1),))
+        >>> policy.biz_day_delta_many(['2011-07-04', '2011-06-10'], ['2011-06-30', '2011-06-24'])
+        array([ 1, 10])
+        """
+        state = self._state
+        low = numpy.minimum(_datetime64_array(days1), _datetime64_array(days2))
+        high = numpy.maximum(_datetime64_array(days1), _datetime64_array(days2))
+        calendar = self._get_busdaycalendar(state, low, high)
+        low_day = low.astype('datetime64[D]')
+        high_day = high.astype('datetime64[D]')
+        # Business days strictly between both days, plus the lower one when it
+        # is not a weekend and whole days separate both (see weekends_between).
+        inner = numpy.busday_count(numpy.minimum(low_day + 1, high_day), high_day, busdaycal=calendar)
+        whole_days = (high - low) // numpy.timedelta64(1, 'D')
+        first = (high_day - whole_days == low_day) & ~self._is_weekend_many(state, low_day)
+        return numpy.where(low_day == high_day, 0, inner + first).astype('int64')
+
+    def _is_weekend_many(self, state, days):
+        calendar = state.calendar
+        ordinals = days.astype('datetime64[D]').astype('int64') + EPOCH_ORDINAL
+        position = (ordinals - calendar.cycle_anchor) % calendar.cycle
+        return (calendar.weekend_mask >> position & 1) == 1
+
+    @_instrumented
+    def add_seconds_many(self, days, seconds):
+        """Same as add_seconds, for arrays of datetimes and numbers of seconds.
+
+        Args:
+            days: array-like of datetimes, converted to numpy datetime64[us].
+            seconds: number or array-like of numbers, possibly negative,
+                broadcast against days.
+
+        >>> policy = Policy(weekends=(SAT, SUN), holidays=(date(2011,7,1),), hours=(time(8), time(20)))
+        >>> policy.add_seconds_many(['2011-06-30T14:30', '2011-06-30T14:30'], [3600, 36000])
+        array(['2011-06-30T15:30:00.000000', '2011-07-04T12:30:00.000000'],
+              dtype='datetime64[us]')
+        """
+        return self._add_seconds_many(self._state, numpy.asarray(days, dtype='datetime64[us]'), seconds)
+
+    def _add_seconds_many(self, state, days, seconds):
+        if isinstance(state.hours, BusinessHours):
+            # Not vectorized, each row bisects the business seconds tables
+            days, seconds = numpy.broadcast_arrays(days, numpy.asarray(seconds, dtype='float64'))
+            return numpy.array([
+                _moved(day, *self._add_seconds(state, day.toordinal(), _seconds_of_day(day), delta))
+                for day, delta in zip(days.tolist(), seconds.tolist())
+            ], dtype='datetime64[us]').reshape(days.shape)
+        calendar = self._get_busdaycalendar(state, days)
+        ticks = days.astype('int64')
+        micros = numpy.round(numpy.asarray(seconds, dtype='float64') * 1e6).astype('int64')
+        ticks, micros = numpy.broadcast_arrays(ticks, micros)
+        day_length = SECONDS_PER_DAY * 1000000
+        ordinals = ticks // day_length
+        forward = micros >= 0
+
+        def roll(ordinals, forward):
+            """closest_biz_day, forward or backward row by row."""
+            ordinals = ordinals.astype('datetime64[D]')
+            return numpy.where(
+                forward,
+                numpy.busday_offset(ordinals, 0, roll='forward', busdaycal=calendar),
+                numpy.busday_offset(ordinals, 0, roll='backward', busdaycal=calendar),
+            ).astype('int64')
+
+        if state.hours is None:
+            day_off = ~numpy.is_busday(ordinals.astype('datetime64[D]'), busdaycal=calendar)
+            ticks = numpy.where(day_off & forward, ordinals * day_length, ticks) + micros
+            ordinals = ticks // day_length
+            result = (ticks + (roll(ordinals, forward) - ordinals) * day_length).astype('datetime64[us]')
+        else:
+            begin, length = (int(round(value * 1000000)) for value in self._hours_window(state))
+
+            # Same as _locate_in_window, row by row
+            offsets = ticks - ordinals * day_length - begin
+            before = (offsets < 0) | ((offsets == 0) & (length == day_length))
+            overnight = before & (offsets + day_length <= length)
+            waiting = before & ~overnight
+            after = ~before & (offsets > length)
+            ordinals = ordinals - overnight - (waiting & ~forward) + (after & forward)
+            offsets = numpy.where(overnight, offsets + day_length, offsets)
+            offsets = numpy.where(waiting | after, numpy.where(forward, 0, length), offsets)
+            day_off = ~numpy.is_busday(ordinals.astype('datetime64[D]'), busdaycal=calendar)
+            ordinals = numpy.where(day_off, roll(ordinals, forward), ordinals)
+            offsets = numpy.where(day_off, numpy.where(forward, 0, length), offsets)
+
+            # Skip whole windows, the last one being partial
+            offsets = offsets + micros
+            days_after = numpy.where(offsets > length, -((length - offsets) // length), 0)
+            days_before = numpy.where(offsets < 0, -(offsets // length), 0)
+            offsets = offsets - days_after * length + days_before * length
+            ordinals = numpy.busday_offset(
+                ordinals.astype('datetime64[D]'), days_after - days_before, busdaycal=calendar).astype('int64')
+            result = (ordinals * day_length + begin + offsets).astype('datetime64[us]')
+        if self._expand_over(state, result):
+            # Holiday rules were expanded for the years of the result, try again
+            return self._add_seconds_many(state, days, seconds)
+        return result
+
+
+def _datetime64_array(values):
+    """Converts to a numpy datetime64 array, keeping or guessing its unit."""
+    values = numpy.asarray(values)
+    if values.dtype.kind != 'M':
+        values = numpy.asarray(values.tolist(), dtype='datetime64')
+    return values
+
+
+WEEKDAYS = {'MON': MON, 'TUE': TUE, 'WED': WED, 'THU': THU, 'FRI': FRI, 'SAT': SAT, 'SUN': SUN}
+
+
+def parse_day(value):
+    """Parse an ISO formatted date, or datetime (to the second)."""
+    value = value.strip()
+    if len(value) == 10:
+        return datetime.strptime(value, '%Y-%m-%d').date()
+    return datetime.strptime(value.replace('T', ' '), '%Y-%m-%d %H:%M:%S')
+
+
+def read_holidays(path):
+    """Read a holiday file: one ISO date per line, blank lines and lines
+    starting with # being ignored."""
+    with open(path) as f:
+        return [parse_day(line) for line in f if line.strip() and not line.lstrip().startswith('#')]
+
+
+def _load_policy(options):
+    if options.calendar:
+        return Policy.load_compiled(options.calendar)
+    weekends = [WEEKDAYS[name.strip().upper()] for name in options.weekends.split(',') if name.strip()]
+    holidays = read_holidays(options.holidays) if options.holidays else None
+    hours = None
+    if options.hours:
+        hours = tuple(datetime.strptime(hour.strip(), '%H:%M').time() for hour in options.hours.split('-'))
+    return Policy(weekends=weekends, holidays=holidays, hours=hours)
+
+
+def _evaluate(policy, command, row):
+    if command == 'add':
+        return policy.add(parse_day(row[0]), int(row[1])).isoformat()
+    elif command == 'delta':
+        return str(policy.biz_day_delta(parse_day(row[0]), parse_day(row[1])))
+    else:
+        return policy.closest_biz_day(parse_day(row[0])).isoformat()
+
+
+def _process_chunk(policy, command, rows):
+    return [row + [_evaluate(policy, command, row)] for row in rows]
+
+
+_worker_policy = None
+
+
+def _init_worker(options):
+    global _worker_policy
+    _worker_policy = _load_policy(options)
+
+
+def _process_chunk_in_worker(command, rows):
+    return _process_chunk(_worker_policy, command, rows)
+
+
+def main(argv=None):
+    """Command line entry point, see python -m bizdatim --help."""
+    import argparse
+    import collections
+    import csv
+    import itertools
+
+    parser = argparse.ArgumentParser(
+        prog='python -m bizdatim',
+        description="Business day arithmetic over CSV or newline-delimited rows. "
+                    "Each output row is the input row followed by the result.",
+    )
+    parser.add_argument('command', choices=['add', 'delta', 'next'],
+                        help="add: DATE,DAYS; delta: DATE,DATE; next: DATE (closest business day)")
+    parser.add_argument('-i', '--input', default='-', help="input file, - for stdin (default)")
+    parser.add_argument('-o', '--output', default='-', help="output file, - for stdout (default)")
+    parser.add_argument('-d', '--delimiter', default=',', help="field delimiter (default: ,)")
+    parser.add_argument('-w', '--weekends', default='SAT,SUN', help="comma separated weekends (default: SAT,SUN)")
+    parser.add_argument('-H', '--holidays', help="holiday file, one ISO date per line")
+    parser.add_argument('--hours', help="business hours, as HH:MM-HH:MM")
+    parser.add_argument('-c', '--calendar', help="compiled calendar file (see Policy.save_compiled), "
+                                                 "instead of --weekends, --holidays and --hours")
+    parser.add_argument('--chunk-size', type=int, default=10000, help="rows per chunk (default: 10000)")
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+                        help="number of worker processes, 0 for one per CPU (default: 1)")
+    options = parser.parse_args(argv)
+    if options.chunk_size < 1:
+        parser.error("--chunk-size must be positive")
+    if options.jobs < 0:
+        parser.error("--jobs must not be negative")
+
+    # The csv module reads line endings itself, open has no newline argument on Python 2
+    newline = {} if sys.version_info < (3,) else {'newline': ''}
+    source = sys.stdin if options.input == '-' else open(options.input, **newline)
+    target = sys.stdout if options.output == '-' else open(options.output, 'w')
+    try:
+        # The csv module of Python 2 wants byte strings
+        reader = (row for row in csv.reader(source, delimiter=str(options.delimiter)) if row)
+        writer = csv.writer(target, delimiter=str(options.delimiter), lineterminator=str('\n'))
+        chunks = iter(lambda: list(itertools.islice(reader, options.chunk_size)), [])
+
+        if options.jobs == 1:
+            policy = _load_policy(options)
+            for chunk in chunks:
+                writer.writerows(_process_chunk(policy, options.command, chunk))
+                target.flush()
+        else:
+            import multiprocessing
+            processes = options.jobs or multiprocessing.cpu_count()
+            pool = multiprocessing.Pool(processes, _init_worker, (options,))
+            try:
+                # Keep a bounded number of chunks in flight, written back in order
+                pending = collections.deque()
+                for chunk in chunks:
+                    pending.append(pool.apply_async(_process_chunk_in_worker, (options.command, chunk)))
+                    if len(pending) > 2 * processes:
+                        writer.writerows(pending.popleft().get())
+                        target.flush()
+                while pending:
+                    writer.writerows(pending.popleft().get())
+                    target.flush()
+            finally:
+                pool.terminate()
+    finally:
+        if source is not sys.stdin:
+            source.close()
+        if target is not sys.stdout:
+            target.close()
+    return 0
 
 
 if __name__ == "__main__":
-    # run tests when called directly
-    import doctest
-    doctest.testmod()
+    sys.exit(main())
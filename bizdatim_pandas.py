@@ -0,0 +1,171 @@
+# -*- coding: utf-8 -*-
+
+"""
+pandas integration for bizdatim.
+
+Importing this module registers a ``bizdatim`` accessor on Series and on
+DatetimeIndex, whose methods take the policy to apply as first argument::
+
+    import bizdatim_pandas
+    days = pd.Series(pd.to_datetime(['2011-06-29', '2011-06-30']))
+    days.bizdatim.add(policy, 2)
+    days.bizdatim.biz_day_delta(policy, pd.Timestamp('2011-07-04'))
+    days.bizdatim.closest_biz_day(policy, forward=False)
+
+It also provides PolicyOffset, a DateOffset moving by business days or
+business hours::
+
+    days + PolicyOffset(3, policy=policy)
+    days + PolicyOffset(policy=policy, delta=timedelta(hours=5))
+
+All computations are done on the underlying datetime64 arrays with the
+Policy batch methods, without going through Python objects row by row.
+Timezone aware values are computed on their wall time.
+"""
+
+from datetime import timedelta
+
+import numpy
+import pandas
+
+import bizdatim
+
+__all__ = ['PolicyOffset', 'BizdatimAccessor']
+
+
+def _add(policy, values, delta):
+    """Same as Policy.add on datetime64 values, delta being a number of
+    business days or a timedelta, possibly one per value."""
+    delta = numpy.asarray(delta)
+    if delta.dtype.kind == 'O':
+        # datetime.timedelta or pandas.Timedelta objects
+        delta = numpy.asarray(delta.tolist(), dtype='timedelta64[us]')
+    if delta.dtype.kind == 'm':
+        delta = delta.astype('timedelta64[us]').astype('int64')
+    else:
+        delta = delta.astype('int64') * (bizdatim.SECONDS_PER_DAY * 1000000)
+    # Like timedelta, split into days and seconds with the sign of the whole delta
+    sign = numpy.where(delta < 0, -1, 1)
+    days, micros = divmod(numpy.abs(delta), bizdatim.SECONDS_PER_DAY * 1000000)
+    # Both steps use the same version of the holidays
+    policy = policy.snapshot()
+    moved = policy.add_seconds_many(values, sign * micros / 1e6)
+    start = moved.astype('datetime64[D]')
+    return policy.add_many(start, sign * days) + (moved - start)
+
+
+def _closest_biz_day(policy, values, forward=True):
+    start = values.astype('datetime64[D]')
+    return policy.closest_biz_day_many(start, forward) + (values - start)
+
+
+def _apply(function, policy, values, *args):
+    """Applies function to a datetime64 array, keeping its unit and NaT."""
+    missing = numpy.isnat(values)
+    result = function(policy, numpy.where(missing, numpy.datetime64(0, 'D'), values), *args)
+    return numpy.where(missing, numpy.datetime64('NaT'), result).astype(values.dtype)
+
+
+class PolicyOffset(pandas.DateOffset):
+    """A DateOffset adding n times delta (one day by default) with Policy.add.
+
+    >>> from datetime import date
+    >>> policy = bizdatim.Policy(weekends=(bizdatim.SAT, bizdatim.SUN), holidays=(date(2011, 7, 1),))
+    >>> pandas.Timestamp('2011-06-29') + PolicyOffset(2, policy=policy)
+    Timestamp('2011-07-04 00:00:00')
+    """
+
+    _attributes = ('n', 'normalize', 'policy', 'delta')
+
+    def __init__(self, n=1, normalize=False, policy=None, delta=None):
+        if policy is None:
+            raise AssertionError("A policy is required")
+        pandas.DateOffset.__init__(self, n=n, normalize=normalize)
+        # DateOffset forbids setting attributes once created
+        object.__setattr__(self, 'policy', policy)
+        object.__setattr__(self, 'delta', timedelta(days=1) if delta is None else delta)
+
+    @property
+    def kwds(self):
+        return {'policy': self.policy, 'delta': self.delta}
+
+    def _apply(self, other):
+        result = pandas.Timestamp(self.policy.add(other.to_pydatetime(), self.n * self.delta))
+        if self.normalize:
+            result = result.normalize()
+        return result
+
+    def _apply_array(self, dtarr):
+        result = _apply(_add, self.policy, dtarr, self.n * numpy.timedelta64(self.delta))
+        if self.normalize:
+            result = result.astype('datetime64[D]').astype(dtarr.dtype)
+        return result
+
+    def is_on_offset(self, dt):
+        if self.normalize and not dt == dt.normalize():
+            return False
+        return not self.policy.is_day_off(dt) and not self.policy.is_not_in_business_hours(dt)
+
+
+def _naive(values):
+    """Returns the wall time datetime64 values of a Series, an Index or a Timestamp."""
+    if isinstance(values, pandas.Series):
+        if getattr(values.dt, 'tz', None) is not None:
+            values = values.dt.tz_localize(None)
+        return values.to_numpy()
+    if isinstance(values, (pandas.Index, pandas.Timestamp)):
+        if getattr(values, 'tz', None) is not None:
+            values = values.tz_localize(None)
+        return values.to_numpy() if isinstance(values, pandas.Index) else values.to_datetime64()
+    return values
+
+
+class BizdatimAccessor(object):
+    """Policy arithmetic on a datetime Series or a DatetimeIndex."""
+
+    def __init__(self, obj):
+        if not pandas.api.types.is_datetime64_any_dtype(obj.dtype):
+            raise AttributeError("Can only use .bizdatim accessor with datetimelike values")
+        self._obj = obj
+        self._tz = obj.dt.tz if isinstance(obj, pandas.Series) else obj.tz
+
+    def _wrap(self, result):
+        if result.dtype.kind == 'M':
+            result = pandas.DatetimeIndex(result)
+            if self._tz is not None:
+                result = result.tz_localize(self._tz)
+        else:
+            result = pandas.Index(result)
+        if isinstance(self._obj, pandas.Series):
+            return pandas.Series(result, index=self._obj.index, name=self._obj.name)
+        return result.rename(self._obj.name)
+
+    def add(self, policy, delta):
+        """Same as Policy.add. delta is a number of days or a timedelta, or an
+        array-like of them with one per value."""
+        return self._wrap(_apply(_add, policy, _naive(self._obj), _naive(delta)))
+
+    def closest_biz_day(self, policy, forward=True):
+        """Same as Policy.closest_biz_day."""
+        return self._wrap(_apply(_closest_biz_day, policy, _naive(self._obj), forward))
+
+    def biz_day_delta(self, policy, other):
+        """Same as Policy.biz_day_delta, against a date or an array-like of
+        them with one per value. Missing values give missing deltas."""
+        values = _naive(self._obj)
+        other = numpy.broadcast_to(_naive(other), values.shape)
+        if other.dtype.kind != 'M':
+            other = numpy.asarray(other.tolist(), dtype='datetime64')
+        missing = numpy.isnat(values) | numpy.isnat(other)
+        result = policy.biz_day_delta_many(
+            numpy.where(missing, numpy.datetime64(0, 'D'), values),
+            numpy.where(missing, numpy.datetime64(0, 'D'), other),
+        )
+        if missing.any():
+            result = pandas.array(result, dtype='Int64')
+            result[missing] = pandas.NA
+        return self._wrap(result)
+
+
+pandas.api.extensions.register_series_accessor('bizdatim')(BizdatimAccessor)
+pandas.api.extensions.register_index_accessor('bizdatim')(BizdatimAccessor)
@@ -0,0 +1,302 @@
+# -*- coding: utf-8 -*-
+
+"""
+Business day arithmetic as a local service, for Python 3.
+
+Requests made to the same policy within a short window are coalesced and
+evaluated together, with the Policy batch methods when numpy is installed,
+so that the cost of a call is shared by all the callers waiting for it::
+
+    python -m bizdatim_server --policy paris=paris.bin --port 8080
+    python -m bizdatim_server --policy paris=paris.bin --unix /run/bizdatim.sock
+
+Policies are compiled calendar files (see Policy.save_compiled). Requests are
+HTTP POST /<policy>/<command> with a JSON body, commands being those of the
+command line (python -m bizdatim --help)::
+
+    add: {"day": "2011-06-29", "days": 2}
+    delta: {"day1": "2011-07-04", "day2": "2011-06-30"}
+    next: {"day": "2011-07-01", "forward": true}
+
+Connections are kept alive. The response holds the result and the version
+of the policy which answered (see Policy.snapshot)::
+
+    {"result": "2011-07-04", "version": 0}
+
+Asyncio applications may also submit requests to a Batcher directly.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+from datetime import date, datetime, time
+
+import bizdatim
+
+__all__ = ['Batcher', 'Service', 'serve']
+
+
+def _parse_add(body):
+    return bizdatim.parse_day(body['day']), int(body['days'])
+
+
+def _parse_delta(body):
+    return bizdatim.parse_day(body['day1']), bizdatim.parse_day(body['day2'])
+
+
+def _parse_next(body):
+    forward = body.get('forward', True)
+    if not isinstance(forward, bool):
+        raise ValueError("forward must be true or false")
+    return bizdatim.parse_day(body['day']), forward
+
+
+_COMMANDS = {'add': _parse_add, 'delta': _parse_delta, 'next': _parse_next}
+
+
+def _evaluate(policy, command, args):
+    if command == 'add':
+        return policy.add(*args)
+    elif command == 'delta':
+        return policy.biz_day_delta(*args)
+    else:
+        return policy.closest_biz_day(*args)
+
+
+def _day(value):
+    return value.date() if isinstance(value, datetime) else value
+
+
+def _same_time(value, day):
+    """day at the time of value, if value is a datetime."""
+    return datetime.combine(day, value.time()) if isinstance(value, datetime) else day
+
+
+def _evaluate_many(policy, command, rows):
+    """Evaluates rows of arguments of a command at once, with the batch methods."""
+    if bizdatim.numpy is None:
+        return [_evaluate(policy, command, args) for args in rows]
+    if command == 'add':
+        # Policy.add also moves datetimes into business hours, those are evaluated one by one
+        results = [_evaluate(policy, command, args) if isinstance(args[0], datetime) else None for args in rows]
+        indexes = [i for i, result in enumerate(results) if result is None]
+        if indexes:
+            moved = policy.add_many([rows[i][0] for i in indexes], [rows[i][1] for i in indexes]).tolist()
+            for i, day in zip(indexes, moved):
+                results[i] = day
+        return results
+    elif command == 'delta':
+        # Datetimes all the way, whole days matter (see Policy.weekends_between)
+        days1, days2 = ([day if isinstance(day, datetime) else datetime.combine(day, time()) for day in days]
+                        for days in zip(*rows))
+        return [int(n) for n in policy.biz_day_delta_many(days1, days2)]
+    else:
+        results = [None] * len(rows)
+        for forward in (True, False):
+            indexes = [i for i, (day, direction) in enumerate(rows) if direction is forward]
+            if indexes:
+                days = [rows[i][0] for i in indexes]
+                moved = policy.closest_biz_day_many([_day(day) for day in days], forward).tolist()
+                for i, day, closest in zip(indexes, days, moved):
+                    results[i] = _same_time(day, closest)
+        return results
+
+
+class Batcher(object):
+    """Coalesces the requests made to a policy and evaluates them together.
+
+    Requests for a command are gathered until window seconds have elapsed
+    since the first one, or until max_size of them are waiting. With a window
+    of 0, the requests received during the same iteration of the event loop
+    are gathered, which adds no latency.
+
+    A batch is evaluated on a snapshot of the policy, whose version is
+    returned along with each result.
+    """
+
+    def __init__(self, policy, window=0.0, max_size=4096):
+        if window < 0 or max_size < 1:
+            raise AssertionError("The window must not be negative and batches must not be empty")
+        self.policy = policy
+        self.window = window
+        self.max_size = max_size
+        self.requests = 0
+        self.batches = 0
+        self._pending = {}
+
+    async def submit(self, command, *args):
+        """Returns the result of the command for the given arguments and the
+        version of the policy which answered."""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        pending = self._pending.setdefault(command, [])
+        pending.append((args, future))
+        self.requests += 1
+        if len(pending) >= self.max_size:
+            self._flush(command, pending)
+        elif len(pending) == 1:
+            if self.window:
+                loop.call_later(self.window, self._flush, command, pending)
+            else:
+                loop.call_soon(self._flush, command, pending)
+        return await future
+
+    def _flush(self, command, pending):
+        if self._pending.get(command) is not pending:
+            # Already flushed when full
+            return
+        del self._pending[command]
+        self.batches += 1
+        snapshot = self.policy.snapshot()
+        rows = [args for args, future in pending]
+        try:
+            results = _evaluate_many(snapshot, command, rows)
+        except Exception:
+            # One bad row must not fail the others
+            results = []
+            for args in rows:
+                try:
+                    results.append(_evaluate(snapshot, command, args))
+                except Exception as error:
+                    results.append(error)
+        for (args, future), result in zip(pending, results):
+            if future.cancelled():
+                continue
+            if isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                future.set_result((result, snapshot.version))
+
+
+_REASONS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed', 413: 'Payload Too Large'}
+
+# Requests are a few dates, larger bodies are not read
+_MAX_BODY = 64 * 1024
+
+
+async def _read_request(reader):
+    """Returns the method, path, headers and body of the next HTTP request,
+    or None once the connection is closed. The body is None when larger
+    than _MAX_BODY, being left unread."""
+    line = await reader.readline()
+    if not line.strip():
+        return None
+    method, path, _ = line.decode('latin-1').split(' ', 2)
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if not line.strip():
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+    length = int(headers.get('content-length', 0))
+    if length > _MAX_BODY:
+        return method, path, headers, None
+    body = await reader.readexactly(length)
+    return method, path, headers, body
+
+
+def _write_response(writer, status, payload, keep_alive):
+    body = json.dumps(payload).encode('utf-8')
+    head = 'HTTP/1.1 %d %s\r\nContent-Type: application/json\r\nContent-Length: %d\r\nConnection: %s\r\n\r\n' % (
+        status, _REASONS[status], len(body), 'keep-alive' if keep_alive else 'close')
+    writer.write(head.encode('latin-1') + body)
+
+
+class Service(object):
+    """Answers HTTP requests for named policies, each through a Batcher."""
+
+    def __init__(self, policies, window=0.0, max_size=4096):
+        self.batchers = dict((name, Batcher(policy, window, max_size)) for name, policy in policies.items())
+
+    async def handle(self, reader, writer):
+        """Serves the requests of a connection, see asyncio.start_server."""
+        try:
+            while True:
+                request = await _read_request(reader)
+                if request is None:
+                    break
+                method, path, headers, body = request
+                if body is None:
+                    # The connection can not be reused with the body left unread
+                    _write_response(writer, 413, {'error': "Bodies are limited to %d bytes" % _MAX_BODY}, False)
+                    await writer.drain()
+                    break
+                status, payload = await self.answer(method, path, body)
+                keep_alive = headers.get('connection', '').lower() != 'close'
+                _write_response(writer, status, payload, keep_alive)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def answer(self, method, path, body):
+        """Returns the HTTP status and the JSON payload answering a request."""
+        if method != 'POST':
+            return 405, {'error': "Requests are POST /<policy>/<command>"}
+        name, _, command = path.strip('/').partition('/')
+        if name not in self.batchers or command not in _COMMANDS:
+            return 404, {'error': "Unknown policy or command: %s" % path}
+        try:
+            args = _COMMANDS[command](json.loads(body.decode('utf-8')))
+        except (ValueError, KeyError, TypeError, AttributeError) as error:
+            return 400, {'error': "Invalid request: %s" % error}
+        try:
+            result, version = await self.batchers[name].submit(command, *args)
+        except (ValueError, OverflowError, AssertionError) as error:
+            return 400, {'error': str(error)}
+        if isinstance(result, date):
+            result = result.isoformat()
+        return 200, {'result': result, 'version': version}
+
+
+async def serve(policies, host='127.0.0.1', port=8080, path=None, window=0.0, max_size=4096):
+    """Serves the named policies until cancelled, on a Unix socket if path is given."""
+    service = Service(policies, window, max_size)
+    # Bursts of clients are the point, do not let them wait for the kernel
+    if path is not None:
+        server = await asyncio.start_unix_server(service.handle, path, backlog=1024)
+    else:
+        server = await asyncio.start_server(service.handle, host, port, backlog=1024)
+    async with server:
+        await server.serve_forever()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='python -m bizdatim_server',
+        description="Serves business day arithmetic over HTTP, coalescing concurrent requests.",
+    )
+    parser.add_argument('-p', '--policy', action='append', required=True, metavar='NAME=FILE',
+                        help="compiled calendar file (see Policy.save_compiled), served as /NAME/; "
+                             "NAME defaults to the file name without extension")
+    parser.add_argument('--host', default='127.0.0.1', help="address to listen on (default: 127.0.0.1)")
+    parser.add_argument('--port', type=int, default=8080, help="port to listen on (default: 8080)")
+    parser.add_argument('-u', '--unix', help="Unix socket to listen on, instead of --host and --port")
+    parser.add_argument('-w', '--window', type=float, default=0.0,
+                        help="milliseconds to wait for more requests before evaluating a batch "
+                             "(default: 0, the requests already received)")
+    parser.add_argument('--max-batch', type=int, default=4096, help="largest batch (default: 4096)")
+    options = parser.parse_args(argv)
+    if options.window < 0 or options.max_batch < 1:
+        parser.error("--window must not be negative and --max-batch must be positive")
+
+    policies = {}
+    for value in options.policy:
+        name, _, path = value.rpartition('=')
+        policies[name or os.path.splitext(os.path.basename(path))[0]] = bizdatim.Policy.load_compiled(path)
+    try:
+        asyncio.run(serve(policies, options.host, options.port, options.unix, options.window / 1000.0,
+                          options.max_batch))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,522 @@
+#!/usr/bin/env python
+
+"""
+Differential fuzzing of the Policy engines against a naive reference.
+
+Random policies are generated: weekends or rotating schedules, holidays and
+holiday rules, and no business hours, a daily window (possibly overnight)
+or BusinessHours with breaks and overnight intervals. Every method is called
+on random days, often on the boundaries of business hours, through each
+engine -- plain, compiled over part of the days, cached, and the NumPy batch
+methods when installed -- and compared with Reference, which walks the
+calendar one day at a time. Reference calls are timed too, so that the
+speedup of each engine is recorded:
+
+    python fuzz.py --policies 500 --seed 1 --output fuzz.json
+
+Mismatches are printed with the seed and number of the policy, which
+reproduce it with --seed and --only, and make the exit status 1.
+"""
+
+import argparse
+import json
+import platform
+import random
+import sys
+from datetime import date, datetime, time, timedelta
+from timeit import default_timer
+
+import bizdatim
+from bizdatim import BusinessHours, EasterHoliday, FixedHoliday, NthWeekdayHoliday, Policy, SECONDS_PER_DAY
+
+DAY = SECONDS_PER_DAY
+EPOCH = bizdatim.EPOCH_ORDINAL * DAY
+
+START = date(2009, 1, 1)
+# Days from START on which calls are made, walks go further
+SPAN = 5 * 365
+
+# Walks longer than this mean there are no business days left
+LIMIT = 100 * 366
+
+
+def _seconds(value):
+    return value.hour * 3600 + value.minute * 60 + value.second
+
+
+def _moment(seconds):
+    """datetime from seconds since 0001-01-01 00:00, as an ordinal is counted."""
+    ordinal, seconds = divmod(seconds, DAY)
+    return datetime.fromordinal(ordinal) + timedelta(seconds=seconds)
+
+
+class Reference(object):
+    """The semantics of Policy, one day at a time.
+
+    Built from the same arguments as Policy, it only uses the weekday of
+    days, the in_year method of holiday rules (observed days are not
+    supported) and the times of business hours, which are in order within a
+    day, the last one only ending on the next day.
+
+    >>> reference = Reference(weekends=(bizdatim.SAT, bizdatim.SUN), holidays=(date(2011, 7, 1),))
+    >>> reference.add_days(date(2011, 6, 29), 2), reference.biz_day_delta(date(2011, 7, 4), date(2011, 6, 30))
+    (datetime.date(2011, 7, 4), 1)
+    """
+
+    def __init__(self, weekends=None, holidays=None, hours=None, holiday_rules=None, cycle=None, cycle_start=None):
+        self.weekends = set(weekends or ())
+        self.holidays = set(day.toordinal() for day in holidays or ())
+        self.rules = holiday_rules or ()
+        self.rule_years = set()
+        self.cycle = cycle
+        self.cycle_start = cycle_start.toordinal() if cycle else None
+        self.hours = hours
+
+    def is_weekend(self, ordinal):
+        if self.cycle:
+            return not self.cycle[(ordinal - self.cycle_start) % len(self.cycle)]
+        return date.fromordinal(ordinal).weekday() in self.weekends
+
+    def is_holiday(self, ordinal):
+        year = date.fromordinal(ordinal).year
+        if year not in self.rule_years:
+            self.rule_years.add(year)
+            for rule in self.rules:
+                day = rule.in_year(year)
+                if day is not None:
+                    self.holidays.add(day.toordinal())
+        return ordinal in self.holidays
+
+    def is_day_off(self, ordinal):
+        return self.is_weekend(ordinal) or self.is_holiday(ordinal)
+
+    def intervals(self, ordinal):
+        """The business hours of a day, as (begin, end) seconds since 0001-01-01."""
+        if self.is_day_off(ordinal):
+            return []
+        if self.hours is None:
+            pairs = [(time(0), time(0))]
+        elif isinstance(self.hours, BusinessHours):
+            day = date.fromordinal(ordinal)
+            pairs = self.hours.special.get(day, self.hours.weekdays[day.weekday()])
+        else:
+            pairs = [self.hours]
+        result = []
+        for begin, end in pairs:
+            begin, end = _seconds(begin), _seconds(end)
+            if end <= begin:
+                end += DAY
+            result.append((ordinal * DAY + begin, ordinal * DAY + end))
+        return result
+
+    # Days
+
+    def closest_biz_day_ordinal(self, ordinal, forward=True):
+        start = ordinal
+        while self.is_day_off(ordinal):
+            ordinal += 1 if forward else -1
+            if abs(ordinal - start) > LIMIT:
+                raise RuntimeError("No business day")
+        return ordinal
+
+    def add_ordinal(self, ordinal, days):
+        if not days:
+            return self.closest_biz_day_ordinal(ordinal)
+        step = 1 if days > 0 else -1
+        for _ in range(abs(days)):
+            ordinal = self.closest_biz_day_ordinal(ordinal + step, days > 0)
+        return ordinal
+
+    def delta_ordinal(self, ordinal1, ordinal2):
+        """Business days strictly between both days, plus the lower one when
+        it is not a weekend, even if it is a holiday."""
+        low, high = min(ordinal1, ordinal2), max(ordinal1, ordinal2)
+        if low == high:
+            return 0
+        inner = sum(1 for ordinal in range(low + 1, high) if not self.is_day_off(ordinal))
+        return inner + (0 if self.is_weekend(low) else 1)
+
+    def holidays_between(self, day1, day2, skip_weekends=True):
+        """Holidays strictly between both days."""
+        low, high = sorted((day1.toordinal(), day2.toordinal()))
+        return sum(1 for ordinal in range(low + 1, high)
+                   if self.is_holiday(ordinal) and not (skip_weekends and self.is_weekend(ordinal)))
+
+    def weekends_between(self, day1, day2):
+        """Weekend days from the lower day included to the upper one excluded."""
+        low, high = sorted((day1.toordinal(), day2.toordinal()))
+        return sum(1 for ordinal in range(low, high) if self.is_weekend(ordinal))
+
+    def closest_biz_day(self, day, forward=True):
+        return day + timedelta(days=self.closest_biz_day_ordinal(day.toordinal(), forward) - day.toordinal())
+
+    def add_days(self, day, days):
+        return day + timedelta(days=self.add_ordinal(day.toordinal(), days) - day.toordinal())
+
+    def biz_day_delta(self, day1, day2):
+        return self.delta_ordinal(day1.toordinal(), day2.toordinal())
+
+    def iter_biz_days(self, start, stop, step=1, reverse=False):
+        days = []
+        ordinal = start.toordinal()
+        while ordinal > stop.toordinal() if reverse else ordinal < stop.toordinal():
+            if not self.is_day_off(ordinal):
+                days.append(start + timedelta(days=ordinal - start.toordinal()))
+            ordinal += -1 if reverse else 1
+        return days[::step]
+
+    def biz_days_in(self, year, month):
+        return len(self._month(year, month))
+
+    def nth_biz_day(self, year, month, n):
+        days = self._month(year, month)
+        if n > len(days) or -n > len(days):
+            return None
+        return days[n - 1] if n > 0 else days[n]
+
+    def last_biz_day(self, year, month):
+        return self.nth_biz_day(year, month, -1)
+
+    def _month(self, year, month):
+        first = date(year, month, 1)
+        last = date(year + month // 12, month % 12 + 1, 1)
+        return self.iter_biz_days(first, last)
+
+    # Seconds
+
+    def _add_seconds(self, moment, seconds):
+        """add_seconds on seconds since 0001-01-01 00:00."""
+        ordinal, seconds_of_day = divmod(moment, DAY)
+        if self.hours is None:
+            # Seconds are added to the day, which then moves to a business day
+            if seconds >= 0 and self.is_day_off(ordinal):
+                seconds_of_day = 0
+            ordinal, seconds_of_day = divmod(ordinal * DAY + seconds_of_day + seconds, DAY)
+            return self.closest_biz_day_ordinal(ordinal, seconds >= 0) * DAY + seconds_of_day
+
+        # Walk business hours, ending at the end of some rather than at the
+        # beginning of the next ones, or the opposite backwards.
+        remaining = abs(seconds)
+        if seconds >= 0:
+            # The hours of the day before may end after midnight
+            for day in range(ordinal - 1, ordinal + LIMIT):
+                for begin, end in self.intervals(day):
+                    if end < moment:
+                        continue
+                    begin = max(begin, moment)
+                    if begin + remaining <= end:
+                        return begin + remaining
+                    remaining -= end - begin
+        else:
+            for day in range(ordinal, ordinal - LIMIT, -1):
+                for begin, end in reversed(self.intervals(day)):
+                    if begin > moment:
+                        continue
+                    end = min(end, moment)
+                    if end - remaining >= begin:
+                        return end - remaining
+                    remaining -= end - begin
+        raise RuntimeError("No business hours")
+
+    def _biz_seconds_between(self, moment1, moment2):
+        low, high = min(moment1, moment2), max(moment1, moment2)
+        return sum(max(min(end, high) - max(begin, low), 0)
+                   for day in range(low // DAY - 1, high // DAY + 1) for begin, end in self.intervals(day))
+
+    def add_seconds(self, day, seconds):
+        return _moment(self._add_seconds(day.toordinal() * DAY + _seconds(day), seconds))
+
+    def add_seconds_epoch(self, timestamp, seconds):
+        return self._add_seconds(timestamp + EPOCH, seconds) - EPOCH
+
+    def biz_seconds_between(self, day1, day2):
+        return self._biz_seconds_between(
+            day1.toordinal() * DAY + _seconds(day1), day2.toordinal() * DAY + _seconds(day2))
+
+    def biz_seconds_between_epoch(self, timestamp1, timestamp2):
+        return self._biz_seconds_between(timestamp1 + EPOCH, timestamp2 + EPOCH)
+
+    def add(self, day, delta):
+        """Seconds are added first, for datetimes, then days."""
+        if isinstance(delta, int):
+            delta = timedelta(days=delta)
+        sign = -1 if delta < timedelta(0) else 1
+        delta = abs(delta)
+        if isinstance(day, datetime):
+            day = self.add_seconds(day, sign * delta.seconds)
+        return self.add_days(day, sign * delta.days)
+
+
+# Random policies
+
+def _minutes(rng, low, high, count):
+    """Sorted distinct times, whole minutes in [low, high)."""
+    return [time(*divmod(minutes, 60)) for minutes in sorted(rng.sample(range(low, high), count))]
+
+
+def random_hours(rng):
+    """None, a (begin, end) window or BusinessHours."""
+    shape = rng.random()
+    if shape < 0.3:
+        return None
+    if shape < 0.65:
+        begin, end = _minutes(rng, 0, 24 * 60, 2)
+        if rng.random() < 0.4:
+            # Overnight, or 24 hours from the same time
+            return (end, begin) if rng.random() < 0.9 else (begin, begin)
+        return begin, end
+    # Every weekday has hours, so that rotating schedules always find some
+    weekdays = {}
+    for weekday in range(7):
+        times = _minutes(rng, 0, 24 * 60, 2 * rng.randint(1, 3))
+        weekdays[weekday] = list(zip(times[::2], times[1::2]))
+    special = {}
+    for _ in range(rng.choice((0, 0, 3, 10))):
+        times = _minutes(rng, 0, 24 * 60, 2 * rng.randint(0, 2))
+        special[START + timedelta(days=rng.randrange(SPAN))] = list(zip(times[::2], times[1::2]))
+    # An overnight end must not reach the first hours of any day
+    first = min(_seconds(intervals[0][0]) for intervals in list(weekdays.values()) + list(special.values())
+                if intervals) // 60
+    for intervals in list(weekdays.values()) + list(special.values()):
+        if intervals and rng.random() < 0.3:
+            intervals[-1] = (intervals[-1][0], time(*divmod(rng.randint(0, first), 60)))
+    return BusinessHours(weekdays, special=special)
+
+
+def random_policy(rng):
+    """The keyword arguments of a random Policy."""
+    kwargs = {}
+    if rng.random() < 0.2:
+        cycle = [rng.random() < 0.6 for _ in range(rng.randint(2, 10))]
+        cycle[rng.randrange(len(cycle))] = True
+        kwargs['cycle'] = cycle
+        kwargs['cycle_start'] = START + timedelta(days=rng.randrange(-30, 30))
+    else:
+        kwargs['weekends'] = rng.sample(range(7), rng.choice((0, 1, 2, 2, 2, 3, 5, 6)))
+    count = rng.choice((0, 5, 50, 500))
+    kwargs['holidays'] = [START + timedelta(days=offset) for offset in rng.sample(range(-365, SPAN + 365), count)]
+    if rng.random() < 0.2:
+        kwargs['holiday_rules'] = rng.sample([
+            FixedHoliday(rng.randint(1, 12), rng.randint(1, 28)),
+            NthWeekdayHoliday(rng.randint(1, 12), rng.randrange(7), rng.choice((1, 2, 3, -1))),
+            EasterHoliday(rng.randint(-50, 60)),
+        ], rng.randint(1, 3))
+    kwargs['hours'] = random_hours(rng)
+    return kwargs
+
+
+def _day(rng):
+    return START + timedelta(days=rng.randrange(SPAN))
+
+
+def _near(rng, day, days=400):
+    return day + timedelta(days=rng.randint(-days, days))
+
+
+def _moment_on(rng, reference):
+    """A datetime, on the boundaries of business hours half of the time."""
+    ordinal = _day(rng).toordinal()
+    boundaries = [moment for interval in reference.intervals(ordinal) for moment in interval]
+    if boundaries and rng.random() < 0.5:
+        return _moment(rng.choice(boundaries))
+    return _moment(ordinal * DAY + rng.randrange(24 * 60) * 60)
+
+
+def _seconds_to_add(rng, reference, moment):
+    """0, or up to the business seconds of the 60 days after or before the
+    moment, often all of them."""
+    sign = rng.choice((-1, 1))
+    start = moment.toordinal() * DAY + _seconds(moment)
+    available = reference._biz_seconds_between(start, start + sign * 60 * DAY)
+    return sign * rng.choice((0, available, rng.randint(0, available) // 60 * 60))
+
+
+def _days_to_add(rng):
+    return rng.choice((0, rng.randint(-30, 30), rng.randint(-600, 600)))
+
+
+def _epoch(moment):
+    return moment.toordinal() * DAY + _seconds(moment) - EPOCH
+
+
+def _seconds_case(rng, reference):
+    moment = _moment_on(rng, reference)
+    return moment, _seconds_to_add(rng, reference, moment)
+
+
+def _add_case(rng, reference):
+    day = _moment_on(rng, reference) if rng.random() < 0.5 else _day(rng)
+    if rng.random() < 0.2:
+        return day, _days_to_add(rng)
+    return day, timedelta(days=_days_to_add(rng), seconds=rng.randrange(DAY) // 60 * 60)
+
+
+def _iter_case(rng, reference):
+    start = _day(rng)
+    reverse = rng.random() < 0.5
+    stop = start + timedelta(days=rng.randint(0, 60) * (-1 if reverse else 1))
+    return start, stop, rng.randint(1, 7), reverse
+
+
+CASES = {
+    'closest_biz_day': lambda rng, reference: (_day(rng), rng.random() < 0.5),
+    'closest_biz_day_ordinal': lambda rng, reference: (_day(rng).toordinal(), rng.random() < 0.5),
+    'add_days': lambda rng, reference: (_day(rng), _days_to_add(rng)),
+    'add_ordinal': lambda rng, reference: (_day(rng).toordinal(), _days_to_add(rng)),
+    'add': _add_case,
+    'add_seconds': _seconds_case,
+    'add_seconds_epoch': lambda rng, reference: (lambda moment, seconds: (_epoch(moment), seconds))(
+        *_seconds_case(rng, reference)),
+    'biz_seconds_between': lambda rng, reference: (_moment_on(rng, reference), _moment_on(rng, reference)),
+    'biz_seconds_between_epoch': lambda rng, reference: (
+        _epoch(_moment_on(rng, reference)), _epoch(_moment_on(rng, reference))),
+    'holidays_between': lambda rng, reference: (_day(rng), _near(rng, _day(rng)), rng.random() < 0.5),
+    'weekends_between': lambda rng, reference: (_day(rng), _near(rng, _day(rng))),
+    'biz_day_delta': lambda rng, reference: (_day(rng), _near(rng, _day(rng))),
+    'delta_ordinal': lambda rng, reference: (_day(rng).toordinal(), _near(rng, _day(rng)).toordinal()),
+    'iter_biz_days': _iter_case,
+    'biz_days_in': lambda rng, reference: (_day(rng).year, rng.randint(1, 12)),
+    'nth_biz_day': lambda rng, reference: (
+        _day(rng).year, rng.randint(1, 12), rng.choice((1, -1)) * rng.randint(1, 25)),
+    'last_biz_day': lambda rng, reference: (_day(rng).year, rng.randint(1, 12)),
+}
+
+# Methods with a NumPy batch version, and the arguments of the batch call
+BATCHES = {
+    'add_days': ('add_many', lambda rows: [list(column) for column in zip(*rows)]),
+    'biz_day_delta': ('biz_day_delta_many', lambda rows: [list(column) for column in zip(*rows)]),
+    'add_seconds': ('add_seconds_many', lambda rows: [list(column) for column in zip(*rows)]),
+}
+
+ENGINES = ('plain', 'compiled', 'cached', 'batch')
+
+
+def make_engine(engine, kwargs, rng):
+    """A Policy from the keyword arguments, set up for the engine."""
+    policy = Policy(**kwargs)
+    if engine == 'compiled':
+        # Over part of the days only, so that calls also leave the table
+        first = START + timedelta(days=rng.randrange(-100, SPAN // 2))
+        policy.compile(first, first + timedelta(days=rng.randrange(SPAN)))
+    elif engine == 'cached':
+        policy.enable_cache(maxsize=16)
+    return policy
+
+
+def _call(function, args):
+    try:
+        result = function(*args)
+        if not isinstance(result, (int, float, date, type(None))):
+            result = list(result)
+        return result
+    except Exception as error:
+        return '%s: %s' % (type(error).__name__, error)
+
+
+def run(policies=100, cases=10, seed=0, methods=None, engines=None, only=None):
+    """Fuzzes the engines, returns the mismatches and the timings.
+
+    Mismatches are dicts of the policy number, its arguments, the method,
+    engine and arguments of the call, and both results. Timings are dicts of
+    the method, engine, number of calls, seconds spent by the engine and by
+    the reference, and the speedup of the engine.
+    """
+    methods = sorted(methods or CASES)
+    engines = [engine for engine in engines or ENGINES if engine != 'batch' or bizdatim.numpy is not None]
+    mismatches = []
+    timings = {}
+    for number in range(policies) if only is None else [only]:
+        rng = random.Random('%s/%s' % (seed, number))
+        kwargs = random_policy(rng)
+        reference = Reference(**kwargs)
+        policies_by_engine = dict((engine, make_engine(engine, kwargs, rng)) for engine in engines)
+        for method in methods:
+            rows = [CASES[method](rng, reference) for _ in range(cases)]
+            start = default_timer()
+            expected = [_call(getattr(reference, method), args) for args in rows]
+            reference_seconds = default_timer() - start
+            # Engines share the calendar, the first one called builds its tables
+            for engine in rng.sample(sorted(policies_by_engine), len(policies_by_engine)):
+                policy = policies_by_engine[engine]
+                if engine == 'batch':
+                    if method not in BATCHES:
+                        continue
+                    name, columns = BATCHES[method]
+                    start = default_timer()
+                    results = _call(getattr(policy, name), columns(rows))
+                    seconds = default_timer() - start
+                    if isinstance(results, list):
+                        results = [value.item() if hasattr(value, 'item') else value for value in results]
+                    else:
+                        results = [results] * len(rows)
+                else:
+                    function = getattr(policy, method)
+                    start = default_timer()
+                    results = [_call(function, args) for args in rows]
+                    seconds = default_timer() - start
+                timing = timings.setdefault((method, engine), [0, 0.0, 0.0])
+                timing[0] += len(rows)
+                timing[1] += seconds
+                timing[2] += reference_seconds
+                for args, value, result in zip(rows, expected, results):
+                    if value != result:
+                        mismatches.append({
+                            'policy': number,
+                            'kwargs': repr(kwargs),
+                            'method': method,
+                            'engine': engine,
+                            'args': repr(args),
+                            'expected': repr(value),
+                            'result': repr(result),
+                        })
+    results = [{
+        'method': method,
+        'engine': engine,
+        'calls': calls,
+        'seconds': seconds,
+        'reference_seconds': reference_seconds,
+        'speedup': reference_seconds / seconds if seconds else None,
+    } for (method, engine), (calls, seconds, reference_seconds) in sorted(timings.items())]
+    return mismatches, results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('-n', '--policies', type=int, default=100, help="random policies (default: 100)")
+    parser.add_argument('-c', '--cases', type=int, default=10, help="calls per method and policy (default: 10)")
+    parser.add_argument('-s', '--seed', default='0', help="seed of the random policies (default: 0)")
+    parser.add_argument('--only', type=int, help="only fuzz this policy number, to reproduce a mismatch")
+    parser.add_argument('-m', '--method', action='append', dest='methods', choices=sorted(CASES),
+                        help="only call this method")
+    parser.add_argument('-e', '--engine', action='append', dest='engines', choices=ENGINES,
+                        help="only use this engine")
+    parser.add_argument('-o', '--output', help="write the mismatches and speedups to this JSON file")
+    options = parser.parse_args(argv)
+
+    mismatches, results = run(options.policies, options.cases, options.seed, options.methods, options.engines,
+                              options.only)
+    for mismatch in mismatches:
+        print('MISMATCH policy=%(policy)s %(method)s[%(engine)s]%(args)s: expected %(expected)s, got %(result)s'
+              % mismatch)
+    for result in results:
+        print('%-26s %-9s calls=%-6d %10.2f us  x%.1f' % (
+            result['method'], result['engine'], result['calls'], result['seconds'] / result['calls'] * 1e6,
+            result['speedup'] or 0))
+
+    if options.output:
+        with open(options.output, 'w') as f:
+            json.dump({
+                'bizdatim': bizdatim.__version__,
+                'python': platform.python_version(),
+                'implementation': platform.python_implementation(),
+                'seed': options.seed,
+                'policies': options.policies,
+                'cases': options.cases,
+                'mismatches': mismatches,
+                'results': results,
+            }, f, indent=1, sort_keys=True)
+    return 1 if mismatches else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
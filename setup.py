@@ -1,7 +1,14 @@
 #!/usr/bin/env python
 
+import sys
+
 from setuptools import setup
 
+py_modules = ["bizdatim", "bizdatim_pandas"]
+if sys.version_info >= (3, 7):
+    # The service is written with async and await, and runs with asyncio.run
+    py_modules.append("bizdatim_server")
+
 setup(
     name="bizdatim",
     version="0.2.0",
@@ -13,7 +20,14 @@ setup(
     maintainer="Polyconseil Dev Team",
     maintainer_email="opensource+bizdatim@polyconseil.fr",
     url="https://github.com/Polyconseil/bizdatim",
-    py_modules=["bizdatim"],
+    py_modules=py_modules,
+    extras_require={
+        'numpy': ['numpy'],
+        'pandas': ['numpy', 'pandas'],
+    },
+    entry_points={
+        'console_scripts': ['bizdatim = bizdatim:main'],
+    },
     classifiers=[
         'Development Status :: 5 - Production/Stable',
         'License :: OSI Approved :: MIT License',
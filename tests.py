@@ -1,9 +1,34 @@
 #!/usr/bin/env python
 
+import copy
+import doctest
+import itertools
+import os
+import pickle
+import sys
+import tempfile
+import threading
 import unittest
-from datetime import date, datetime, time, timedelta
+from datetime import date, datetime, time, timedelta, tzinfo
+import bizdatim
+import fuzz
 from bizdatim import Policy, MON, TUE, WED, THU, FRI, SAT, SUN
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+try:
+    import pandas
+    import bizdatim_pandas
+except ImportError:
+    pandas = None
+
+if sys.version_info >= (3, 7):
+    # async def is a syntax error before, and the server needs asyncio.run
+    from tests_server import TestServer
+
 holidays = (
     date(2009, 12, 25),  # xmas
     date(2009, 12, 28),  # boxing day in on
@@ -76,7 +101,24 @@ class TestAddition(unittest.TestCase):
         self.assertEqual(policy.add(date(2011, 3, 3), 40), date(2011, 4, 29))
 
     def test_negative_addition(self):
-        pass
+        policy = Policy(weekends=(SAT, SUN), holidays=holidays)
+        self.assertEqual(policy.add(date(2011, 3, 3), -1), date(2011, 3, 2))
+        self.assertEqual(policy.add(date(2011, 3, 3), -4), date(2011, 2, 25))
+        self.assertEqual(policy.add(date(2011, 3, 3), -5), date(2011, 2, 24))
+        self.assertEqual(policy.add(date(2011, 3, 3), -8), date(2011, 2, 18))
+        self.assertEqual(policy.add(date(2011, 4, 26), -2), date(2011, 4, 21))
+
+    def test_add_days_landing_on_holiday(self):
+        policy = Policy(weekends=(SAT, SUN), holidays=(date(2011, 3, 8), date(2011, 3, 9)))
+        self.assertEqual(policy.add(date(2011, 3, 7), 1), date(2011, 3, 10))
+        self.assertEqual(policy.add(date(2011, 3, 7), 2), date(2011, 3, 11))
+        self.assertEqual(policy.add(date(2011, 3, 11), -2), date(2011, 3, 7))
+
+    def test_add_days_from_weekend(self):
+        policy = Policy(weekends=(SAT, SUN), holidays=holidays)
+        self.assertEqual(policy.add(date(2011, 3, 5), 1), date(2011, 3, 7))
+        self.assertEqual(policy.add(date(2011, 3, 5), 5), date(2011, 3, 11))
+        self.assertEqual(policy.add(date(2011, 3, 5), -5), date(2011, 2, 28))
 
     def test_add_seconds(self):
         begin = time(8, 30)
@@ -95,6 +137,22 @@ class TestAddition(unittest.TestCase):
         # Span weekend
         self.assertEqual(policy.add_seconds(datetime(2011, 3, 4, 15, 30), 36000), datetime(2011, 3, 7, 13, 30))
 
+    def test_add_seconds_after_hours_before_weekend(self):
+        policy = Policy(weekends=(SAT, SUN), holidays=holidays, hours=(time(8, 30), time(20, 30)))
+        self.assertEqual(policy.add_seconds(datetime(2011, 3, 4, 21, 0), 3600), datetime(2011, 3, 7, 9, 30))
+        self.assertEqual(policy.add_seconds(datetime(2011, 3, 4, 20, 30), 0), datetime(2011, 3, 4, 20, 30))
+
+    def test_add_seconds_long_duration(self):
+        policy = Policy(weekends=(SAT, SUN), holidays=holidays, hours=(time(8, 30), time(20, 30)))
+        # 100 business days of 12 hours, ending at the end of the 100th one
+        self.assertEqual(
+            policy.add_seconds(datetime(2010, 1, 4, 8, 30), 100 * 12 * 3600),
+            datetime.combine(policy.add_days(date(2010, 1, 4), 99), time(20, 30)),
+        )
+        # Years of business hours do not recurse
+        day = policy.add_seconds(datetime(2010, 1, 4, 9, 30), 2000 * 12 * 3600)
+        self.assertEqual(day, datetime.combine(policy.add_days(date(2010, 1, 4), 2000), time(9, 30)))
+
     def test_add_seconds_no_working_hours(self):
         policy = Policy(weekends=(SAT, SUN), holidays=holidays, hours=None)
         # Nominal
@@ -111,6 +169,23 @@ class TestAddition(unittest.TestCase):
         # Nominal
         self.assertEqual(policy.add_seconds(datetime(2011, 3, 3, 5, 30), 3600), datetime(2011, 3, 3, 6, 30))
         self.assertEqual(policy.add_seconds(datetime(2011, 3, 2, 22, 30), 10800), datetime(2011, 3, 3, 1, 30))
+        # Shifts span midnight
+        self.assertEqual(policy.add_seconds(datetime(2011, 3, 3, 5, 30), 14400), datetime(2011, 3, 3, 21, 30))
+        self.assertEqual(policy.add_seconds(datetime(2011, 3, 3, 12, 0), 12 * 3600), datetime(2011, 3, 4, 8, 30))
+        # The friday night shift ends on saturday morning, the next one starts on monday
+        self.assertEqual(policy.add_seconds(datetime(2011, 3, 5, 7, 30), 7200), datetime(2011, 3, 7, 21, 30))
+        self.assertEqual(policy.add_seconds(datetime(2011, 3, 7, 7, 30), 3600), datetime(2011, 3, 7, 21, 30))
+        self.assertEqual(
+            policy.add_seconds(datetime(2011, 3, 3, 21, 30), 30 * 12 * 3600),
+            datetime(2011, 4, 14, 21, 30),
+        )
+
+    def test_add_seconds_whole_day_shift(self):
+        policy = Policy(weekends=(SAT, SUN), holidays=holidays, hours=(time(9), time(9)))
+        # The friday shift ends on saturday at 9, still within business hours
+        self.assertEqual(policy.add_seconds(datetime(2011, 3, 5, 9, 0), 0), datetime(2011, 3, 5, 9, 0))
+        self.assertEqual(policy.add_seconds(datetime(2011, 3, 5, 9, 0), 3600), datetime(2011, 3, 7, 10, 0))
+        self.assertEqual(policy.add_seconds(datetime(2011, 3, 7, 9, 0), -3600), datetime(2011, 3, 5, 8, 0))
 
     def test_add(self):
         begin = time(8, 30)
@@ -133,6 +208,1141 @@ class TestAddition(unittest.TestCase):
         )
 
 
+class TestSubtraction(unittest.TestCase):
+
+    def setUp(self):
+        self.policy = Policy(weekends=(SAT, SUN), holidays=holidays, hours=(time(8, 30), time(20, 30)))
+
+    def test_add_seconds(self):
+        # Nominal
+        self.assertEqual(self.policy.add_seconds(datetime(2011, 3, 3, 9, 30), -3600), datetime(2011, 3, 3, 8, 30))
+        # After end
+        self.assertEqual(self.policy.add_seconds(datetime(2011, 3, 3, 22, 30), -3600), datetime(2011, 3, 3, 19, 30))
+        # Before begin
+        self.assertEqual(self.policy.add_seconds(datetime(2011, 3, 3, 7, 30), -3600), datetime(2011, 3, 2, 19, 30))
+        # During weekend
+        self.assertEqual(self.policy.add_seconds(datetime(2011, 3, 6, 10, 30), -3600), datetime(2011, 3, 4, 19, 30))
+        # Span weekend
+        self.assertEqual(self.policy.add_seconds(datetime(2011, 3, 7, 13, 30), -36000), datetime(2011, 3, 4, 15, 30))
+        # Across a holiday
+        self.assertEqual(self.policy.add_seconds(datetime(2011, 7, 4, 9, 30), -2 * 3600), datetime(2011, 6, 30, 19, 30))
+
+    def test_add_seconds_night_shift(self):
+        policy = Policy(weekends=(SAT, SUN), holidays=holidays, hours=(time(20, 30), time(8, 30)))
+        self.assertEqual(policy.add_seconds(datetime(2011, 3, 3, 1, 30), -10800), datetime(2011, 3, 2, 22, 30))
+        self.assertEqual(policy.add_seconds(datetime(2011, 3, 3, 21, 30), -7200), datetime(2011, 3, 3, 7, 30))
+        self.assertEqual(policy.add_seconds(datetime(2011, 3, 7, 12, 0), -3600), datetime(2011, 3, 5, 7, 30))
+
+    def test_add(self):
+        self.assertEqual(
+            self.policy.add(datetime(2011, 3, 8, 11, 30), -timedelta(days=2, hours=3)),
+            datetime(2011, 3, 4, 8, 30),
+        )
+        self.assertEqual(
+            self.policy.add(datetime(2011, 3, 7, 9, 30), -timedelta(hours=2)),
+            datetime(2011, 3, 4, 19, 30),
+        )
+
+    def test_biz_seconds_between(self):
+        begin = datetime(2011, 3, 3, 8, 30)
+        self.assertEqual(self.policy.biz_seconds_between(begin, datetime(2011, 3, 3, 9, 30)), 3600)
+        self.assertEqual(self.policy.biz_seconds_between(datetime(2011, 3, 3, 9, 30), begin), 3600)
+        self.assertEqual(self.policy.biz_seconds_between(begin, datetime(2011, 3, 3, 6, 30)), 0)
+        # Span weekend
+        self.assertEqual(
+            self.policy.biz_seconds_between(datetime(2011, 3, 4, 15, 30), datetime(2011, 3, 7, 13, 30)),
+            36000,
+        )
+        # Across a holiday
+        self.assertEqual(
+            self.policy.biz_seconds_between(datetime(2011, 6, 30, 20, 0), datetime(2011, 7, 4, 9, 0)),
+            3600,
+        )
+        for seconds in (0, 1800, 12 * 3600, 100000, 10 ** 7):
+            end = self.policy.add_seconds(begin, seconds)
+            self.assertEqual(self.policy.biz_seconds_between(begin, end), seconds)
+            self.assertEqual(self.policy.add_seconds(end, -seconds), begin)
+
+    def test_biz_seconds_between_no_working_hours(self):
+        policy = Policy(weekends=(SAT, SUN), holidays=holidays)
+        self.assertEqual(policy.biz_seconds_between(datetime(2011, 3, 4, 20, 0), datetime(2011, 3, 7, 1, 0)), 18000)
+
+
+class TestHolidayIndex(unittest.TestCase):
+
+    def test_empty_policy(self):
+        policy = Policy()
+        self.assertTrue(policy.is_empty())
+        self.assertEqual(policy.add(date(2011, 3, 5), 1), date(2011, 3, 6))
+
+    def test_is_holiday(self):
+        policy = Policy(weekends=(SAT, SUN), holidays=holidays)
+        self.assertTrue(policy.is_holiday(date(2011, 7, 1)))
+        self.assertTrue(policy.is_holiday(datetime(2011, 7, 1, 10, 0)))
+        self.assertFalse(policy.is_holiday(date(2011, 7, 2)))
+
+    def test_duplicate_holidays(self):
+        policy = Policy(weekends=(SAT, SUN), holidays=[date(2011, 7, 1), date(2011, 7, 1)])
+        self.assertEqual(policy.holidays, [date(2011, 7, 1)])
+        self.assertEqual(policy.holidays_between(date(2011, 6, 1), date(2011, 8, 1)), 1)
+
+    def test_holidays_between(self):
+        policy = Policy(weekends=(SAT, SUN), holidays=holidays)
+        self.assertEqual(policy.holidays_between(date(2009, 12, 1), date(2011, 12, 31)), 22)
+        self.assertEqual(policy.holidays_between(date(2011, 12, 31), date(2009, 12, 1)), 22)
+        # Boundaries are excluded
+        self.assertEqual(policy.holidays_between(date(2010, 12, 27), date(2011, 1, 3)), 1)
+        self.assertEqual(policy.holidays_between(datetime(2011, 7, 1, 8), datetime(2011, 7, 1, 9)), 0)
+
+    def test_holidays_between_weekends(self):
+        policy = Policy(weekends=(FRI, SAT), holidays=holidays)
+        self.assertEqual(policy.holidays_between(date(2011, 1, 1), date(2011, 12, 31)), 8)
+        self.assertEqual(policy.holidays_between(date(2011, 1, 1), date(2011, 12, 31), skip_weekends=False), 10)
+
+    def test_weekends_update(self):
+        policy = Policy(weekends=(SAT, SUN), holidays=holidays)
+        policy.weekends = (FRI, SAT)
+        self.assertTrue(policy.is_weekend(date(2011, 3, 4)))
+        self.assertFalse(policy.is_weekend(date(2011, 3, 6)))
+        self.assertEqual(policy.holidays_between(date(2011, 4, 1), date(2011, 5, 1)), 0)
+
+
+class TestCompiled(unittest.TestCase):
+
+    def setUp(self):
+        self.policy = Policy(weekends=(SAT, SUN), holidays=holidays)
+        self.compiled = Policy(weekends=(SAT, SUN), holidays=holidays)
+        self.compiled.compile(date(2010, 1, 1), date(2011, 12, 31))
+
+    def days(self):
+        day = date(2009, 12, 1)
+        while day < date(2012, 2, 1):
+            yield day
+            day += timedelta(days=1)
+
+    def test_add_days(self):
+        for day in self.days():
+            for n in (-60, -7, -5, -1, 0, 1, 2, 5, 9, 60):
+                self.assertEqual(self.compiled.add_days(day, n), self.policy.add_days(day, n), (day, n))
+
+    def test_add_datetime(self):
+        day = datetime(2011, 6, 29, 14, 30)
+        self.assertEqual(self.compiled.add(day, 2), datetime(2011, 7, 4, 14, 30))
+        self.assertEqual(self.policy.add(day, 2), datetime(2011, 7, 4, 14, 30))
+        self.assertEqual(self.policy.add(datetime(2010, 12, 24, 8, 30), 1), datetime(2010, 12, 29, 8, 30))
+
+    def test_closest_biz_day(self):
+        for day in self.days():
+            self.assertEqual(self.compiled.closest_biz_day(day), self.policy.closest_biz_day(day))
+            self.assertEqual(
+                self.compiled.closest_biz_day(day, forward=False),
+                self.policy.closest_biz_day(day, forward=False),
+            )
+
+    def test_biz_day_delta(self):
+        for day in self.days():
+            for other in (date(2009, 12, 24), date(2010, 7, 3), date(2011, 1, 1), date(2012, 1, 31)):
+                self.assertEqual(self.compiled.biz_day_delta(day, other), self.policy.biz_day_delta(day, other))
+
+    def test_holidays_update(self):
+        self.compiled.holidays = list(holidays) + [date(2011, 3, 4)]
+        self.assertEqual(self.compiled.add(date(2011, 3, 3), 1), date(2011, 3, 7))
+        self.compiled.weekends = (SUN,)
+        self.assertEqual(self.compiled.add(date(2011, 3, 3), 1), date(2011, 3, 5))
+
+
+class TestCompiledFile(unittest.TestCase):
+
+    def setUp(self):
+        self.policy = Policy(weekends=(FRI, SAT), holidays=holidays, hours=(time(20, 30), time(8, 30)))
+        self.policy.compile(date(2010, 1, 1), date(2011, 12, 31))
+        fd, self.path = tempfile.mkstemp()
+        os.close(fd)
+        self.addCleanup(os.remove, self.path)
+
+    def test_round_trip(self):
+        self.policy.save_compiled(self.path)
+        loaded = Policy.load_compiled(self.path)
+        self.assertEqual(loaded.weekends, [FRI, SAT])
+        self.assertEqual(loaded.holidays, sorted(holidays))
+        self.assertEqual(loaded.hours, (time(20, 30), time(8, 30)))
+        self.assertEqual(list(loaded._compiled_counts), list(self.policy._compiled_counts))
+        for n in range(0, 700, 7):
+            day = date(2009, 12, 1) + timedelta(days=n)
+            self.assertEqual(loaded.add_days(day, 12), self.policy.add_days(day, 12))
+            other = date(2011, 1, 1)
+            self.assertEqual(loaded.biz_day_delta(day, other), self.policy.biz_day_delta(day, other))
+            self.assertEqual(loaded.add(datetime.combine(day, time(21)), timedelta(hours=30)),
+                             self.policy.add(datetime.combine(day, time(21)), timedelta(hours=30)))
+
+    def test_holidays_update(self):
+        self.policy.save_compiled(self.path)
+        loaded = Policy.load_compiled(self.path)
+        loaded.holidays = [date(2011, 3, 7)]
+        self.assertEqual(loaded.add_days(date(2011, 3, 6), 1), date(2011, 3, 8))
+
+    def test_not_compiled(self):
+        self.assertRaises(AssertionError, Policy(weekends=(SAT, SUN)).save_compiled, self.path)
+
+    def test_invalid_file(self):
+        with open(self.path, 'wb') as f:
+            f.write(b'x' * 64)
+        self.assertRaises(ValueError, Policy.load_compiled, self.path)
+        with open(self.path, 'wb') as f:
+            f.write(b'x')
+        self.assertRaises(ValueError, Policy.load_compiled, self.path)
+
+    def test_truncated_file(self):
+        self.policy.save_compiled(self.path)
+        with open(self.path, 'rb') as f:
+            data = f.read()
+        # Cut in the holidays, then in the counts
+        for size in (len(data) - 4, len(data) - 4 * len(holidays) - 4):
+            with open(self.path, 'wb') as f:
+                f.write(data[:size])
+            self.assertRaises(ValueError, Policy.load_compiled, self.path)
+
+
+class TestCompiledCalendar(unittest.TestCase):
+
+    def test_interned(self):
+        calendar = bizdatim.CompiledCalendar.get(weekends=(SAT, SUN), holidays=holidays)
+        self.assertIs(bizdatim.CompiledCalendar.get(weekends=[SUN, SAT], holidays=holidays[::-1] + holidays),
+                      calendar)
+        self.assertIsNot(bizdatim.CompiledCalendar.get(weekends=(SAT,), holidays=holidays), calendar)
+        self.assertIs(Policy(weekends=(SAT, SUN), holidays=holidays).calendar, calendar)
+
+    def test_immutable(self):
+        calendar = bizdatim.CompiledCalendar.get(weekends=(SAT, SUN), holidays=holidays)
+        self.assertRaises(AttributeError, setattr, calendar, 'weekend_mask', 0)
+        self.assertRaises(AttributeError, setattr, calendar, 'other', 0)
+        self.assertFalse(hasattr(Policy(), '__dict__'))
+
+    def test_shared(self):
+        calendar = bizdatim.CompiledCalendar.get(weekends=(SAT, SUN), holidays=holidays)
+        day = Policy(calendar=calendar)
+        night = Policy(calendar=calendar, hours=(time(20), time(8)))
+        self.assertEqual(day.holidays, sorted(holidays))
+        self.assertEqual(night.weekends, [SAT, SUN])
+        self.assertEqual(day.add_days(date(2011, 6, 30), 2), date(2011, 7, 5))
+        self.assertEqual(night.add(datetime(2011, 6, 30, 7), timedelta(hours=2)), datetime(2011, 6, 30, 21))
+        self.assertRaises(AssertionError, Policy, weekends=(SUN,), calendar=calendar)
+
+    def test_setters(self):
+        calendar = bizdatim.CompiledCalendar.get(weekends=(SAT, SUN), holidays=holidays)
+        policy = Policy(calendar=calendar)
+        policy.holidays = [date(2011, 7, 1)]
+        self.assertIsNot(policy.calendar, calendar)
+        self.assertEqual(calendar.holidays, sorted(holidays))
+        self.assertEqual(policy.weekends, [SAT, SUN])
+        policy.holidays = holidays
+        self.assertIs(policy.calendar, calendar)
+
+    def test_pickle(self):
+        policy = Policy(weekends=(SAT, SUN), holidays=holidays)
+        for copied in [copy.deepcopy(policy)] + [pickle.loads(pickle.dumps(policy, protocol))
+                                                 for protocol in range(pickle.HIGHEST_PROTOCOL + 1)]:
+            # Interned again rather than copied
+            self.assertIs(copied.calendar, policy.calendar)
+            self.assertEqual(copied.add_days(date(2011, 6, 30), 2), date(2011, 7, 5))
+
+    def test_shared_tables(self):
+        calendar = bizdatim.CompiledCalendar.get(weekends=(SAT, SUN), holidays=holidays)
+        first, second = Policy(calendar=calendar), Policy(calendar=calendar)
+        first.compile(date(2010, 1, 1), date(2011, 12, 31))
+        second.compile(date(2010, 1, 1), date(2011, 12, 31))
+        self.assertIs(first._compiled_counts, second._compiled_counts)
+
+
+class TestHolidayRules(unittest.TestCase):
+
+    rules = (
+        bizdatim.FixedHoliday(1, 1, observed={SAT: 2, SUN: 1}),
+        bizdatim.NthWeekdayHoliday(2, MON, 3),     # Family Day
+        bizdatim.EasterHoliday(-2),                # Good Friday
+        bizdatim.FixedHoliday(7, 1, observed={SAT: 2, SUN: 1}),
+        bizdatim.NthWeekdayHoliday(8, MON, 1),     # Civic Holiday
+        bizdatim.NthWeekdayHoliday(9, MON, 1),     # Labour Day
+        bizdatim.NthWeekdayHoliday(10, MON, 2),    # Thanksgiving Day
+        bizdatim.FixedHoliday(12, 25, observed={SAT: 2, SUN: 1}),
+        bizdatim.FixedHoliday(12, 26, observed={SAT: 2, SUN: 1}),
+    )
+
+    def setUp(self):
+        self.policy = Policy(weekends=(SAT, SUN), holidays=(date(2010, 5, 24), date(2011, 5, 23)),
+                             holiday_rules=self.rules)
+
+    def test_rules(self):
+        self.assertEqual(bizdatim.EasterHoliday().in_year(2008), date(2008, 3, 23))
+        self.assertEqual(bizdatim.EasterHoliday(1).in_year(2038), date(2038, 4, 26))
+        self.assertEqual(bizdatim.NthWeekdayHoliday(5, MON, -1).in_year(2011), date(2011, 5, 30))
+        self.assertEqual(bizdatim.NthWeekdayHoliday(5, MON, 5).in_year(2011), date(2011, 5, 30))
+        self.assertIsNone(bizdatim.NthWeekdayHoliday(6, MON, 5).in_year(2011))
+        self.assertIsNone(bizdatim.FixedHoliday(2, 29).in_year(2011))
+        self.assertRaises(AssertionError, bizdatim.FixedHoliday, 4, 31)
+        self.assertRaises(AssertionError, bizdatim.NthWeekdayHoliday, 4, MON, 0)
+
+    def test_same_as_holidays(self):
+        reference = Policy(weekends=(SAT, SUN), holidays=holidays)
+        for n in range(0, 630, 3):
+            day = date(2010, 1, 2) + timedelta(days=n)
+            self.assertEqual(self.policy.is_day_off(day), reference.is_day_off(day), day)
+            self.assertEqual(self.policy.add_days(day, 40), reference.add_days(day, 40))
+            self.assertEqual(self.policy.biz_day_delta(day, date(2011, 6, 1)),
+                             reference.biz_day_delta(day, date(2011, 6, 1)))
+
+    def test_observed(self):
+        # Christmas on a Saturday and Boxing Day on a Sunday, then Christmas on a Sunday
+        for day in (date(2010, 12, 27), date(2010, 12, 28), date(2011, 12, 26), date(2011, 12, 27)):
+            self.assertTrue(self.policy.is_holiday(day))
+        self.assertFalse(self.policy.is_holiday(date(2011, 12, 28)))
+        # New Year's day on a Saturday is observed on the Monday
+        self.assertEqual(self.policy.add_days(date(2010, 12, 31), 1), date(2011, 1, 4))
+
+    def test_lazy(self):
+        calendar = self.policy.calendar
+        self.policy.is_day_off(date(2011, 3, 1))
+        self.assertEqual(sorted(calendar._years), [2010, 2011, 2012])
+        self.assertEqual(self.policy.add_days(date(2011, 3, 1), 500), date(2013, 2, 25))
+        self.assertEqual(sorted(calendar._years), [2010, 2011, 2012, 2013, 2014])
+        self.assertEqual(self.policy.holidays, [date(2010, 5, 24), date(2011, 5, 23)])
+
+    def test_iteration(self):
+        days = list(itertools.islice(self.policy.iter_biz_days(date(2011, 12, 22)), 5))
+        self.assertEqual(days, [date(2011, 12, 22), date(2011, 12, 23), date(2011, 12, 28), date(2011, 12, 29),
+                                date(2011, 12, 30)])
+
+    def test_iteration_while_expanding(self):
+        # Other calls expand the shared calendar ahead of the iteration; a
+        # calendar of its own keeps the years of the other tests unexpanded
+        policy = Policy(weekends=(SAT, SUN), holiday_rules=self.rules)
+        days = []
+        for day in policy.iter_biz_days(date(2011, 1, 1), date(2016, 1, 1)):
+            policy.add_days(day, 60)
+            days.append(day)
+        self.assertFalse([day for day in days if policy.is_day_off(day)])
+        self.assertEqual(len(days), policy.biz_day_delta(date(2011, 1, 1), date(2016, 1, 1)))
+
+    def test_backward_iteration(self):
+        # Steps of more than a year backwards, each expanding years of rules
+        rules = [bizdatim.FixedHoliday(month, day) for month in range(1, 13) for day in (3, 10, 17, 24)]
+        iterated = Policy(weekends=(SAT, SUN), holiday_rules=rules)
+        reference = Policy(weekends=(SAT, SUN), holiday_rules=rules)
+        days = itertools.islice(iterated.iter_biz_days(date(2011, 6, 1), step=300, reverse=True), 6)
+        self.assertEqual(list(days), [reference.add_days(date(2011, 6, 1), -300 * n) for n in range(6)])
+
+    def test_holiday_rules_update(self):
+        self.policy.compile(date(2011, 1, 1), date(2011, 12, 31))
+        self.assertEqual(self.policy.add_days(date(2011, 6, 30), 1), date(2011, 7, 4))
+        self.policy.holiday_rules = []
+        self.assertEqual(self.policy.add_days(date(2011, 6, 30), 1), date(2011, 7, 1))
+        self.assertFalse(Policy(holiday_rules=self.rules).is_empty())
+
+    @unittest.skipIf(numpy is None, "numpy is not installed")
+    def test_batch(self):
+        days = numpy.array(['2011-06-30', '2025-12-24'], dtype='datetime64[D]')
+        numpy.testing.assert_array_equal(
+            self.policy.add_many(days, [1, 1]), numpy.array(['2011-07-04', '2025-12-29'], dtype='datetime64[D]'))
+
+
+class TestCycle(unittest.TestCase):
+
+    def setUp(self):
+        # Two days on, one day off
+        self.policy = Policy(cycle=(True, True, False), cycle_start=date(2011, 7, 1),
+                             holidays=(date(2011, 7, 14), date(2011, 8, 15)))
+
+    def naive_add_days(self, day, days):
+        step = 1 if days > 0 else -1
+        day = self.policy.closest_biz_day(day, days >= 0) if not days else day
+        while days:
+            day += timedelta(days=step)
+            if not self.policy.is_day_off(day):
+                days -= step
+        return day
+
+    def test_weekends(self):
+        self.assertEqual(self.policy.weekends, None)
+        self.assertEqual(self.policy.cycle, (True, True, False))
+        self.assertTrue(self.policy.is_weekend(date(2011, 7, 3)))
+        self.assertTrue(self.policy.is_weekend(date(2011, 6, 30)))
+        self.assertFalse(self.policy.is_weekend(date(2011, 7, 4)))
+        self.assertEqual(self.policy.weekends_between(date(2011, 7, 1), date(2011, 7, 31)), 10)
+        self.assertRaises(AssertionError, Policy, cycle=(True, False))
+        self.assertRaises(AssertionError, Policy, cycle=(False, False), cycle_start=date(2011, 7, 1))
+
+    def test_add_days(self):
+        for n in range(0, 90, 4):
+            day = date(2011, 6, 20) + timedelta(days=n)
+            for days in (1, 2, 5, 30, -1, -7, -30):
+                self.assertEqual(self.policy.add_days(day, days), self.naive_add_days(day, days), (day, days))
+
+    def test_biz_day_delta(self):
+        # The days off of the cycle given as holidays
+        days_off = [date(2011, 7, 3) + timedelta(days=n) for n in range(-30, 90, 3)]
+        reference = Policy(holidays=days_off + [date(2011, 7, 14), date(2011, 8, 15)])
+        for n in range(0, 60, 3):
+            day = date(2011, 7, 2) + timedelta(days=n)
+            self.assertEqual(self.policy.biz_day_delta(date(2011, 6, 22), day),
+                             reference.biz_day_delta(date(2011, 6, 22), day), day)
+
+    def test_closest_biz_day(self):
+        self.assertEqual(self.policy.closest_biz_day(date(2011, 7, 3)), date(2011, 7, 4))
+        self.assertEqual(self.policy.closest_biz_day(date(2011, 7, 3), forward=False), date(2011, 7, 2))
+        # A holiday right before the day off of the cycle
+        self.assertEqual(self.policy.closest_biz_day(date(2011, 7, 14)), date(2011, 7, 16))
+
+    def test_same_as_weekly(self):
+        weekly = Policy(weekends=(SAT, SUN), holidays=holidays)
+        cycle = Policy(cycle=(False, True, True, True, True, True, False), cycle_start=date(2011, 7, 3),
+                       holidays=holidays)
+        self.assertIs(weekly.calendar, cycle.calendar)
+        self.assertEqual(cycle.weekends, [SAT, SUN])
+
+    def test_compiled(self):
+        expected = self.policy.add_days(date(2011, 7, 1), 40)
+        self.policy.compile(date(2011, 1, 1), date(2011, 12, 31))
+        self.assertEqual(self.policy.add_days(date(2011, 7, 1), 40), expected)
+
+    def test_setters(self):
+        self.policy.holidays = []
+        self.assertEqual(self.policy.cycle, (True, True, False))
+        self.assertEqual(self.policy.add_days(date(2011, 7, 13), 1), date(2011, 7, 14))
+
+    @unittest.skipIf(numpy is None, "numpy is not installed")
+    def test_batch(self):
+        days = numpy.array(['2011-07-01', '2011-07-13'], dtype='datetime64[D]')
+        numpy.testing.assert_array_equal(
+            self.policy.add_many(days, [4, 1]), numpy.array(['2011-07-07', '2011-07-16'], dtype='datetime64[D]'))
+        # The lower day counts when it is not a weekend, as in biz_day_delta
+        self.assertEqual(self.policy.biz_day_delta(date(2011, 7, 1), date(2011, 7, 8)), 5)
+        self.assertEqual(list(self.policy.biz_day_delta_many(['2011-07-01'], ['2011-07-08'])), [5])
+
+
+class TestCombination(unittest.TestCase):
+
+    def setUp(self):
+        self.paris = Policy(weekends=(SAT, SUN), holidays=(date(2011, 7, 14), date(2011, 8, 15)),
+                            holiday_rules=[bizdatim.FixedHoliday(5, 1)])
+        self.new_york = Policy(weekends=(SAT, SUN), holidays=holidays + (date(2011, 7, 4),))
+        self.shifts = Policy(cycle=(True, True, False), cycle_start=date(2011, 7, 1))
+
+    def test_intersection(self):
+        policy = self.paris & self.new_york
+        self.assertEqual(policy.weekends, [SAT, SUN])
+        for n in range(400):
+            day = date(2011, 1, 1) + timedelta(days=n)
+            self.assertEqual(policy.is_day_off(day), self.paris.is_day_off(day) or self.new_york.is_day_off(day))
+        self.assertEqual(policy.add_days(date(2011, 6, 30), 1), date(2011, 7, 5))
+        self.assertEqual(policy.add_days(date(2011, 7, 13), 1), date(2011, 7, 15))
+        self.assertEqual(policy.biz_day_delta(date(2011, 6, 30), date(2011, 7, 15)), 8)
+        self.assertEqual(policy.closest_biz_day(date(2012, 5, 1)), date(2012, 5, 2))
+
+    def test_union(self):
+        policy = self.paris.union(self.new_york, self.shifts)
+        self.assertEqual(policy.calendar.cycle, 21)
+        for n in range(400):
+            day = date(2011, 1, 1) + timedelta(days=n)
+            self.assertEqual(policy.is_day_off(day), all(
+                p.is_day_off(day) for p in (self.paris, self.new_york, self.shifts)), day)
+
+    def test_cycle(self):
+        policy = self.new_york & self.shifts
+        for n in range(0, 120, 7):
+            day = date(2011, 6, 1) + timedelta(days=n)
+            expected = day
+            while self.new_york.is_day_off(expected) or self.shifts.is_day_off(expected):
+                expected += timedelta(days=1)
+            self.assertEqual(policy.closest_biz_day(day), expected)
+            for _ in range(10):
+                expected += timedelta(days=1)
+                while self.new_york.is_day_off(expected) or self.shifts.is_day_off(expected):
+                    expected += timedelta(days=1)
+            self.assertEqual(policy.add_days(policy.closest_biz_day(day), 10), expected, day)
+
+    def test_shared(self):
+        self.assertIs((self.paris & self.new_york).calendar, (self.paris & self.new_york).calendar)
+        self.assertIsNot((self.paris & self.new_york).calendar, (self.paris | self.new_york).calendar)
+
+    def test_setters(self):
+        policy = self.paris & self.new_york
+        policy.holidays = [date(2011, 7, 6)]
+        self.assertTrue(policy.is_holiday(date(2011, 7, 4)))
+        self.assertTrue(policy.is_holiday(date(2011, 7, 6)))
+        policy.weekends = [SUN]
+        self.assertTrue(policy.is_holiday(date(2011, 7, 14)))
+        self.assertFalse(policy.is_day_off(date(2011, 7, 2)))
+
+    def test_hours(self):
+        hours = Policy(hours=(time(8), time(20)))
+        self.assertRaises(AssertionError, hours.intersection, self.paris)
+        self.assertEqual((hours & Policy(hours=[time(8), time(20)])).hours, (time(8), time(20)))
+        self.assertRaises(AssertionError, self.paris.intersection, self.shifts,
+                          Policy(weekends=[MON, TUE, WED, THU, FRI]))
+
+    @unittest.skipIf(numpy is None, "numpy is not installed")
+    def test_batch(self):
+        policy = self.paris & self.new_york & self.shifts
+        days = numpy.array(['2011-06-30', '2011-07-13'], dtype='datetime64[D]')
+        expected = [policy.add_days(day, 3) for day in (date(2011, 6, 30), date(2011, 7, 13))]
+        numpy.testing.assert_array_equal(
+            policy.add_many(days, 3), numpy.array(expected, dtype='datetime64[D]'))
+
+
+class TestBusinessHours(unittest.TestCase):
+
+    def setUp(self):
+        day = [(time(9), time(12)), (time(13), time(18))]
+        self.hours = bizdatim.BusinessHours(
+            {MON: day, TUE: day, WED: day, THU: day, FRI: [(time(9), time(16))]},
+            special={date(2011, 6, 30): [(time(9), time(12))]})
+        self.policy = Policy(weekends=(SAT, SUN), holidays=holidays, hours=self.hours)
+
+    def test_breaks(self):
+        day = datetime(2011, 6, 29, 11)
+        self.assertEqual(self.policy.add_seconds(day, 3600), datetime(2011, 6, 29, 12))
+        self.assertEqual(self.policy.add_seconds(day, 7200), datetime(2011, 6, 29, 14))
+        self.assertEqual(self.policy.add_seconds(day, -7200), datetime(2011, 6, 29, 9))
+        self.assertEqual(self.policy.add_seconds(datetime(2011, 6, 29, 12, 30), 0), datetime(2011, 6, 29, 13))
+        self.assertEqual(self.policy.add_seconds(datetime(2011, 6, 29, 12, 30), -60), datetime(2011, 6, 29, 11, 59))
+        self.assertTrue(self.policy.is_not_in_business_hours(datetime(2011, 6, 29, 12, 30)))
+        self.assertFalse(self.policy.is_not_in_business_hours(datetime(2011, 6, 29, 12)))
+
+    def test_special_days(self):
+        # Half-day on Thursday, Canada Day on Friday, a short Friday the week after
+        day = datetime(2011, 6, 29, 11)
+        self.assertEqual(self.policy.add_seconds(day, 9 * 3600), datetime(2011, 6, 30, 12))
+        self.assertEqual(self.policy.add_seconds(day, 30 * 3600), datetime(2011, 7, 6, 15))
+        self.assertEqual(self.policy.add_seconds(datetime(2011, 7, 8, 15), 3600), datetime(2011, 7, 8, 16))
+        self.assertEqual(self.policy.add_seconds(datetime(2011, 7, 8, 15), 7200), datetime(2011, 7, 11, 10))
+
+    def test_biz_seconds_between(self):
+        day = datetime(2011, 6, 29, 11)
+        for seconds in (0, 3600, 9 * 3600, 30 * 3600, -30 * 3600, 10 ** 7, -10 ** 7):
+            self.assertEqual(self.policy.biz_seconds_between(day, self.policy.add_seconds(day, seconds)),
+                             abs(seconds))
+
+    def test_same_as_hours(self):
+        for hours in ((time(8, 30), time(20, 30)), (time(20, 30), time(8, 30))):
+            reference = Policy(weekends=(SAT, SUN), holidays=holidays, hours=hours)
+            policy = Policy(weekends=(SAT, SUN), holidays=holidays,
+                            hours=bizdatim.BusinessHours(dict((weekday, [hours]) for weekday in range(7))))
+            for n in range(0, 700 * 48, 97):
+                day = datetime(2010, 1, 1) + timedelta(minutes=30 * n)
+                for seconds in (0, 1800, -1800, 43200, -43200, 10 ** 6, -10 ** 6):
+                    self.assertEqual(policy.add_seconds(day, seconds), reference.add_seconds(day, seconds),
+                                     (day, seconds))
+                other = day + timedelta(hours=n % 500)
+                self.assertEqual(policy.biz_seconds_between(day, other), reference.biz_seconds_between(day, other))
+
+    def test_invalid(self):
+        self.assertRaises(AssertionError, bizdatim.BusinessHours, {7: []})
+        self.assertRaises(AssertionError, bizdatim.BusinessHours, {MON: [(time(9), time(12)), (time(11), time(18))]})
+        self.assertRaises(AssertionError, bizdatim.BusinessHours, {MON: [(time(9), time(2)), (time(3), time(10))]})
+        self.policy.compile(date(2011, 1, 1), date(2011, 12, 31))
+        self.assertRaises(AssertionError, self.policy.save_compiled, os.devnull)
+
+    def test_no_business_hours(self):
+        # Hours only on Saturdays, which are weekends: no year ever has any
+        policy = Policy(weekends=(SAT, SUN), hours=bizdatim.BusinessHours({SAT: [(time(9), time(17))]}))
+        self.assertRaises(ValueError, policy.add_seconds, datetime(2011, 7, 4, 10), 3600)
+        self.assertRaises(ValueError, policy.add_seconds, datetime(2011, 7, 4, 10), -3600)
+        # Until the last special day
+        policy.hours = bizdatim.BusinessHours({SAT: [(time(9), time(17))]},
+                                              special={date(2013, 7, 4): [(time(9), time(12))]})
+        self.assertEqual(policy.add_seconds(datetime(2011, 7, 4, 10), 3600), datetime(2013, 7, 4, 10))
+        self.assertEqual(policy.add_seconds(datetime(2014, 7, 4, 10), -3600), datetime(2013, 7, 4, 11))
+        self.assertRaises(ValueError, policy.add_seconds, datetime(2014, 7, 4, 10), 3600)
+
+    def test_pickle(self):
+        policy = Policy(weekends=(SAT, SUN), holidays=holidays, holiday_rules=TestHolidayRules.rules, hours=self.hours)
+        day = datetime(2011, 6, 29, 11)
+        for copied in [copy.deepcopy(policy)] + [pickle.loads(pickle.dumps(policy, protocol))
+                                                 for protocol in range(pickle.HIGHEST_PROTOCOL + 1)]:
+            self.assertIs(copied.calendar, policy.calendar)
+            self.assertEqual(copied.hours, self.hours)
+            self.assertEqual(copied.add_seconds(day, 30 * 3600), policy.add_seconds(day, 30 * 3600))
+
+    def test_shared_tables(self):
+        other = Policy(calendar=self.policy.calendar, hours=self.hours)
+        self.policy.add_seconds(datetime(2011, 6, 29, 11), 3600)
+        self.assertIs(self.policy.calendar.business_seconds(self.hours, 2011),
+                      other.calendar.business_seconds(self.hours, 2011))
+
+    @unittest.skipIf(numpy is None, "numpy is not installed")
+    def test_batch(self):
+        days = numpy.array(['2011-06-29T11:00', '2011-06-29T11:00'], dtype='datetime64[us]')
+        numpy.testing.assert_array_equal(
+            self.policy.add_seconds_many(days, [3600, 9 * 3600]),
+            numpy.array(['2011-06-29T12:00', '2011-06-30T12:00'], dtype='datetime64[us]'))
+
+
+class TestOrdinals(unittest.TestCase):
+
+    def setUp(self):
+        self.policy = Policy(weekends=(SAT, SUN), holidays=holidays, hours=(time(8, 30), time(20, 30)))
+        self.days = [date(2009, 12, 20) + timedelta(days=n) for n in range(0, 760, 3)]
+
+    def check(self):
+        for day in self.days:
+            ordinal = day.toordinal()
+            self.assertEqual(self.policy.is_day_off_ordinal(ordinal), self.policy.is_day_off(day))
+            for forward in (True, False):
+                self.assertEqual(date.fromordinal(self.policy.closest_biz_day_ordinal(ordinal, forward)),
+                                 self.policy.closest_biz_day(day, forward))
+            for days in (0, 1, 7, 30, -1, -30):
+                self.assertEqual(date.fromordinal(self.policy.add_ordinal(ordinal, days)),
+                                 self.policy.add_days(day, days))
+            other = date(2011, 3, 3)
+            self.assertEqual(self.policy.delta_ordinal(ordinal, other.toordinal()),
+                             self.policy.biz_day_delta(day, other))
+
+    def test_ordinals(self):
+        self.check()
+
+    def test_compiled(self):
+        self.policy.compile(date(2010, 1, 1), date(2011, 6, 30))
+        self.check()
+
+    def test_epoch(self):
+        epoch = datetime(1970, 1, 1)
+        for day in self.days:
+            moment = datetime.combine(day, time(19, 45))
+            timestamp = int((moment - epoch).total_seconds())
+            for seconds in (0, 3600, -3600, 100000, -100000):
+                self.assertEqual(self.policy.add_seconds_epoch(timestamp, seconds),
+                                 (self.policy.add_seconds(moment, seconds) - epoch).total_seconds())
+            self.assertEqual(self.policy.biz_seconds_between_epoch(timestamp, 1299138300),
+                             self.policy.biz_seconds_between(moment, datetime(2011, 3, 3, 7, 45)))
+
+    def test_datetimes(self):
+        # The date methods keep the time of datetimes
+        self.assertEqual(self.policy.add_days(datetime(2011, 6, 30, 10, 15), 1), datetime(2011, 7, 4, 10, 15))
+        self.assertEqual(self.policy.closest_biz_day(datetime(2011, 7, 1, 10, 15)), datetime(2011, 7, 4, 10, 15))
+
+
+class TestSnapshots(unittest.TestCase):
+
+    def setUp(self):
+        self.policy = Policy(weekends=(SAT, SUN), holidays=holidays, hours=(time(8, 30), time(20, 30)))
+        self.bridge = date(2011, 6, 30)
+
+    def test_incremental_changes(self):
+        self.policy.add_holidays([self.bridge, date(2011, 7, 1)])
+        self.assertEqual(self.policy.holidays, sorted(holidays + (self.bridge,)))
+        # Same calendar as when holidays are given at once
+        self.assertIs(self.policy.calendar, bizdatim.CompiledCalendar.get((SAT, SUN), holidays + (self.bridge,)))
+        self.assertEqual(self.policy.add_days(date(2011, 6, 29), 1), date(2011, 7, 4))
+        self.policy.remove_holidays([self.bridge, date(2011, 7, 2)])
+        self.assertEqual(self.policy.holidays, list(holidays))
+        self.assertEqual(self.policy.add_days(date(2011, 6, 29), 1), date(2011, 6, 30))
+
+    def test_versions(self):
+        self.assertEqual(self.policy.version, 0)
+        snapshot = self.policy.snapshot()
+        self.policy.add_holidays([self.bridge])
+        self.policy.hours = None
+        self.assertEqual(self.policy.version, 2)
+        self.assertEqual(snapshot.version, 0)
+        self.assertEqual(snapshot.hours, (time(8, 30), time(20, 30)))
+        self.assertEqual(snapshot.add_days(date(2011, 6, 29), 1), date(2011, 6, 30))
+        self.assertEqual(self.policy.add_days(date(2011, 6, 29), 1), date(2011, 7, 4))
+
+    def test_compiled(self):
+        self.policy.compile(date(2010, 1, 1), date(2011, 12, 31))
+        snapshot = self.policy.snapshot()
+        self.policy.add_holidays([self.bridge])
+        self.assertEqual(self.policy._compiled_counts[-1], snapshot._compiled_counts[-1] - 1)
+        before = Policy(weekends=(SAT, SUN), holidays=holidays)
+        after = Policy(weekends=(SAT, SUN), holidays=holidays + (self.bridge,))
+        start = date(2010, 6, 1)
+        for day in (date(2011, 6, 1), date(2011, 6, 30), date(2011, 7, 31)):
+            self.assertEqual(self.policy.biz_day_delta(start, day), after.biz_day_delta(start, day))
+            self.assertEqual(snapshot.biz_day_delta(start, day), before.biz_day_delta(start, day))
+
+    def test_iteration(self):
+        days = self.policy.iter_biz_days(date(2011, 6, 28))
+        self.assertEqual(next(days), date(2011, 6, 28))
+        self.policy.add_holidays([self.bridge])
+        # A started iteration keeps the version it started with
+        self.assertEqual(next(days), date(2011, 6, 29))
+        self.assertEqual(next(days), self.bridge)
+
+    def test_concurrent_readers(self):
+        expected = {
+            False: [self.policy.add_days(date(2011, 6, 20), n) for n in range(20)],
+            True: [self.policy.snapshot().add_days(date(2011, 6, 20), n) for n in range(20)],
+        }
+        self.policy.add_holidays([self.bridge])
+        expected[True] = [self.policy.add_days(date(2011, 6, 20), n) for n in range(20)]
+        self.policy.remove_holidays([self.bridge])
+        stop = threading.Event()
+        errors = []
+
+        def read():
+            while not stop.is_set():
+                snapshot = self.policy.snapshot()
+                result = [snapshot.add_days(date(2011, 6, 20), n) for n in range(20)]
+                if result != expected[snapshot.version % 2 == 1]:
+                    errors.append((snapshot.version, result))
+
+        readers = [threading.Thread(target=read) for _ in range(4)]
+        for reader in readers:
+            reader.start()
+        for _ in range(200):
+            self.policy.add_holidays([self.bridge])
+            self.policy.remove_holidays([self.bridge])
+        stop.set()
+        for reader in readers:
+            reader.join()
+        self.assertEqual(errors, [])
+
+    def test_concurrent_expansion(self):
+        rules = (bizdatim.FixedHoliday(3, 17), bizdatim.FixedHoliday(11, 11), bizdatim.NthWeekdayHoliday(6, THU, 2))
+        policy = Policy(holiday_rules=rules)
+        counts = []
+
+        def read(offset):
+            for year in range(1900 + offset, 2100, 8):
+                counts.append(policy.holidays_between(date(year, 1, 1), date(year, 12, 31), skip_weekends=False))
+
+        readers = [threading.Thread(target=read, args=(offset,)) for offset in range(8)]
+        for reader in readers:
+            reader.start()
+        for reader in readers:
+            reader.join()
+        self.assertEqual(counts, [3] * 200)
+
+
+class TestCommandLine(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(os.rmdir, self.directory)
+        self.holidays = self.path('holidays.txt', '# Canada\n' + '\n'.join(h.isoformat() for h in holidays) + '\n')
+        self.output = os.path.join(self.directory, 'output.csv')
+
+    def path(self, name, content):
+        path = os.path.join(self.directory, name)
+        with open(path, 'w') as f:
+            f.write(content)
+        self.addCleanup(os.remove, path)
+        return path
+
+    def run_main(self, *args):
+        self.assertEqual(bizdatim.main(list(args) + ['-H', self.holidays, '-o', self.output]), 0)
+        with open(self.output) as f:
+            lines = f.read().splitlines()
+        os.remove(self.output)
+        return lines
+
+    def test_add(self):
+        source = self.path('input.csv', '2011-03-03,2\n\n2011-03-03,-8\n2011-03-03T10:00:00,1\n')
+        self.assertEqual(self.run_main('add', '-i', source), [
+            '2011-03-03,2,2011-03-07',
+            '2011-03-03,-8,2011-02-18',
+            '2011-03-03T10:00:00,1,2011-03-04T10:00:00',
+        ])
+
+    def test_delta(self):
+        source = self.path('input.csv', '2011-07-04;2011-06-30\n')
+        self.assertEqual(self.run_main('delta', '-i', source, '-d', ';'), ['2011-07-04;2011-06-30;1'])
+
+    def test_next(self):
+        source = self.path('input.csv', '2011-07-01\n2011-07-05\n')
+        self.assertEqual(
+            self.run_main('next', '-i', source, '-w', 'FRI,SAT'),
+            ['2011-07-01,2011-07-03', '2011-07-05,2011-07-05'],
+        )
+
+    def test_jobs(self):
+        days = [date(2011, 1, 1) + timedelta(days=n) for n in range(300)]
+        source = self.path('input.csv', ''.join('%s,%d\n' % (day, n % 30) for n, day in enumerate(days)))
+        lines = self.run_main('add', '-i', source, '-j', '3', '--chunk-size', '7')
+        policy = Policy(weekends=(SAT, SUN), holidays=holidays)
+        self.assertEqual(lines, ['%s,%d,%s' % (day, n % 30, policy.add(day, n % 30)) for n, day in enumerate(days)])
+
+    def test_invalid_options(self):
+        devnull = open(os.devnull, 'w')
+        self.addCleanup(devnull.close)
+        self.addCleanup(setattr, sys, 'stderr', sys.stderr)
+        sys.stderr = devnull
+        source = self.path('input.csv', '2011-03-03,2\n')
+        for options in (['--chunk-size', '0'], ['-j', '-1']):
+            self.assertRaises(SystemExit, bizdatim.main, ['add', '-i', source] + options)
+
+
+@unittest.skipIf(numpy is None, "numpy is not installed")
+class TestBatch(unittest.TestCase):
+
+    def setUp(self):
+        self.policy = Policy(weekends=(SAT, SUN), holidays=holidays)
+        self.days = [date(2009, 12, 1) + timedelta(days=n) for n in range(800)]
+
+    def test_add_many(self):
+        for delta in (-60, -5, -1, 0, 1, 2, 5, 9, 60):
+            expected = numpy.array([self.policy.add_days(day, delta) for day in self.days], dtype='datetime64[D]')
+            numpy.testing.assert_array_equal(self.policy.add_many(self.days, delta), expected)
+
+    def test_add_many_per_row(self):
+        deltas = [n % 41 - 20 for n in range(len(self.days))]
+        expected = [self.policy.add_days(day, delta) for day, delta in zip(self.days, deltas)]
+        result = self.policy.add_many(numpy.array(self.days, dtype='datetime64[D]'), numpy.array(deltas))
+        numpy.testing.assert_array_equal(result, numpy.array(expected, dtype='datetime64[D]'))
+
+    def test_closest_biz_day_many(self):
+        for forward in (True, False):
+            expected = [self.policy.closest_biz_day(day, forward) for day in self.days]
+            numpy.testing.assert_array_equal(
+                self.policy.closest_biz_day_many(self.days, forward),
+                numpy.array(expected, dtype='datetime64[D]'),
+            )
+
+    def test_biz_day_delta_many(self):
+        for other in (date(2009, 12, 24), date(2010, 7, 3), date(2011, 1, 1), date(2012, 1, 31)):
+            expected = [self.policy.biz_day_delta(day, other) for day in self.days]
+            numpy.testing.assert_array_equal(self.policy.biz_day_delta_many(self.days, other), expected)
+
+    def test_holidays_update(self):
+        self.policy.holidays = [date(2011, 3, 4)]
+        self.assertEqual(self.policy.add_many(['2011-03-03'], 1)[0], numpy.datetime64('2011-03-07'))
+
+
+class TestIteration(unittest.TestCase):
+
+    def setUp(self):
+        self.policy = Policy(weekends=(SAT, SUN), holidays=holidays)
+
+    def test_iter_biz_days(self):
+        days = list(self.policy.iter_biz_days(date(2009, 12, 1), date(2012, 1, 1)))
+        self.assertEqual(len(days), self.policy.biz_day_delta(date(2009, 12, 1), date(2012, 1, 1)))
+        self.assertEqual(days[0], date(2009, 12, 1))
+        self.assertEqual(days[-1], date(2011, 12, 30))
+        for day, following in zip(days, days[1:]):
+            self.assertEqual(self.policy.add_days(day, 1), following)
+
+    def test_step(self):
+        for step in (2, 5, 7, 23):
+            days = list(self.policy.iter_biz_days(date(2010, 12, 24), date(2012, 1, 1), step))
+            for day, following in zip(days, days[1:]):
+                self.assertEqual(self.policy.add_days(day, step), following)
+
+    def test_reverse(self):
+        days = list(self.policy.iter_biz_days(date(2011, 1, 2), date(2010, 12, 20), reverse=True))
+        self.assertEqual(days, [date(2010, 12, 31), date(2010, 12, 30), date(2010, 12, 29), date(2010, 12, 24),
+                                date(2010, 12, 23), date(2010, 12, 22), date(2010, 12, 21)])
+
+    def test_unbounded(self):
+        days = self.policy.iter_biz_days(datetime(2011, 6, 30, 10, 0))
+        self.assertEqual(list(itertools.islice(days, 3)),
+                         [datetime(2011, 6, 30, 10, 0), datetime(2011, 7, 4, 10, 0), datetime(2011, 7, 5, 10, 0)])
+
+    def test_biz_day_range(self):
+        self.assertEqual(list(self.policy.biz_day_range(date(2011, 6, 29), date(2011, 7, 6), 2)),
+                         [date(2011, 6, 29), date(2011, 7, 4)])
+        self.assertEqual(list(self.policy.biz_day_range(date(2011, 7, 6), date(2011, 6, 29), -2)),
+                         [date(2011, 7, 6), date(2011, 7, 4)])
+        self.assertEqual(list(self.policy.biz_day_range(date(2011, 7, 6), date(2011, 6, 29))), [])
+        self.assertRaises(AssertionError, self.policy.biz_day_range, date(2011, 7, 6), date(2011, 6, 29), 0)
+
+
+class TestPeriods(unittest.TestCase):
+
+    def setUp(self):
+        self.policies = [
+            Policy(weekends=(SAT, SUN), holidays=holidays),
+            Policy(cycle=(True, True, False), cycle_start=date(2011, 7, 1)),
+            Policy(weekends=(SAT, SUN), holiday_rules=[bizdatim.FixedHoliday(1, 1), bizdatim.EasterHoliday(1)]),
+        ]
+
+    def scan(self, policy, first, last):
+        """The business days of [first, last), one by one."""
+        return [first + timedelta(days=i) for i in range((last - first).days)
+                if not policy.is_day_off(first + timedelta(days=i))]
+
+    def test_months(self):
+        for policy in self.policies:
+            for year, month in itertools.product((2009, 2010, 2011), range(1, 13)):
+                days = self.scan(policy, date(year, month, 1), date(year + month // 12, month % 12 + 1, 1))
+                self.assertEqual(policy.biz_days_in(year, month), len(days))
+                self.assertEqual(policy.last_biz_day(year, month), days[-1])
+                for n in (1, 5, len(days)):
+                    self.assertEqual(policy.nth_biz_day(year, month, n), days[n - 1])
+                    self.assertEqual(policy.nth_biz_day(year, month, -n), days[-n])
+                self.assertIsNone(policy.nth_biz_day(year, month, len(days) + 1))
+                self.assertIsNone(policy.nth_biz_day(year, month, -len(days) - 1))
+
+    def test_quarters_and_years(self):
+        policy = self.policies[0]
+        days = self.scan(policy, date(2010, 4, 1), date(2010, 7, 1))
+        self.assertEqual(policy.biz_days_in(2010, quarter=2), len(days))
+        self.assertEqual(policy.nth_biz_day(2010, n=5, quarter=2), days[4])
+        self.assertEqual(policy.last_biz_day(2010, quarter=2), days[-1])
+        days = self.scan(policy, date(2010, 1, 1), date(2011, 1, 1))
+        self.assertEqual(policy.biz_days_in(2010), len(days))
+        self.assertEqual(policy.nth_biz_day(2010, n=100), days[99])
+        self.assertEqual(policy.last_biz_day(2010), date(2010, 12, 31))
+        self.assertRaises(AssertionError, policy.biz_days_in, 2010, 13)
+        self.assertRaises(AssertionError, policy.biz_days_in, 2010, 1, 1)
+        self.assertRaises(AssertionError, policy.nth_biz_day, 2010, 1, 0)
+
+    def test_schedule(self):
+        policy = self.policies[0]
+        self.assertEqual(list(policy.biz_day_schedule(date(2009, 12, 15), date(2011, 12, 31))),
+                         [policy.nth_biz_day(2009 + (11 + i) // 12, (11 + i) % 12 + 1) for i in range(25)])
+        # Periods of 3 months spanning new year
+        self.assertEqual(list(policy.biz_day_schedule(date(2009, 11, 1), date(2010, 8, 1), n=-1, months=3)),
+                         [date(2010, 1, 29), date(2010, 4, 30), date(2010, 7, 30), date(2010, 10, 29)])
+        self.assertEqual(list(policy.biz_day_schedule(date(2009, 11, 1), date(2010, 8, 1), n=22, months=3)),
+                         [policy.add_days(policy.closest_biz_day(first), 21)
+                          for first in (date(2009, 11, 1), date(2010, 2, 1), date(2010, 5, 1), date(2010, 8, 1))])
+        # A month only has so many business days
+        self.assertEqual(policy.biz_days_in(2011, 2), 19)
+        self.assertEqual(list(policy.biz_day_schedule(date(2011, 1, 1), date(2011, 3, 1), n=20)),
+                         [date(2011, 1, 31), date(2011, 3, 28)])
+        self.assertRaises(AssertionError, list, policy.biz_day_schedule(date(2011, 1, 1), date(2011, 3, 1), months=0))
+
+    def test_versions(self):
+        policy = Policy(weekends=(SAT, SUN), holidays=holidays)
+        self.assertEqual(policy.nth_biz_day(2011, 6, 22), date(2011, 6, 30))
+        policy.add_holidays([date(2011, 6, 30)])
+        self.assertEqual(policy.nth_biz_day(2011, 6, 22), None)
+        self.assertEqual(policy.last_biz_day(2011, 6), date(2011, 6, 29))
+
+
+class _FixedOffset(tzinfo):
+    """A time zone at a fixed number of minutes east of UTC, Python 2 having no datetime.timezone."""
+
+    def __init__(self, minutes):
+        self.offset = timedelta(minutes=minutes)
+
+    def utcoffset(self, day):
+        return self.offset
+
+    def dst(self, day):
+        return timedelta(0)
+
+
+class TestCache(unittest.TestCase):
+
+    def setUp(self):
+        self.policy = Policy(weekends=(SAT, SUN), holidays=holidays, hours=(time(8, 30), time(20, 30)))
+        self.policy.enable_cache(maxsize=4)
+
+    def test_disabled_by_default(self):
+        self.assertIsNone(Policy(weekends=(SAT, SUN)).cache_info())
+
+    def test_hits_and_misses(self):
+        self.assertEqual(self.policy.closest_biz_day(date(2011, 7, 1)), date(2011, 7, 4))
+        self.assertEqual(self.policy.closest_biz_day(date(2011, 7, 1)), date(2011, 7, 4))
+        self.assertEqual(self.policy.closest_biz_day(date(2011, 7, 1), forward=False), date(2011, 6, 30))
+        info = self.policy.cache_info()
+        self.assertEqual((info.hits, info.misses, info.evictions, info.currsize), (1, 2, 0, 2))
+
+    def test_date_and_datetime(self):
+        self.assertEqual(self.policy.add(date(2011, 3, 3), 1), date(2011, 3, 4))
+        self.assertEqual(self.policy.add(datetime(2011, 3, 3), 1), datetime(2011, 3, 4, 8, 30))
+
+    def test_time_zones(self):
+        # The same instant, before business hours in one zone and during them in the other
+        utc, paris = _FixedOffset(0), _FixedOffset(60)
+        day1, day2 = datetime(2011, 3, 3, 8, 0, tzinfo=utc), datetime(2011, 3, 3, 9, 0, tzinfo=paris)
+        self.assertEqual(day1, day2)
+        self.assertEqual(self.policy.add(day1, timedelta(hours=1)), datetime(2011, 3, 3, 9, 30, tzinfo=utc))
+        result = self.policy.add(day2, timedelta(hours=1))
+        self.assertEqual((result, result.tzinfo), (datetime(2011, 3, 3, 10, 0, tzinfo=paris), paris))
+        self.assertEqual(self.policy.cache_info().hits, 0)
+
+    def test_evictions(self):
+        for n in range(6):
+            self.policy.biz_day_delta(date(2011, 3, 3), date(2011, 3, 10 + n))
+        info = self.policy.cache_info()
+        self.assertEqual((info.evictions, info.currsize), (2, 4))
+        self.policy.biz_day_delta(date(2011, 3, 3), date(2011, 3, 15))
+        self.assertEqual(self.policy.cache_info().hits, 1)
+        self.policy.biz_day_delta(date(2011, 3, 3), date(2011, 3, 10))
+        self.assertEqual(self.policy.cache_info().hits, 1)
+
+    def test_invalidation(self):
+        self.assertEqual(self.policy.add_days(date(2011, 3, 3), 1), date(2011, 3, 4))
+        self.policy.holidays = list(holidays) + [date(2011, 3, 4)]
+        self.assertEqual(self.policy.add_days(date(2011, 3, 3), 1), date(2011, 3, 7))
+        self.policy.weekends = (SUN,)
+        self.assertEqual(self.policy.add_days(date(2011, 3, 3), 1), date(2011, 3, 5))
+        self.assertEqual(self.policy.add(datetime(2011, 3, 3, 20, 0), timedelta(hours=1)), datetime(2011, 3, 5, 9, 0))
+        self.policy.hours = (time(8, 0), time(20, 0))
+        self.assertEqual(self.policy.add(datetime(2011, 3, 3, 20, 0), timedelta(hours=1)), datetime(2011, 3, 5, 9, 0))
+        self.policy.hours = (time(8, 0), time(21, 0))
+        self.assertEqual(self.policy.add(datetime(2011, 3, 3, 20, 0), timedelta(hours=1)), datetime(2011, 3, 3, 21, 0))
+
+
+class TestStats(unittest.TestCase):
+
+    def setUp(self):
+        self.policy = Policy(weekends=(SAT, SUN), holidays=holidays, hours=(time(8, 30), time(20, 30)))
+        self.policy.enable_stats()
+
+    def test_disabled_by_default(self):
+        self.assertIsNone(Policy(weekends=(SAT, SUN)).stats_info())
+
+    def test_calls(self):
+        for _ in range(3):
+            self.policy.biz_day_delta(date(2011, 3, 3), date(2011, 3, 10))
+        # Christmas 2010 falls on a Saturday, followed by two holidays
+        self.assertEqual(self.policy.closest_biz_day(date(2010, 12, 25)), date(2010, 12, 29))
+        stats = self.policy.stats_info()
+        self.assertEqual(sorted(stats), ['biz_day_delta', 'closest_biz_day'])
+        self.assertEqual(stats['biz_day_delta'].calls, 3)
+        self.assertEqual(stats['closest_biz_day'][::2], (1, 3))
+        self.assertTrue(stats['closest_biz_day'].seconds > 0)
+
+    def test_nested_calls(self):
+        # The steps of add are accounted to it
+        self.policy.add(datetime(2011, 6, 29, 14, 30), timedelta(days=22, hours=10))
+        stats = self.policy.stats_info()
+        self.assertEqual(list(stats), ['add'])
+        self.assertEqual(stats['add'].calls, 1)
+        self.assertEqual(stats['add'].max_depth, 2)
+
+    def test_hook(self):
+        calls = []
+        self.policy.enable_stats(hook=lambda name, stats: calls.append((name, stats.calls, stats.max_depth)))
+        self.policy.add_ordinal(date(2011, 6, 29).toordinal(), 22)
+        self.policy.snapshot().delta_ordinal(date(2011, 6, 29).toordinal(), date(2011, 7, 29).toordinal())
+        self.assertEqual(calls, [('add_ordinal', 1, 3), ('delta_ordinal', 1, 0)])
+
+    def test_clear_and_disable(self):
+        self.policy.add_days(date(2011, 6, 29), 1)
+        self.policy.clear_stats()
+        self.assertEqual(self.policy.stats_info(), {})
+        self.policy.disable_stats()
+        self.policy.add_days(date(2011, 6, 29), 1)
+        self.assertIsNone(self.policy.stats_info())
+
+    def test_subclass(self):
+        # Disabled stats leave the methods as they are, subclasses keep theirs
+        class Custom(Policy):
+            __slots__ = ()
+
+            def add_days(self, day, days):
+                return super(Custom, self).add_days(day, 2 * days)
+
+        policy = Custom(weekends=(SAT, SUN), holidays=holidays)
+        policy.enable_stats()
+        policy.enable_stats()
+        self.assertIsInstance(policy, Custom)
+        self.assertEqual(policy.add_days(date(2011, 6, 29), 1), date(2011, 7, 4))
+        self.assertEqual(policy.stats_info()['add_days'].calls, 1)
+        policy.disable_stats()
+        self.assertIs(type(policy), Custom)
+        self.assertIs(type(self.policy.snapshot()), type(self.policy))
+        self.policy.disable_stats()
+        self.assertIs(type(self.policy), Policy)
+
+
+@unittest.skipIf(pandas is None, "pandas is not installed")
+class TestPandas(unittest.TestCase):
+
+    def setUp(self):
+        self.policy = Policy(weekends=(SAT, SUN), holidays=holidays, hours=(time(8, 30), time(20, 30)))
+        self.days = [datetime(2010, 12, 20, 5, 0) + timedelta(minutes=n * 97) for n in range(500)]
+        self.series = pandas.Series(self.days, name='day')
+
+    def assertSeriesEqual(self, series, expected):
+        self.assertEqual([None if pandas.isna(value) else value for value in series.tolist()], expected)
+        self.assertEqual(series.name, 'day')
+
+    def test_add(self):
+        for delta in (1, -3, timedelta(hours=5), timedelta(days=2, hours=15), -timedelta(hours=30)):
+            self.assertSeriesEqual(
+                self.series.bizdatim.add(self.policy, delta),
+                [self.policy.add(day, delta) for day in self.days],
+            )
+
+    def test_add_per_row(self):
+        deltas = [timedelta(hours=n % 50 - 25) for n in range(len(self.days))]
+        self.assertSeriesEqual(
+            self.series.bizdatim.add(self.policy, pandas.Series(deltas)),
+            [self.policy.add(day, delta) for day, delta in zip(self.days, deltas)],
+        )
+
+    def test_closest_biz_day(self):
+        self.assertSeriesEqual(
+            self.series.bizdatim.closest_biz_day(self.policy, forward=False),
+            [self.policy.closest_biz_day(day, forward=False) for day in self.days],
+        )
+
+    def test_biz_day_delta(self):
+        other = datetime(2011, 1, 4, 12, 0)
+        self.assertSeriesEqual(
+            self.series.bizdatim.biz_day_delta(self.policy, pandas.Timestamp(other)),
+            [self.policy.biz_day_delta(day, other) for day in self.days],
+        )
+
+    def test_missing_values(self):
+        series = pandas.Series([datetime(2011, 7, 1, 10, 0), None], name='day')
+        self.assertSeriesEqual(series.bizdatim.add(self.policy, 1), [datetime(2011, 7, 5, 8, 30), None])
+        self.assertSeriesEqual(series.bizdatim.biz_day_delta(self.policy, date(2011, 7, 5)), [1, None])
+
+    def test_index(self):
+        index = pandas.DatetimeIndex(self.days, name='day').tz_localize('Europe/Paris')
+        result = index.bizdatim.add(self.policy, 2)
+        self.assertIsInstance(result, pandas.DatetimeIndex)
+        self.assertEqual(
+            [day.replace(tzinfo=None) for day in result.tolist()],
+            [self.policy.add(day, 2) for day in self.days],
+        )
+        self.assertEqual(str(result.tz), 'Europe/Paris')
+
+    def test_offset(self):
+        offset = bizdatim_pandas.PolicyOffset(2, policy=self.policy, delta=timedelta(hours=7))
+        self.assertSeriesEqual(
+            self.series + offset,
+            [self.policy.add(day, timedelta(hours=14)) for day in self.days],
+        )
+        self.assertSeriesEqual(
+            self.series - offset,
+            [self.policy.add(day, -timedelta(hours=14)) for day in self.days],
+        )
+        self.assertEqual(
+            pandas.Timestamp(2011, 6, 30, 19, 30) + bizdatim_pandas.PolicyOffset(policy=self.policy),
+            pandas.Timestamp(2011, 7, 4, 19, 30),
+        )
+        self.assertTrue(offset.is_on_offset(pandas.Timestamp(2011, 6, 30, 19, 30)))
+        self.assertFalse(offset.is_on_offset(pandas.Timestamp(2011, 7, 1, 19, 30)))
+
+
+class TestFuzz(unittest.TestCase):
+
+    def test_reference(self):
+        reference = fuzz.Reference(weekends=(SAT, SUN), holidays=holidays, hours=(time(8, 30), time(20, 30)))
+        policy = Policy(weekends=(SAT, SUN), holidays=holidays, hours=(time(8, 30), time(20, 30)))
+        self.assertEqual(reference.add_days(date(2011, 6, 29), 22), policy.add_days(date(2011, 6, 29), 22))
+        self.assertEqual(reference.weekends_between(date(2011, 6, 3), date(2011, 6, 4)), 0)
+        self.assertEqual(reference.weekends_between(date(2011, 6, 5), date(2011, 6, 6)), 1)
+        self.assertEqual(reference.holidays_between(date(2011, 7, 1), date(2011, 8, 1)), 0)
+        self.assertEqual(reference.add_seconds(datetime(2011, 3, 3, 8, 30), 2 * 12 * 3600 + 3 * 3600),
+                         datetime(2011, 3, 7, 11, 30))
+
+    def test_engines(self):
+        mismatches, results = fuzz.run(policies=20, cases=3, seed='tests')
+        self.assertEqual(mismatches, [])
+        self.assertEqual(set(result['method'] for result in results), set(fuzz.CASES))
+        self.assertTrue(all(result['calls'] and result['reference_seconds'] for result in results))
+
+    def test_mismatches(self):
+        original = Policy.weekends_between
+        try:
+            # An engine counting the upper boundary is caught
+            Policy.weekends_between = lambda self, day1, day2: original(
+                self, day1 + timedelta(days=1), day2 + timedelta(days=1))
+            mismatches, results = fuzz.run(policies=5, cases=5, methods=['weekends_between'], engines=['plain'])
+        finally:
+            Policy.weekends_between = original
+        self.assertTrue(mismatches)
+        self.assertEqual(set(mismatch['method'] for mismatch in mismatches), {'weekends_between'})
+
+
 class TestNonWorkingHours(unittest.TestCase):
 
     def test_no_working_hours(self):
@@ -156,5 +1366,22 @@ class TestNonWorkingHours(unittest.TestCase):
         self.assertFalse(policy.is_not_in_business_hours(datetime(2011, 7, 1, 8, 30)))
 
 
+def _without_numpy(tests):
+    """Drops the examples of the *_many methods, which need numpy."""
+    for test in tests:
+        if not test.id().endswith('_many'):
+            yield test
+
+
+def load_tests(loader, tests, ignore):
+    """Runs the examples of the docstrings along with the test cases."""
+    examples = doctest.DocTestSuite(bizdatim)
+    tests.addTests(examples if numpy is not None else _without_numpy(examples))
+    tests.addTests(doctest.DocTestSuite(fuzz))
+    if pandas is not None:
+        tests.addTests(doctest.DocTestSuite(bizdatim_pandas))
+    return tests
+
+
 if __name__ == '__main__':
     unittest.main()
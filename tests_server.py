@@ -0,0 +1,133 @@
+"""Tests of bizdatim_server, which needs Python 3.7 or later."""
+
+import asyncio
+import json
+import os
+import tempfile
+import unittest
+from datetime import date, datetime, time, timedelta
+
+import bizdatim_server
+from bizdatim import Policy, SAT, SUN
+
+holidays = (
+    date(2010, 12, 27),  # Christmas Day
+    date(2010, 12, 28),  # Boxing Day
+    date(2011, 1, 3),    # New Year
+    date(2011, 2, 21),   # Family Day
+)
+
+
+class TestServer(unittest.TestCase):
+
+    def setUp(self):
+        self.policy = Policy(weekends=(SAT, SUN), holidays=holidays, hours=(time(8, 30), time(20, 30)))
+        self.policy.compile(date(2009, 1, 1), date(2012, 12, 31))
+        self.service = bizdatim_server.Service({'ca': self.policy})
+        self.requests = []
+        for n in range(60):
+            day = date(2010, 12, 20) + timedelta(days=n)
+            self.requests.append(('add', {'day': day.isoformat(), 'days': n % 7 - 3},
+                                  self.policy.add(day, n % 7 - 3).isoformat()))
+            self.requests.append(('delta', {'day1': day.isoformat(), 'day2': '2011-01-31'},
+                                  self.policy.biz_day_delta(day, date(2011, 1, 31))))
+            self.requests.append(('next', {'day': day.isoformat() + 'T10:15:00', 'forward': n % 2 == 0},
+                                  self.policy.closest_biz_day(datetime.combine(day, time(10, 15)), n % 2 == 0)
+                                  .isoformat()))
+
+    @staticmethod
+    async def post(reader, writer, path, body, close=False):
+        body = json.dumps(body).encode('utf-8')
+        writer.write(('POST %s HTTP/1.1\r\nContent-Length: %d\r\n%s\r\n' % (
+            path, len(body), 'Connection: close\r\n' if close else '')).encode('latin-1') + body)
+        status = int((await reader.readline()).split()[1])
+        headers = {}
+        while True:
+            line = (await reader.readline()).decode('latin-1').strip()
+            if not line:
+                break
+            name, _, value = line.partition(':')
+            headers[name.lower()] = value.strip()
+        return status, json.loads((await reader.readexactly(int(headers['content-length']))).decode('utf-8'))
+
+    def run_client(self, connect, client):
+        async def main():
+            server = await connect(self.service.handle)
+            try:
+                return await client(server)
+            finally:
+                server.close()
+                await server.wait_closed()
+        return asyncio.run(main())
+
+    def test_batches(self):
+        async def client(server):
+            port = server.sockets[0].getsockname()[1]
+
+            async def call(command, body):
+                reader, writer = await asyncio.open_connection('127.0.0.1', port)
+                try:
+                    return await self.post(reader, writer, '/ca/%s' % command, body, close=True)
+                finally:
+                    writer.close()
+                    await writer.wait_closed()
+
+            return await asyncio.gather(*[call(command, body) for command, body, expected in self.requests])
+
+        responses = self.run_client(lambda handle: asyncio.start_server(handle, '127.0.0.1', 0, backlog=1024), client)
+        self.assertEqual(responses, [(200, {'result': expected, 'version': 1})
+                                     for command, body, expected in self.requests])
+        batcher = self.service.batchers['ca']
+        self.assertEqual(batcher.requests, len(self.requests))
+        self.assertTrue(batcher.batches < batcher.requests)
+
+    @unittest.skipIf(not hasattr(asyncio, 'start_unix_server'), "Unix sockets are not available")
+    def test_unix_socket(self):
+        path = os.path.join(tempfile.mkdtemp(), 'bizdatim.sock')
+
+        async def client(server):
+            reader, writer = await asyncio.open_unix_connection(path)
+            try:
+                # The connection is kept alive between requests
+                responses = [await self.post(reader, writer, '/ca/%s' % command, body)
+                             for command, body, expected in self.requests[:6]]
+                responses.append(await self.post(reader, writer, '/paris/add', {}))
+                responses.append(await self.post(reader, writer, '/ca/add', {'day': '2011-13-01', 'days': 1},
+                                                 close=True))
+                return responses
+            finally:
+                writer.close()
+                await writer.wait_closed()
+
+        responses = self.run_client(lambda handle: asyncio.start_unix_server(handle, path), client)
+        self.assertEqual(responses[:6], [(200, {'result': expected, 'version': 1})
+                                         for command, body, expected in self.requests[:6]])
+        self.assertEqual([status for status, payload in responses[6:]], [404, 400])
+
+    def test_invalid_requests(self):
+        async def client(server):
+            reader, writer = await asyncio.open_connection('127.0.0.1', server.sockets[0].getsockname()[1])
+            try:
+                # Only JSON booleans tell the direction
+                responses = [await self.post(reader, writer, '/ca/next', {'day': '2011-07-01', 'forward': 'false'})]
+                responses.append(await self.post(reader, writer, '/ca/next', {'day': 'x' * 100000}))
+                return responses
+            finally:
+                writer.close()
+                await writer.wait_closed()
+
+        responses = self.run_client(lambda handle: asyncio.start_server(handle, '127.0.0.1', 0), client)
+        self.assertEqual([status for status, payload in responses], [400, 413])
+
+    def test_batcher(self):
+        batcher = bizdatim_server.Batcher(self.policy, window=0.01)
+
+        async def main():
+            return await asyncio.gather(*[batcher.submit('add', date(2011, 6, 29), n) for n in range(10)])
+
+        self.assertEqual(asyncio.run(main()), [(self.policy.add(date(2011, 6, 29), n), 1) for n in range(10)])
+        self.assertEqual((batcher.requests, batcher.batches), (10, 1))
+
+
+if __name__ == '__main__':
+    unittest.main()